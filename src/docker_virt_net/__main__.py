@@ -23,14 +23,25 @@ def main():
             print(f"{opt}\t->\t{default}")
         return 0
 
+    # Removals, resumptions and status queries rely on the recorded state: no need to parse the whole definition
+    if args.remove or args.status or args.resume:
+        net_name, net_conf = config_parser.net_name(args.net_definition)
+        if args.status:
+            network_instantiation.net_status(net_name)
+        elif args.resume:
+            network_instantiation.resume_network(net_name)
+        else:
+            network_instantiation.delete_net(net_name, net_conf)
+        return 0
+
     net_conf, net_graph = config_parser.parse_config(args.net_definition)
 
     if args.show != "NOSHOW":
         net_visualization.show_net(net_graph, args.show)
         return 0
 
-    if args.remove:
-        network_instantiation.delete_net(net_conf)
+    if args.reconcile:
+        network_instantiation.reconcile_network(net_conf, net_graph)
         return 0
 
     network_instantiation.instantiate_network(net_conf, net_graph)
@@ -1,4 +1,6 @@
-import logging
+import logging, heapq
+
+from .exceptions import InstError
 
 log = logging.getLogger(__name__)
 
@@ -7,59 +9,283 @@ private_ranges = [
     "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"
 ]
 
-next_subn_addr = {}
-assigned_addreses = {}
+# Netmasks for every prefix length: no need to rebuild them bit by bit
+masks = [(0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF for plen in range(33)]
 
-def request_ip(subnet, hname = None):
-    if subnet not in next_subn_addr:
-        next_subn_addr[subnet] = get_net_addr(subnet)
+class allocator:
+    """Hands out IPv4 addresses within subnets and keeps track of who holds them.
+
+    Addresses are handled as integers throughout: CIDR strings are only rendered
+    for callers (i.e. on their way to ip2_api). Within a subnet addresses are handed
+    out in order, reusing released ones (lowest first) before moving forward.
+    Subnets are keyed by their (network address, prefix length).
+
+    Node addresses are packed as `address << 6 | prefix length` to keep the
+    footprint of large deployments small.
+    """
+    def __init__(self):
+        # Per subnet: the highest address handed out plus a heap of released ones (lowest first)
+            # and a set for membership checks. Heap entries no longer in the set are stale and skipped.
+        self.cursors, self.released, self.free = {}, {}, {}
+        # Indexes: address -> node, node -> [packed addresses], subnet -> {nodes}
+        self.owners, self.nodes, self.members = {}, {}, {}
+
+    def request(self, net, plen, node = None):
+        """Returns the next free address within subnet `net/plen`, assigning it to `node`.
+
+        Raises:
+            InstError: If there are no addresses left within the subnet.
+        """
+        net &= masks[plen]
+        addr = self._pop_released((net, plen))
+        if addr == None:
+            addr = self.cursors.get((net, plen), net) + 1
+            brd = net | (~masks[plen] & 0xFFFFFFFF)
+            if addr > brd or (addr == brd and plen < 31):
+                raise InstError(f"There are no addresses left within {binary_to_addr(net)}/{plen}")
+            self.cursors[(net, plen)] = addr
+        if node != None:
+            self._assign(addr, plen, node)
+        return addr
+
+    def reserve(self, addr, plen, node = None):
+        """Marks an address handed out elsewhere (e.g. by a previous run) as taken."""
+        key = (addr & masks[plen], plen)
+        self.cursors[key] = max(self.cursors.get(key, key[0]), addr)
+        self.free.get(key, set()).discard(addr)
+        if node != None and self.owners.get(addr) != node:
+            self._detach(addr, plen)
+            self._assign(addr, plen, node)
+
+    def release(self, addr, plen):
+        """Returns an address to its subnet so that it can be handed out again.
+
+        Raises:
+            InstError: If the address isn't handed out (e.g. it's been released already).
+        """
+        key = (addr & masks[plen], plen)
+        if not key[0] < addr <= self.cursors.get(key, key[0]) or addr in self.free.get(key, set()):
+            raise InstError(f"Can't release {binary_to_addr(addr)}/{plen}: it isn't handed out")
+        self._detach(addr, plen)
+        self.free.setdefault(key, set()).add(addr)
+        heapq.heappush(self.released.setdefault(key, []), addr)
+
+    def _pop_released(self, key):
+        heap, free = self.released.get(key), self.free.get(key)
+        while heap:
+            addr = heapq.heappop(heap)
+            if addr in free:
+                free.discard(addr)
+                return addr
+        return None
 
-    next_subn_addr[subnet] += 1
+    def _detach(self, addr, plen):
+        node = self.owners.pop(addr, None)
+        if node != None:
+            self.nodes[node].remove(addr << 6 | plen)
+            if not self.nodes[node]:
+                del self.nodes[node]
+            self.members[(addr & masks[plen], plen)].discard(node)
 
-    a_addr = "{}/{}".format(
-        binary_to_addr(next_subn_addr[subnet]),
-        subnet.split('/')[1]
-    )
+    def _assign(self, addr, plen, node):
+        self.owners[addr] = node
+        self.nodes.setdefault(node, []).append(addr << 6 | plen)
+        self.members.setdefault((addr & masks[plen], plen), set()).add(node)
 
-    if hname:
-        if hname not in assigned_addreses:
-            assigned_addreses[hname] = [a_addr]
+    def addresses(self, node):
+        """Returns the (address, prefix length) tuples assigned to `node`, in assignment order."""
+        return [(packed >> 6, packed & 0x3F) for packed in self.nodes.get(node, [])]
+
+    def owner(self, addr):
+        return self.owners.get(addr)
+
+    def subnet_members(self, net, plen):
+        return self.members.get((net & masks[plen], plen), set())
+
+class buddy:
+    """Carves variable-size subnets out of an address pool following the buddy system.
+
+    Free blocks are kept per prefix length. A request is served by the smallest free
+    block that's large enough, splitting it in halves (buddies) until it fits; released
+    blocks are merged back with their buddy whenever it's free too. Small subnets thus
+    fill the holes left by aligning larger ones instead of wasting them.
+
+    Args:
+        net (int): The pool's network address.
+        plen (int): The pool's prefix length.
+    """
+    def __init__(self, net, plen):
+        self.net, self.plen = net & masks[plen], plen
+        # Per prefix length: a heap of free blocks (lowest first) and a set for membership
+            # checks. Heap entries no longer in the set are stale and skipped.
+        self.free_heaps = {plen: [self.net]}
+        self.free_sets = {plen: {self.net}}
+        self.allocated = {}
+
+    def request(self, plen):
+        """Returns the network address of a free `/plen` block within the pool.
+
+        Raises:
+            InstError: If there's no free block large enough.
+        """
+        for order in range(plen, self.plen - 1, -1):
+            block = self._pop_free(order)
+            if block != None:
+                break
         else:
-            assigned_addreses[hname].append(a_addr)
+            raise InstError(f"There's no room for a /{plen} subnet within {binary_to_addr(self.net)}/{self.plen}")
+
+        # Split the block, keeping the lower half and freeing the upper one
+        while order < plen:
+            order += 1
+            self._push_free(block | 1 << (32 - order), order)
+        self.allocated[block] = plen
+        return block
+
+    def release(self, net):
+        plen = self.allocated.pop(net, None)
+        if plen == None:
+            log.warning(f"Subnet {binary_to_addr(net)} wasn't allocated from {binary_to_addr(self.net)}/{self.plen}")
+            return
+        while plen > self.plen:
+            mate = net ^ 1 << (32 - plen)
+            if mate not in self.free_sets.get(plen, ()):
+                break
+            self.free_sets[plen].discard(mate)
+            net &= mate
+            plen -= 1
+        self._push_free(net, plen)
+
+    def _pop_free(self, plen):
+        heap, free = self.free_heaps.get(plen), self.free_sets.get(plen)
+        while heap:
+            block = heapq.heappop(heap)
+            if block in free:
+                free.discard(block)
+                return block
+        return None
+
+    def _push_free(self, block, plen):
+        heapq.heappush(self.free_heaps.setdefault(plen, []), block)
+        self.free_sets.setdefault(plen, set()).add(block)
+
+    def utilization(self):
+        """Returns how much of the pool is in use.
+
+        Returns:
+            dictionary: The pool's `size`, the addresses within `allocated` subnets, the
+                `usable` ones among those (i.e. excluding network and broadcast addresses)
+                and the `largest_free` prefix length that could still be served.
+        """
+        allocated = sum(2 ** (32 - plen) for plen in self.allocated.values())
+        usable = sum(2 ** (32 - plen) - (2 if plen < 31 else 0) for plen in self.allocated.values())
+        free = [plen for plen, blocks in self.free_sets.items() if blocks]
+        return {
+            "size": 2 ** (32 - self.plen), "allocated": allocated, "usable": usable,
+            "largest_free": min(free) if free else None
+        }
+
+_allocator = allocator()
+_pools = {}
+
+def reset():
+    """Forgets every assignment and subnet allocation."""
+    global _allocator
+    _allocator = allocator()
+    _pools.clear()
+
+def request_subnet(plen, pool = "10.0.0.0/8"):
+    """Allocates a `/plen` subnet from `pool` using the buddy system.
+
+    Args:
+        plen (int): The prefix length of the subnet.
+        pool (str, optional): The CIDR block subnets are carved out of.
+
+    Returns:
+        str: The allocated subnet in CIDR notation.
+
+    Raises:
+        InstError: If the pool has no room left for the subnet.
+    """
+    if pool not in _pools:
+        _pools[pool] = buddy(*parse_cidr(pool))
+    return to_cidr(_pools[pool].request(plen), plen)
+
+def release_subnet(subnet, pool = "10.0.0.0/8"):
+    if pool in _pools:
+        _pools[pool].release(parse_cidr(subnet)[0])
+
+def subnet_utilization():
+    """Returns every pool's utilization (check `buddy.utilization()`) and logs it."""
+    report = {}
+    for pool, alloc in _pools.items():
+        report[pool] = alloc.utilization()
+        log.info(
+            f"Pool {pool}: {len(alloc.allocated)} subnets take {report[pool]['allocated']} of " +
+            f"{report[pool]['size']} addresses ({100 * report[pool]['allocated'] / report[pool]['size']:.2f} %); " +
+            f"{report[pool]['usable']} are usable by nodes"
+        )
+    return report
+
+def request_ip(subnet, hname = None):
+    addr, plen = parse_cidr(subnet)
+    return to_cidr(_allocator.request(addr, plen, hname), plen)
+
+def release_ip(cidr):
+    _allocator.release(*parse_cidr(cidr))
+
+def restore(assignments):
+    """Marks previously handed out addresses as assigned.
+
+    Subsequent requests on the same subnets are served addresses above the highest
+    restored one.
+
+    Args:
+        assignments (dictionary): Node names mapped to their CIDR blocks.
+    """
+    for hname, addrs in assignments.items():
+        for addr in addrs:
+            _allocator.reserve(*parse_cidr(addr), hname)
+
+def assignments():
+    """Returns every node mapped to the CIDR blocks it's been handed."""
+    return {node: [to_cidr(addr, plen) for addr, plen in _allocator.addresses(node)] for node in _allocator.nodes}
+
+def owner(addr):
+    """Returns the node holding `addr` (in A.B.C.D format), if any."""
+    return _allocator.owner(addr_to_binary(addr))
+
+def parse_cidr(cidr):
+    addr, _, plen = cidr.partition('/')
+    return addr_to_binary(addr), int(plen) if plen else 32
 
-    return a_addr
+def to_cidr(addr, plen):
+    return f"{binary_to_addr(addr)}/{plen}"
 
 def addr_to_binary(addr):
-    bin_ip, loop_count = 0, 0
-    for x in reversed(addr.split('/')[0].split('.')):
-        bin_ip |= int(x) << loop_count * 8
-        loop_count += 1
-    return bin_ip
+    a, b, c, d = addr.split('/')[0].split('.')
+    return int(a) << 24 | int(b) << 16 | int(c) << 8 | int(d)
 
 def binary_to_addr(bin):
-    addr = ""
-    for i in range(3, -1, -1):
-        addr += str(bin >> 8 * i & 0xFF) + '.'
-    return addr[:len(addr) - 1]
+    return f"{bin >> 24 & 0xFF}.{bin >> 16 & 0xFF}.{bin >> 8 & 0xFF}.{bin & 0xFF}"
 
 def get_net_addr(subn):
-    mask = 0
-    for i in range(int(subn.split('/')[1])):
-        mask |= 0x1 << (31 - i)
-    return addr_to_binary(subn) & mask
+    addr, plen = parse_cidr(subn)
+    return addr & masks[plen]
 
 def get_brd_addr(subn):
-    mask = 0
-    for i in range(int(subn.split('/')[1])):
-        mask |= 0x1 << (31 - i)
-    return get_net_addr(subn) | ~mask
+    addr, plen = parse_cidr(subn)
+    return addr | (~masks[plen] & 0xFFFFFFFF)
 
 def name_2_ip(name, index = 0):
+    addrs = _allocator.addresses(name)
     try:
         if index >= 0:
-            return assigned_addreses[name][index].split('/')[0]
+            return binary_to_addr(addrs[index][0])
         elif index == -1:
-            return assigned_addreses[name]
+            if not addrs:
+                raise KeyError(name)
+            return [to_cidr(addr, plen) for addr, plen in addrs]
     except (KeyError, IndexError):
         log.error(f"Couldn't retrieve IP address with index {index} for {name}")
         return -1
@@ -22,11 +22,23 @@ def parse_args():
     parser = argparse.ArgumentParser(description = "Docker-based Network Virtualizer")
     parser.add_argument(
         "net_definition",
-        help = "JSON file containing the desired network's definition."
+        help = "JSON file containing the desired network's definition. When removing or querying a network, its name is enough."
     )
     parser.add_argument(
         "-r", "--remove", action = 'store_true',
-        help = "Remove the instances of elements found on <net_definition>."
+        help = "Remove the instances recorded for the network defined on <net_definition>."
+    )
+    parser.add_argument(
+        "--resume", action = 'store_true',
+        help = "Carry on with a deployment of the network defined on <net_definition> that failed midway."
+    )
+    parser.add_argument(
+        "--reconcile", action = 'store_true',
+        help = "Update a deployed network to match <net_definition>, only touching what changed."
+    )
+    parser.add_argument(
+        "--status", action = 'store_true',
+        help = "Show what has been recorded for the network defined on <net_definition>."
     )
     parser.add_argument(
         "-s", "--show", nargs = '?', default = "NOSHOW", const = "NOSTORE",
@@ -13,7 +13,14 @@ optional_confs = {
     "update_hosts": False,
     "host_image": "pcollado/d_host",
     "router_image": "pcollado/d_router",
-    "private_routing": True
+    "node_backends": {},
+    "node_commands": {},
+    "attachment_mode": "veth",
+    "private_routing": True,
+    "ip_backend": "iproute2",
+    "max_workers": 16,
+    "retries": 3,
+    "aggregate_routes": True
 }
 
 def parse_config(conf, schema = "net.schema"):
@@ -66,6 +73,24 @@ def load_conf(conf_path, schema = "net.schema"):
 
     return net_conf
 
+def net_name(definition):
+    """Figures out which network a command line argument refers to.
+
+    Args:
+        definition (str): Either the path to a network configuration or a network's name.
+
+    Returns:
+        tuple: The network's name and its configuration, if `definition` is a path.
+    """
+    if not pathlib.Path(definition).is_file():
+        return definition, None
+    try:
+        net_conf = load_conf(definition)
+    except ConfError as err:
+        log.critical(f"Error parsing the configuration: {err.cause}")
+        sys.exit(-1)
+    return net_conf['name'], net_conf
+
 def validate_subnet_addresses(conf):
     """Validates the CIDR addresses for every subnet.
 
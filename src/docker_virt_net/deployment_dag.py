@@ -0,0 +1,220 @@
+import logging, time, concurrent.futures
+
+from ip2_api.exceptions import IP2Error
+from .exceptions import DckError, InstError, StateError
+
+log = logging.getLogger(__name__)
+
+# What steps are expected to raise: anything else is a bug, but it's journaled all the same
+_step_errors = (InstError, DckError, IP2Error, StateError)
+
+def _cause(err):
+    return err.cause if isinstance(err, _step_errors) else f"{type(err).__name__}: {err}"
+
+class task:
+    """A single deployment step.
+
+    Args:
+        name (str): Unique identifier such as `veth:A-1:A_brd`.
+        kind (str): The kind of step (i.e. bridge, container, veth, address, route,
+            firewall or hosts).
+        fn (callable): What to run. It takes no arguments.
+        deps (list): Names of the tasks that must be done before this one starts.
+        undo (callable, optional): Cleans up after a failed or partial run so that
+            the task can be run again. It takes no arguments.
+        check (callable, optional): Returns whether what the task did is still in
+            place. It takes no arguments.
+    """
+    def __init__(self, name, kind, fn, deps, undo = None, check = None):
+        self.name, self.kind, self.fn, self.deps = name, kind, fn, list(deps)
+        self.undo, self.check = undo, check
+        self.start, self.end = None, None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end != None else 0
+
+class task_graph:
+    """A DAG of deployment steps run by a bounded pool of threads.
+
+    A task starts as soon as every one of its dependencies is done, so independent
+    work (e.g. starting a container and wiring up another node) overlaps.
+
+    Args:
+        journal (state.deployment_state, optional): Where to record each task
+            finishing or failing for good so that the deployment can be resumed.
+    """
+    def __init__(self, journal = None):
+        self.tasks = {}
+        self.journal = journal
+
+    def add(self, name, kind, fn, deps = [], undo = None, check = None):
+        if name in self.tasks:
+            raise InstError(f"Deployment step {name} has been defined more than once")
+        for dep in deps:
+            if dep not in self.tasks:
+                raise InstError(f"Deployment step {name} depends on undefined step {dep}")
+        self.tasks[name] = task(name, kind, fn, deps, undo, check)
+        return name
+
+    def revalidate(self, journal):
+        """Figures out which journaled tasks can be skipped when resuming.
+
+        A task is still done if it was journaled as such, what it did is still in place
+        and every one of its dependencies is still done too. Any other task that ran,
+        even partially, is undone so that it can be run again.
+
+        Args:
+            journal (dictionary): Task names mapped to their journaled status.
+
+        Returns:
+            set: The names of the tasks that are still done.
+        """
+        done = set()
+        # Tasks can only depend on previously added ones: insertion order is a topological order
+        for t in self.tasks.values():
+            if t.name not in journal:
+                continue
+            if journal[t.name] == "done" and all(dep in done for dep in t.deps) and (t.check == None or t.check()):
+                done.add(t.name)
+                continue
+            log.debug(f"Step {t.name} is to be run again")
+            self._undo(t)
+            if self.journal != None:
+                self.journal.forget_step(t.name)
+        return done
+
+    def run(self, max_workers, done = None, retries = 0, backoff = 1):
+        """Runs every task honouring its dependencies.
+
+        The first error stops new tasks from being started. Running tasks are waited
+        for so that the bookkeeping needed for undoing the deployment is complete by
+        the time the error is raised.
+
+        Args:
+            max_workers (int): The maximum number of tasks running at once.
+            done (set, optional): Names of tasks to consider done already.
+            retries (int, optional): How many times to retry a failing task. The task
+                is undone and we wait `backoff * 2 ** attempt` seconds before each retry.
+            backoff (float, optional): The base delay between retries in seconds.
+
+        Raises:
+            InstError: If any task failed. Unexpected exceptions are re-raised as they are
+                once running tasks are done and the failure has been journaled.
+        """
+        done = done or set()
+        dependants = {name: [] for name in self.tasks}
+        pending_deps = {}
+        for t in self.tasks.values():
+            pending_deps[t.name] = len([dep for dep in t.deps if dep not in done])
+            for dep in t.deps:
+                dependants[dep].append(t.name)
+
+        ready = [name for name, n in pending_deps.items() if n == 0 and name not in done]
+        running, errors = {}, []
+
+        log.debug(f"Running {len(self.tasks)} deployment steps, {max_workers} at a time")
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+            while ready or running:
+                while ready and not errors:
+                    name = ready.pop(0)
+                    running[executor.submit(self._run_task, self.tasks[name], retries, backoff)] = name
+
+                if not running:
+                    break
+
+                finished, _ = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    # Unexpected errors (e.g. a KeyError within a step) are journaled too: otherwise
+                        # there would be no trace of the step having run
+                    except Exception as err:
+                        errors.append((name, err))
+                        self._journal('step_failed', name, self.tasks[name].kind, _cause(err))
+                        continue
+                    self._journal('step_done', name, self.tasks[name].kind)
+                    for dependant in dependants[name]:
+                        pending_deps[dependant] -= 1
+                        if pending_deps[dependant] == 0:
+                            ready.append(dependant)
+
+        if errors:
+            for name, err in errors[1:]:
+                log.error(f"Additional error @ step {name}: {_cause(err)}")
+            name, err = errors[0]
+            if not isinstance(err, _step_errors):
+                log.error(f"Unexpected error @ step {name}")
+                raise err
+            raise InstError(f"{err.cause} @ step {name}")
+
+    def _run_task(self, t, retries = 0, backoff = 1):
+        log.debug(f"Running step {t.name}")
+        t.start = time.monotonic()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    t.fn()
+                    return
+                except (InstError, DckError, IP2Error) as err:
+                    if attempt == retries:
+                        raise err
+                    log.warning(f"Step {t.name} failed ({err.cause}): retrying in {backoff * 2 ** attempt} s")
+                    self._undo(t)
+                    time.sleep(backoff * 2 ** attempt)
+        finally:
+            t.end = time.monotonic()
+
+    def _undo(self, t):
+        if t.undo == None:
+            return
+        try:
+            t.undo()
+        except Exception as err:
+            log.debug(f"Couldn't undo step {t.name}: {_cause(err)}")
+
+    def _journal(self, method, *args):
+        # A journal we can't write to only hampers resuming: don't fail the deployment
+        if self.journal == None:
+            return
+        try:
+            getattr(self.journal, method)(*args)
+        except StateError as err:
+            log.warning(f"Couldn't journal step {args[0]}: {err.cause}")
+
+    def critical_path(self):
+        """Returns the chain of dependent tasks that took the longest to finish.
+
+        Returns:
+            list: The tasks on the critical path, in execution order.
+        """
+        finish, previous = {}, {}
+        # Tasks can only depend on previously added ones: insertion order is a topological order
+        for t in self.tasks.values():
+            slowest = max(t.deps, key = lambda dep: finish[dep], default = None)
+            finish[t.name] = t.duration + (finish[slowest] if slowest != None else 0)
+            previous[t.name] = slowest
+
+        if not finish:
+            return []
+
+        path, name = [], max(finish, key = finish.get)
+        while name != None:
+            path.append(self.tasks[name])
+            name = previous[name]
+        return path[::-1]
+
+    def report(self):
+        path = self.critical_path()
+        if not path or all(t.start == None for t in self.tasks.values()):
+            return
+        ran = [t for t in self.tasks.values() if t.start != None]
+        started = min(t.start for t in ran)
+        finished = max(t.end for t in ran if t.end != None)
+        log.info(
+            f"Ran {len(ran)} deployment steps in {finished - started:.2f} s; " +
+            f"the critical path takes {sum(t.duration for t in path):.2f} s over {len(path)} steps"
+        )
+        for t in path:
+            log.info(f"\t{t.duration:8.3f} s -> {t.name}")
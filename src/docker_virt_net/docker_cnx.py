@@ -1,4 +1,4 @@
-import docker, subprocess, logging, time
+import docker, subprocess, logging, time, io, re, tarfile, os
 
 # Supress urrlib3's log output below the WARNING level
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -31,10 +31,25 @@ dns_resolvers = [
     "1.1.1.1", "8.8.8.8"
 ]
 
-d_client = docker.from_env(timeout = 180)
+# Deployment steps run concurrently (check deployment_dag.task_graph.run()):
+    # let each worker keep its own connection to the engine.
+max_pool_size = 64
+
+d_client = None
+
+def _client():
+    # Connecting is deferred until the engine is needed: deployments made up of bare
+        # network namespaces alone (check netns_cnx.py) run without a docker engine.
+    global d_client
+    if d_client == None:
+        try:
+            d_client = docker.from_env(timeout = 180, max_pool_size = max_pool_size)
+        except docker.errors.DockerException as err:
+            raise DckError(f"Couldn't reach the docker engine - {err}")
+    return d_client
 
 def get_default_net_data():
-    for net in d_client.networks.list():
+    for net in _client().networks.list():
         if net.name == "bridge":
             try:
                 brd = net.attrs['Options']['com.docker.network.bridge.name']
@@ -51,7 +66,7 @@ def run_container(name, type, img):
     log.debug(f"Running container {name}: img = {img}; caps = {caps_map[type]}; sysctls = {sysctls_map[type]}")
 
     try:
-        d_client.containers.run(
+        _client().containers.run(
             img,
             name = name,
             hostname = name,
@@ -66,18 +81,43 @@ def run_container(name, type, img):
     except docker.errors.APIError as err:
         # We might've hit a timeout!
         time.sleep(5)
-        d_client.containers.get(name).start()
+        _client().containers.get(name).start()
+        raise DckError(f"Docker engine error - {err.explanation}")
+
+def container_running(name):
+    try:
+        return _client().containers.get(name).status == "running"
+    except docker.errors.NotFound:
+        return False
+    except docker.errors.APIError as err:
         raise DckError(f"Docker engine error - {err.explanation}")
 
-def remove_container(name):
+def remove_container(name, graceful = True):
+    """Removes a container and unlinks its network namespace.
+
+    Args:
+        name (str): The container's name.
+        graceful (bool, optional): Whether to stop the container (i.e. SIGTERM and
+            wait for the grace period) before removing it. Otherwise it's SIGKILLed
+            and removed through a single API call.
+    """
     log.debug(f"Removing container {name} and unlinking its netns")
     try:
-        c_inst = d_client.containers.get(name)
-        c_inst.stop()
-        c_inst.remove()
-        subprocess.run(['rm', '-f', f'/var/run/netns/{name}'])
+        c_inst = _client().containers.get(name)
+        if graceful:
+            c_inst.stop()
+            c_inst.remove()
+        else:
+            c_inst.remove(force = True)
     except docker.errors.APIError as err:
         raise DckError(f"Docker engine error - {err.explanation}")
+    unlink_netns(name)
+
+def unlink_netns(name):
+    try:
+        os.remove(f'/var/run/netns/{name}')
+    except FileNotFoundError:
+        pass
 
 def link_netns(name):
     log.debug(f"Linking {name}'s network namespace")
@@ -85,7 +125,7 @@ def link_netns(name):
         subprocess.run(
                 [
                     'ln', '-sf',
-                    f"/proc/{d_client.api.inspect_container(name)['State']['Pid']}/ns/net",
+                    f"/proc/{_client().api.inspect_container(name)['State']['Pid']}/ns/net",
                     f'/var/run/netns/{name}'
                 ],
                 check = True,
@@ -95,84 +135,213 @@ def link_netns(name):
     except subprocess.CalledProcessError:
         raise DckError(f"Error linking the netns of container {name}")
 
-def apply_fw_rules(name, fw_rules, chain = "FORWARD"):
-    if len(fw_rules) <= 0:
+# Firewall back ends:
+    # iptables -> A linear chain with one rule per (source, destination) pair, i.e. O(E) matching.
+    # nftables -> Pairs are stored in sets with concatenated keys, i.e. O(1) matching.
+fw_modes = ["iptables", "nftables"]
+
+def apply_fw_rules(name, fw_rules, chain = "FORWARD", nat_rules = [], mode = "iptables", replace = False):
+    """Installs a router's firewall through a single iptables-restore(8) or nft(8) run.
+
+    The policy, the filter rules and the NAT rules are compiled into one ruleset
+    which is uploaded to the container and committed atomically. With iptables, rules
+    already in place are kept (i.e. we run with --noflush). With nftables, rules live
+    in their own `dvnet` table which is replaced as a whole.
+
+    Args:
+        name (str): The router's name.
+        fw_rules (dictionary): The POLICY, ACCEPT and DROP rules as found in the configuration.
+        chain (str, optional): The filter table chain rules are added to.
+        nat_rules (list, optional): (target, destination) tuples for the POSTROUTING
+            chain of the nat table. A destination of None matches any traffic.
+        mode (str, optional): The firewall back end. One of `fw_modes`.
+        replace (bool, optional): Whether to flush the rules previously installed on
+            the tables we write to (i.e. run iptables-restore without --noflush).
+    """
+    if len(fw_rules) <= 0 and len(nat_rules) <= 0 and not replace:
         return
 
-    try:
-        r_cont = d_client.containers.get(name)
+    # Replacing a firewall with nothing leaves traffic flowing freely
+    if len(fw_rules) <= 0 and replace:
+        fw_rules = {"POLICY": "ACCEPT", "ACCEPT": [], "DROP": []}
 
-        log.debug(f"Setting {name}'s default FW policy to {fw_rules['POLICY'].upper()}")
+    if mode not in fw_modes:
+        raise DckError(f"FW conf error @ {name}: Unknown firewall mode {mode}")
 
-        try:
-            _exec(
-                r_cont,
-                ['iptables', '-P', chain, fw_rules['POLICY'].upper()]
-            )
-        except DckError:
-            raise DckError(f"Error setting policy {fw_rules['POLICY']}")
-
-        for target in ["ACCEPT", "DROP"]:
-            for rule in fw_rules[target]:
-                log.debug(f"Adding FW rule {rule} to {name}")
-                _add_fw_rule(r_cont, chain, target, rule[0], rule[1])
-                if rule[2]:
-                    _add_fw_rule(r_cont, chain, target, rule[1], rule[0])
-    except DckError as err:
-        raise DckError(f"FW conf error @ {name}: {err.cause}")
+    try:
+        r_cont = _client().containers.get(name)
     except docker.errors.APIError:
         raise DckError(f"FW conf error @ {name}: Couldn't get container")
 
-def _add_fw_rule(cont, chain, target, source, dest):
-    source, dest = name_2_ip(source), name_2_ip(dest)
+    try:
+        payload = _fw_payload(fw_rules, chain, nat_rules, mode, replace)
+        log.debug(f"Installing {len(payload[1])} FW rules on {name} through {mode}")
+        _restore_ruleset(r_cont, *payload)
+    except DckError as err:
+        raise DckError(f"FW conf error @ {name}: {err.cause}")
 
-    if source == -1:
-        raise DckError(f"Couldn't retrieve {source}'s IP")
+def _fw_payload(fw_rules, chain, nat_rules, mode, replace):
+    # The ruleset, its line descriptions, the command committing it, the file it's read
+        # from and how to find the failing line within the command's output.
+    if mode == "nftables":
+        ruleset, rule_descs = _compile_nft_ruleset(fw_rules, chain, nat_rules)
+        return ruleset, rule_descs, ['nft', '-f'], "dvnet.nft", r"dvnet\.nft:(\d+):"
+    ruleset, rule_descs = _compile_ruleset(fw_rules, chain, nat_rules, replace)
+    return ruleset, rule_descs, ['iptables-restore'] + ([] if replace else ['--noflush']), "dvnet.rules", r"line (\d+) failed"
 
-    if dest == -1:
-        raise DckError(f"Couldn't retrieve {dest}'s IP")
+def _expand_fw_rules(fw_rules):
+    # Duplicates (e.g. both directions of bidirectional rules) are only returned once
+    seen = set()
+    for target in ["ACCEPT", "DROP"]:
+        for rule in fw_rules[target]:
+            pairs = [(rule[0], rule[1]), (rule[1], rule[0])] if rule[2] else [(rule[0], rule[1])]
+            for source, dest in pairs:
+                if (source, dest, target) in seen:
+                    continue
+                seen.add((source, dest, target))
+                s_ip, d_ip = name_2_ip(source), name_2_ip(dest)
+                if s_ip == -1:
+                    raise DckError(f"Couldn't retrieve {source}'s IP")
+                if d_ip == -1:
+                    raise DckError(f"Couldn't retrieve {dest}'s IP")
+                yield target, s_ip, d_ip
 
-    try:
-        _exec(
-            cont,
-            [
-                'iptables', '-A', chain, '-j', target,
-                '-s', source, '-d', dest
+def _compile_ruleset(fw_rules, chain, nat_rules, replace = False):
+    # Each line of the payload is mapped to a description so that errors reported
+        # by iptables-restore(8) (i.e. `line N failed`) can point to the culprit.
+    lines, rule_descs = [], {}
+
+    if len(fw_rules) > 0:
+        lines += ["*filter", f":{chain} {fw_rules['POLICY'].upper()} [0:0]"]
+        rule_descs[len(lines)] = f"policy {fw_rules['POLICY']}"
+        for target, s_ip, d_ip in _expand_fw_rules(fw_rules):
+            lines.append(f"-A {chain} -s {s_ip} -d {d_ip} -j {target}")
+            rule_descs[len(lines)] = f"rule {s_ip}-{d_ip}-{target}; {chain} chain; filter table"
+        lines.append("COMMIT")
+
+    # An empty table flushes whatever NAT rules were installed before when replacing
+    if len(nat_rules) > 0 or replace:
+        lines.append("*nat")
+        for target, dest in nat_rules:
+            lines.append(f"-A POSTROUTING{f' -d {dest}' if dest else ''} -j {target}")
+            rule_descs[len(lines)] = f"rule any-{dest if dest else 'any'}-{target}; POSTROUTING chain; nat table"
+        lines.append("COMMIT")
+
+    return '\n'.join(lines) + '\n', rule_descs
+
+def _compile_nft_ruleset(fw_rules, chain, nat_rules):
+    # Same semantics as the iptables ruleset: ACCEPTed pairs are checked before
+        # DROPped ones and anything else hits the policy.
+    lines, rule_descs = [
+        # Creating the table first makes deleting it safe on the first run
+        "table ip dvnet",
+        "delete table ip dvnet",
+        "table ip dvnet {"
+    ], {}
+
+    if len(fw_rules) > 0:
+        elements = {"ACCEPT": [], "DROP": []}
+        for target, s_ip, d_ip in _expand_fw_rules(fw_rules):
+            elements[target].append((s_ip, d_ip))
+
+        for target, pairs in elements.items():
+            lines += [
+                f"\tset {target.lower()}_pairs {{",
+                "\t\ttype ipv4_addr . ipv4_addr"
             ]
-        )
-    except DckError as err:
-        raise DckError(f"{err.cause} @ rule {source}-{dest}-{target}; {chain} chain; filter table")
+            if pairs:
+                lines.append("\t\telements = {")
+                for i, (s_ip, d_ip) in enumerate(pairs):
+                    lines.append(f"\t\t\t{s_ip} . {d_ip}{',' if i < len(pairs) - 1 else ''}")
+                    rule_descs[len(lines)] = f"rule {s_ip}-{d_ip}-{target}; {chain} chain; dvnet table"
+                lines.append("\t\t}")
+            lines.append("\t}")
+
+        lines += [
+            f"\tchain {chain.lower()} {{",
+            f"\t\ttype filter hook {chain.lower()} priority 0; policy {fw_rules['POLICY'].lower()};"
+        ]
+        rule_descs[len(lines)] = f"policy {fw_rules['POLICY']}"
+        lines += [
+            "\t\tip saddr . ip daddr @accept_pairs accept",
+            "\t\tip saddr . ip daddr @drop_pairs drop",
+            "\t}"
+        ]
+
+    if len(nat_rules) > 0:
+        lines += [
+            "\tchain postrouting {",
+            "\t\ttype nat hook postrouting priority 100; policy accept;"
+        ]
+        for target, dest in nat_rules:
+            lines.append(f"\t\t{f'ip daddr {dest} ' if dest else ''}{target.lower()}")
+            rule_descs[len(lines)] = f"rule any-{dest if dest else 'any'}-{target}; postrouting chain; dvnet table"
+        lines.append("\t}")
+
+    lines.append("}")
+
+    return '\n'.join(lines) + '\n', rule_descs
 
-def _allow_traffic_to_ip(cont, dest):
+def _restore_ruleset(cont, ruleset, rule_descs, cmd, fname, failed_line, path = "/tmp"):
     try:
-        _exec(d_client.containers.get(cont), ['iptables', '-A', "FORWARD", '-j', "ACCEPT", '-d', dest])
+        cont.put_archive(path, _tar_file(fname, ruleset.encode()))
+        rc, output = cont.exec_run(cmd + [f'{path}/{fname}'])
+    except docker.errors.APIError as err:
+        raise DckError(err.explanation)
+
+    _check_restore(rc, output, rule_descs, failed_line)
+
+def _check_restore(rc, output, rule_descs, failed_line):
+    if rc != 0:
+        output = output.decode(errors = "replace") if output else ""
+        match = re.search(failed_line, output)
+        if match and int(match.group(1)) in rule_descs:
+            raise DckError(f"Non-zero return code @ {rule_descs[int(match.group(1))]}")
+        raise DckError(f"Non-zero return code - {output.strip()}")
+
+def _tar_file(fname, data):
+    tar_buff = io.BytesIO()
+    t_file = tarfile.open(mode = 'w', fileobj = tar_buff)
+    tinfo = tarfile.TarInfo()
+    tinfo.name = fname
+    tinfo.size = len(data)
+    t_file.addfile(tinfo, io.BytesIO(data))
+    t_file.close()
+    return tar_buff.getvalue()
+
+def _allow_traffic_to_ip(cont, dest, mode = "iptables"):
+    try:
+        _exec(_client().containers.get(cont), _allow_traffic_cmd(mode, '-d', dest))
     except DckError as err:
-        raise DckError(f"{err.cause} @ rule anywhere-{dest}-ACCEPT; FORWARD chain; filter table")
+        raise DckError(f"{err.cause} @ rule anywhere-{dest}-ACCEPT; {_allow_traffic_desc(mode)}")
 
-def _allow_traffic_from_ip(cont, src):
+def _allow_traffic_from_ip(cont, src, mode = "iptables"):
     try:
-        _exec(d_client.containers.get(cont), ['iptables', '-A', "FORWARD", '-j', "ACCEPT", '-s', src])
+        _exec(_client().containers.get(cont), _allow_traffic_cmd(mode, '-s', src))
     except DckError as err:
-        raise DckError(f"{err.cause} @ rule {src}-anywhere-ACCEPT; FORWARD chain; filter table")
+        raise DckError(f"{err.cause} @ rule {src}-anywhere-ACCEPT; {_allow_traffic_desc(mode)}")
 
-def add_nat_rule(cont, target, dest = None):
-    cont = d_client.containers.get(cont)
-    args = [
-        'iptables', '-t', 'nat', '-A', 'POSTROUTING',
-        '-j', target, '-d', dest
-    ]
+def _allow_traffic_cmd(mode, match, addr):
+    # An iptables ACCEPT can't override the verdicts of the dvnet table apply_fw_rules() installs
+        # through nftables: the rule goes at the top of its forward chain instead. The table and
+        # chain are declared (without a policy, so an existing one is kept) in case there's no firewall.
+    if mode == "nftables":
+        return ['nft',
+            "add table ip dvnet ; " +
+            "add chain ip dvnet forward { type filter hook forward priority 0 ; } ; " +
+            f"insert rule ip dvnet forward ip {'daddr' if match == '-d' else 'saddr'} {addr} accept"
+        ]
+    return ['iptables', '-A', "FORWARD", '-j', "ACCEPT", match, addr]
 
-    if dest == None:
-        args = args[:-2]
+def _allow_traffic_desc(mode):
+    return "forward chain; dvnet table" if mode == "nftables" else "FORWARD chain; filter table"
 
-    try:
-        _exec(cont, args)
-    except DckError as err:
-        raise DckError(f"{err.cause} @ rule any-{dest if dest else 'any'}-{target}; POSTROUTING chain; nat table")
+def add_nat_rule(cont, target, dest = None):
+    apply_fw_rules(cont, {}, nat_rules = [(target, dest)])
 
 def append_file_to_file(name, src, dst):
     try:
-        d_client.containers.get(name).exec_run(
+        _client().containers.get(name).exec_run(
             f"bash -c 'cat {src} >> {dst}'"
         )
     except docker.errors.APIError as err:
@@ -180,7 +349,7 @@ def append_file_to_file(name, src, dst):
 
 def upload_file(name, path, data):
     try:
-        d_client.containers.get(name).put_archive(path, data)
+        _client().containers.get(name).put_archive(path, data)
     except docker.errors.APIError as err:
         raise DckError(err.explanation)
 
@@ -21,3 +21,11 @@ class DckError(Exception):
 
     def __str__(self):
         return self.cause
+
+class StateError(Exception):
+    """Exception representing an error accessing the state recorded for a deployment."""
+    def __init__(self, cause):
+        self.cause = cause
+
+    def __str__(self):
+        return self.cause
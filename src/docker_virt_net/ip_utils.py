@@ -1,3 +1,5 @@
+from .addr_manager import masks
+
 def addr_to_binary(addr):
     """Returns an integer equivalent for an IPv4 address.
 
@@ -22,10 +24,7 @@ def get_net_addr(subn):
         Returns:
             int: The CIDR's block network address.
     """
-    mask = 0
-    for i in range(int(subn.split('/')[1])):
-        mask |= 0x1 << (31 - i)
-    return addr_to_binary(subn) & mask
+    return addr_to_binary(subn) & masks[int(subn.split('/')[1])]
 
 def get_brd_addr(subn):
     """Returns the broadcast address for an IPv4 CIDR block.
@@ -36,7 +35,4 @@ def get_brd_addr(subn):
         Returns:
             int: The CIDR's block broadcast address.
     """
-    mask = 0
-    for i in range(int(subn.split('/')[1])):
-        mask |= 0x1 << (31 - i)
-    return get_net_addr(subn) | ~mask
+    return get_net_addr(subn) | (~masks[int(subn.split('/')[1])] & 0xFFFFFFFF)
@@ -0,0 +1,178 @@
+import subprocess, logging, os, io, shutil, signal, shlex, tarfile, tempfile, pathlib
+
+from . import docker_cnx as dx
+from .exceptions import DckError
+
+log = logging.getLogger(__name__)
+
+# Nodes can live in bare network namespaces instead of containers: there's no image to
+    # pull nor engine to go through, so they're much cheaper to create and tear down. On
+    # the other hand there's no filesystem, process or user isolation: they see the host.
+    # Functions take the same arguments as their docker_cnx counterparts.
+
+# Nodes are recorded along their image (check state.py): bare namespaces are recorded as
+    # `netns` or `netns:<command>` so that reconciling notices a change of backend.
+image_prefix = "netns"
+
+# `ip netns exec` bind mounts every file under /etc/netns/<name> over its /etc counterpart,
+    # which must exist. Files uploaded to a node are kept there if they overlay one of the
+    # host's; they're kept under root_dir/<name> otherwise.
+root_dir = "/var/lib/dvnet/netns"
+
+def image(cmd = None):
+    """Returns the image recorded for a bare namespace node running `cmd`, if any."""
+    return image_prefix if not cmd else f"{image_prefix}:{cmd}"
+
+def is_image(img):
+    return img != None and (img == image_prefix or img.startswith(f"{image_prefix}:"))
+
+def command(img):
+    return img.partition(':')[2] or None
+
+def run_container(name, type, cmd = None):
+    """Creates a bare network namespace standing in for a container.
+
+    The namespace gets the same sysctls a container of the same type would (check
+    docker_cnx.sysctls_map) and its loopback interface is brought up.
+
+    Args:
+        name (str): The node's name, which the namespace is named after.
+        type (int): The node's type (check docker_cnx.types).
+        cmd (str, optional): A command to leave running within the namespace, just like
+            a container's entrypoint. Its output is discarded.
+    """
+    log.debug(f"Creating netns {name}: sysctls = {dx.sysctls_map[type]}; cmd = {cmd}")
+    _run(['ip', 'netns', 'add', name], f"Error creating netns {name}")
+    _run(['ip', '-n', name, 'link', 'set', 'lo', 'up'], f"Error activating lo @ netns {name}")
+    _run(
+        ['ip', 'netns', 'exec', name, 'sysctl', '-w'] + [f"{key}={value}" for key, value in dx.sysctls_map[type].items()],
+        f"Error writing sysctls @ netns {name}"
+    )
+
+    if cmd:
+        try:
+            subprocess.Popen(
+                ['ip', 'netns', 'exec', name] + shlex.split(cmd),
+                stdin = subprocess.DEVNULL,
+                stdout = subprocess.DEVNULL,
+                stderr = subprocess.DEVNULL,
+                start_new_session = True
+            )
+        except OSError as err:
+            raise DckError(f"Error running `{cmd}` @ netns {name}: {err.strerror}")
+
+def container_running(name):
+    # Namespaces created by ip(8) are bind mounts whereas containers' are symlinks (check docker_cnx.link_netns())
+    return os.path.ismount(f'/var/run/netns/{name}')
+
+def remove_container(name, graceful = True):
+    """Kills every process within a namespace and deletes it along with its uploaded files.
+
+    Args:
+        name (str): The node's name.
+        graceful (bool, optional): Whether to SIGTERM processes instead of SIGKILLing them.
+    """
+    log.debug(f"Removing netns {name}")
+    pids = subprocess.run(['ip', 'netns', 'pids', name], capture_output = True, text = True).stdout.split()
+    for pid in pids:
+        try:
+            os.kill(int(pid), signal.SIGTERM if graceful else signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    _run(['ip', 'netns', 'delete', name], f"Error deleting netns {name}")
+    shutil.rmtree(f"/etc/netns/{name}", ignore_errors = True)
+    shutil.rmtree(os.path.join(root_dir, name), ignore_errors = True)
+
+def link_netns(name):
+    # The namespace is already where iproute2 looks for it
+    pass
+
+def exec_run(name, args):
+    """Runs a command within a node's namespace.
+
+    Returns:
+        tuple: The command's return code and its (merged) output, as docker's exec_run() does.
+    """
+    try:
+        res = subprocess.run(
+            ['ip', 'netns', 'exec', name] + args,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT
+        )
+    except OSError as err:
+        raise DckError(err.strerror)
+    return res.returncode, res.stdout
+
+def apply_fw_rules(name, fw_rules, chain = "FORWARD", nat_rules = [], mode = "iptables", replace = False):
+    """Installs a router's firewall. Check docker_cnx.apply_fw_rules()."""
+    if len(fw_rules) <= 0 and len(nat_rules) <= 0 and not replace:
+        return
+
+    if len(fw_rules) <= 0 and replace:
+        fw_rules = {"POLICY": "ACCEPT", "ACCEPT": [], "DROP": []}
+
+    if mode not in dx.fw_modes:
+        raise DckError(f"FW conf error @ {name}: Unknown firewall mode {mode}")
+
+    try:
+        ruleset, rule_descs, cmd, fname, failed_line = dx._fw_payload(fw_rules, chain, nat_rules, mode, replace)
+        log.debug(f"Installing {len(rule_descs)} FW rules on {name} through {mode}")
+        # The file is read by name so that errors point to it just like within containers
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, fname)
+            pathlib.Path(path).write_text(ruleset)
+            rc, output = exec_run(name, cmd + [path])
+        dx._check_restore(rc, output, rule_descs, failed_line)
+    except DckError as err:
+        raise DckError(f"FW conf error @ {name}: {err.cause}")
+
+def _allow_traffic_to_ip(cont, dest, mode = "iptables"):
+    if exec_run(cont, dx._allow_traffic_cmd(mode, '-d', dest))[0] != 0:
+        raise DckError(f"Non-zero return code @ rule anywhere-{dest}-ACCEPT; {dx._allow_traffic_desc(mode)}")
+
+def _allow_traffic_from_ip(cont, src, mode = "iptables"):
+    if exec_run(cont, dx._allow_traffic_cmd(mode, '-s', src))[0] != 0:
+        raise DckError(f"Non-zero return code @ rule {src}-anywhere-ACCEPT; {dx._allow_traffic_desc(mode)}")
+
+def add_nat_rule(cont, target, dest = None):
+    apply_fw_rules(cont, {}, nat_rules = [(target, dest)])
+
+def node_path(name, path):
+    """Returns where a node's `path` lives on the host's filesystem."""
+    path = os.path.normpath(path)
+    if path.startswith("/etc/") and os.path.isfile(path):
+        return os.path.join(f"/etc/netns/{name}", os.path.relpath(path, "/etc"))
+    return os.path.join(root_dir, name, os.path.relpath(path, "/"))
+
+def append_file_to_file(name, src, dst):
+    src_path, dst_path = node_path(name, src), node_path(name, dst)
+    try:
+        os.makedirs(os.path.dirname(dst_path), exist_ok = True)
+        # Files overlaying the host's (e.g. /etc/hosts) start off as a copy of them
+        if not os.path.exists(dst_path) and dst_path.startswith("/etc/netns/"):
+            shutil.copyfile(dst, dst_path)
+        with open(src_path, 'rb') as s_file, open(dst_path, 'ab') as d_file:
+            shutil.copyfileobj(s_file, d_file)
+    except OSError as err:
+        raise DckError(f"Couldn't append {src} to {dst} @ netns {name}: {err.strerror}")
+
+def upload_file(name, path, data):
+    try:
+        with tarfile.open(mode = 'r', fileobj = io.BytesIO(data)) as t_file:
+            for member in t_file.getmembers():
+                if not member.isfile():
+                    continue
+                dest = node_path(name, os.path.join(path, member.name))
+                os.makedirs(os.path.dirname(dest), exist_ok = True)
+                with t_file.extractfile(member) as s_file, open(dest, 'wb') as d_file:
+                    shutil.copyfileobj(s_file, d_file)
+    except (OSError, tarfile.TarError) as err:
+        raise DckError(f"Couldn't upload files to {path} @ netns {name}: {err}")
+
+def _run(args, err_msg):
+    try:
+        subprocess.run(args, check = True, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    except subprocess.CalledProcessError as err:
+        raise DckError(f"{err_msg} - {err.stderr.decode(errors = 'replace').strip()}")
+    except OSError as err:
+        raise DckError(f"{err_msg} - {err.strerror}")
@@ -1,190 +1,738 @@
-import sys, logging, json, tarfile, io
+import sys, os, logging, tarfile, io, functools, concurrent.futures, time, collections, ipaddress
 
-import networkx
-
-from .addr_manager import request_ip, name_2_ip, get_net_addr
+from .addr_manager import request_ip, get_net_addr, masks
 
 import ip2_api.link as iplink
 import ip2_api.addr as ipaddr
 import ip2_api.route as iproute
 import ip2_api.utils as iputils
+import ip2_api.batch as ipbatch
 from ip2_api.exceptions import IP2Error, UtilError
 
 from . import docker_cnx as dx
+from . import netns_cnx as nns
+from . import deployment_dag
+from . import state
+from . import config_parser
 
-from .exceptions import DckError, InstError
+from .exceptions import DckError, InstError, StateError
 from docker_virt_net import addr_manager
 
 log = logging.getLogger(__name__)
 
-existing_instances = {
-    'bridges': [],
-    'containers': []
-}
+# The persistent record (check state.py) of the deployment in progress, if any
+current_state = None
 
 def instantiate_network(conf, net_graph):
+    try:
+        _open_state(conf['name'], "docker_virt_net", conf)
+    except StateError as err:
+        log.critical(f"Error instantiating the net: {err.cause}")
+        sys.exit(-1)
+
     try:
         log.info("Setting up the system")
-        _system_setup()
-        log.info("Creating subnets...")
-        _instantiate_subnets(conf)
-        log.info("Creating routers...")
-        _instantiate_routers(conf, net_graph)
-        if conf['private_routing']:
-            log.info("Routing the private network...")
-            _private_routing(conf, net_graph)
-        if conf['internet_access']:
-            log.info("Routing the network towards the Internet...")
-            _public_routing(conf, net_graph)
-        if conf['update_hosts']:
-            log.info("Adding entries to /etc/hosts at each node...")
-            _update_hosts_files()
+        _system_setup(conf['ip_backend'])
+        log.info("Compiling the deployment...")
+        deployment = _compile_deployment(conf, net_graph)
+        deployment.journal = current_state
+        _record('add_addresses', addr_manager.assignments())
+        log.info(f"Deploying {len(deployment.tasks)} steps ({conf['max_workers']} at a time)...")
+        deployment.run(conf['max_workers'], retries = conf['retries'])
+        deployment.report()
+        _record('set_meta', 'complete', True)
+        _close_state()
         log.info(f"Network '{conf['name']}' is ready to go!")
-    except (InstError, DckError, IP2Error) as err:
+    except (InstError, DckError, IP2Error, StateError) as err:
+        # Completed steps are journaled: keep them around instead of rolling everything back
         log.critical(f"Error instantiating the net: {err.cause}")
-        log.debug("Cleaning what we had...")
-        try:
-            _undo_deployment(existing_instances)
-        except (IP2Error, DckError) as err:
-            log.critical(f"Error undoing the deployment: {err.cause}.")
-            log.critical("Try to manually remove containers and bridges left behind...")
+        log.critical(f"Pick up where we left off with `--resume {conf['name']}` or clean up with `--remove {conf['name']}`")
+        _close_state()
+        sys.exit(-1)
+
+def resume_network(name):
+    """Carries on with a deployment that failed midway.
+
+    The deployment is compiled again from the recorded configuration. Journaled steps
+    whose work is still in place are skipped; every other one (i.e. failed, pending
+    or done but since gone) is cleaned up and run again.
+
+    Args:
+        name (str): The network's name.
+    """
+    global current_state
+    try:
+        current_state = state.load(name)
+        conf = current_state.get_meta('conf')
+        if conf == None:
+            raise InstError(f"Network '{name}' was not deployed by docker_virt_net")
+        if current_state.get_meta('complete', False):
+            log.info(f"Network '{name}' was fully deployed already: there's nothing to resume")
+            _close_state()
+            return
+
+        log.info("Setting up the system")
+        _system_setup(conf['ip_backend'])
+        log.info("Compiling the deployment...")
+        deployment = _compile_deployment(conf, config_parser.build_graph(conf))
+        deployment.journal = current_state
+
+        # Addresses are handed out deterministically: a mismatch means the recorded state can't be trusted
+        recorded = current_state.snapshot()['addresses']
+        for node, addrs in recorded.items():
+            if sorted(addrs) != sorted(addr_manager.assignments().get(node, [])):
+                raise InstError(f"Addresses recorded for {node} ({addrs}) don't match the configuration")
+
+        done = deployment.revalidate(current_state.journal())
+        log.info(f"Found {len(done)} of {len(deployment.tasks)} steps in place: resuming the rest...")
+        deployment.run(conf['max_workers'], done, retries = conf['retries'])
+        deployment.report()
+        _record('set_meta', 'complete', True)
+        _close_state()
+        log.info(f"Network '{name}' is ready to go!")
+    except (InstError, DckError, IP2Error, StateError) as err:
+        log.critical(f"Error resuming the net: {err.cause}")
+        log.critical("What's been done so far is recorded: fix the problem and resume again...")
+        _close_state()
         sys.exit(-1)
 
-def _system_setup():
+def _open_state(name, tool, conf = None):
+    global current_state
+    current_state = state.create(name, tool, conf)
+
+def _close_state(drop = False):
+    global current_state
+    if current_state == None:
+        return
+    if drop:
+        current_state.drop()
+    else:
+        current_state.close()
+    current_state = None
+
+def _record(method, *args):
+    if current_state != None:
+        getattr(current_state, method)(*args)
+
+def _record_flushed(method, *args):
+    # Within an ip2_api batch nothing's there until it's flushed (check ip2_api.batch.after_flush())
+    ipbatch.after_flush(functools.partial(_record, method, *args))
+
+def _system_setup(ip_backend = "iproute2"):
     try:
+        iputils.use_backend(ip_backend)
         iputils.alter_ipv4_forwarding()
         iputils.alter_brd_iptables_calls()
         iputils.create_netns_dir()
     except UtilError as err:
         raise InstError(err.cause)
 
-def _instantiate_subnets(conf):
+def _compile_deployment(conf, net_graph, live = None):
+    """Turns a network configuration into a DAG of deployment steps.
+
+    Every address is handed out here, before anything is run, so that assignments
+    don't depend on the order in which steps finish: hosts go first and routers
+    follow, as always.
+
+    Args:
+        conf (dictionary): The network configuration.
+        net_graph (networkx.Graph): The graph built from `conf`.
+        live (dictionary, optional): What's already deployed and is to be kept, as
+            returned by _diff_deployment(). Only the missing steps are compiled then.
+
+    Returns:
+        deployment_dag.task_graph: The steps instantiating the network.
+    """
+    dag = deployment_dag.task_graph()
+    kept = live if live != None else {'containers': set(), 'bridges': set(), 'attachments': {}, 'routes': {}}
+
+    for subnet in conf['subnets'].keys():
+        if subnet + "_brd" not in kept['bridges']:
+            dag.add(
+                f"bridge:{subnet}_brd", "bridge", functools.partial(_create_bridge, subnet + "_brd"),
+                undo = functools.partial(_remove_bridge, subnet + "_brd"),
+                check = _checked(iplink.bridge.exists, subnet + "_brd")
+            )
+
+    nodes, desired = [], _desired_nodes(conf)
+    for name, (type, img, attachments) in desired.items():
+        nodes.append((
+            name, type, img,
+            [(bridge, _attachment_ip(name, bridge, subnet_addr, kept)) for bridge, subnet_addr in attachments]
+        ))
+
+    # Routers always attach through veths: hosts might hang from their subnet's bridge instead
+    sublink = attachment_modes.get(conf.get('attachment_mode', "veth"))
+
+    addr_steps = {}
+    for name, type, img, attachments in nodes:
+        if name not in kept['containers']:
+            dag.add(
+                f"container:{name}", "container", functools.partial(_create_node, name, type, img),
+                undo = functools.partial(_remove_node, name),
+                check = _checked(_node_exists, name)
+            )
+        addr_steps[name] = []
+        for bridge, cidr_block in attachments:
+            if (name, bridge) in kept['attachments']:
+                continue
+            veth = dag.add(
+                f"veth:{name}:{bridge}", "veth",
+                functools.partial(_attach_node, name, bridge, sublink) if sublink != None and type == dx.types.host
+                    else functools.partial(_connect_node, name, bridge),
+                _deps(dag, f"container:{name}", f"bridge:{bridge}"),
+                undo = functools.partial(_disconnect_node, name, bridge),
+                check = _checked(iplink.veth.exists, _veth_names(name, bridge)[0], name)
+            )
+            addr_steps[name].append(dag.add(
+                f"address:{name}:{bridge}", "address",
+                functools.partial(ipaddr.assign, _veth_names(name, bridge)[0], cidr_block, name),
+                [veth]
+            ))
+
+    route_tables = {name: [] for name, _, _, _ in nodes}
+    nat_rules = {}
+    if conf['internet_access']:
+        nat_rules = _compile_uplink(dag, conf, addr_steps, route_tables, kept)
+        if not nat_rules:
+            # The first router would have nowhere to send traffic: it'd be black-holed
+            log.warning("There's no uplink to the internet: leaving default routes out")
+
+    # Each router's policy, filter and NAT rules go in a single iptables-restore(8) payload
+    for router, config in conf['routers'].items():
+        replace = router in kept['containers']
+        if replace and not _firewall_changed(router, conf, nat_rules, live):
+            continue
+        if len(config['fw_rules']) > 0 or router in nat_rules or replace:
+            dag.add(
+                f"firewall:{router}", "firewall",
+                functools.partial(
+                    _cnx(router, desired[router][1]).apply_fw_rules, router, config['fw_rules'],
+                    nat_rules = nat_rules.get(router, []), replace = replace
+                ),
+                _deps(dag, f"container:{router}")
+            )
+
+    attach_ips = {
+        (name, bridge): cidr_block.split('/')[0] for name, _, _, attachments in nodes for bridge, cidr_block in attachments
+    }
+    _merge_route_tables(route_tables, _routing_tables(conf, net_graph, attach_ips, default_route = bool(nat_rules)))
+    if conf['aggregate_routes']:
+        # Nodes sharing a subnet tend to share their whole table too
+        summaries = {}
+        for node, table in route_tables.items():
+            key = tuple(table)
+            if key not in summaries:
+                summaries[key] = _summarize_route_table(table)
+            route_tables[node] = summaries[key]
+
+    for node, table in route_tables.items():
+        if node in kept['containers']:
+            recorded = kept['routes'].get(node, {})
+            # Routes go away along with the interfaces they go through: remade ones need them back
+            if recorded == dict(table) and node in kept['stable']:
+                continue
+            dag.add(
+                f"route:{node}", "route",
+                functools.partial(
+                    _update_route_table, node, table,
+                    [(dest, gw_ip) for dest, gw_ip in recorded.items() if dest not in dict(table)]
+                ),
+                addr_steps[node]
+            )
+        elif table:
+            dag.add(
+                f"route:{node}", "route",
+                functools.partial(_apply_route_table, node, table),
+                addr_steps[node]
+            )
+
+    if conf['update_hosts']:
+        tar_data = _hosts_file_tar()
+        for name, _, _, _ in nodes:
+            # Appending to the /etc/hosts of existing containers would duplicate entries
+            if name in kept['containers']:
+                continue
+            dag.add(
+                f"hosts:{name}", "hosts",
+                functools.partial(_update_hosts_file, name, tar_data),
+                [f"container:{name}"]
+            )
+
+    return dag
+
+def _desired_nodes(conf):
+    # Nodes mapped to their type, image and the (bridge, subnet address) tuples they're attached to
+    nodes = {}
+    for subnet, config in conf['subnets'].items():
+        for host in config['hosts']:
+            nodes[host] = (dx.types.host, _node_image(conf, "host"), [(subnet + "_brd", config['address'])])
+    for router, config in conf['routers'].items():
+        nodes[router] = (
+            dx.types.router, _node_image(conf, "router"),
+            [(subnet + "_brd", conf['subnets'][subnet]['address']) for subnet in config['subnets']]
+        )
+    return nodes
+
+def _node_image(conf, type):
+    # Configurations recorded by older versions know nothing about backends
+    if conf.get('node_backends', {}).get(type, "docker") == "netns":
+        return nns.image(conf.get('node_commands', {}).get(type))
+    return conf[f'{type}_image']
+
+def _cnx(name, img = None):
+    """Returns the module handling a node: docker_cnx for containers, netns_cnx for bare namespaces.
+
+    Args:
+        name (str): The node's name.
+        img (str, optional): The node's image. If missing, whatever's deployed is looked at.
+    """
+    if img != None:
+        return nns if nns.is_image(img) else dx
+    return nns if nns.container_running(name) else dx
+
+def _attachment_ip(node, bridge, subnet_addr, kept):
+    if (node, bridge) in kept['attachments']:
+        return kept['attachments'][(node, bridge)]
+    return request_ip(subnet_addr, hname = node)
+
+def _deps(dag, *names):
+    # Steps for what's already deployed are not compiled: there's nothing to wait for
+    return [name for name in names if name in dag.tasks]
+
+def _uplink_data(conf):
     try:
-        for subnet, config in conf['subnets'].items():
-            log.debug(f"Instantiating subnet {subnet}")
-            _create_bridge(subnet + "_brd")
-
-            for host in config['hosts']:
-                log.debug(f"Instantiating host {host}")
-                _create_node(host, dx.types.host, conf['host_image'])
-                host_iface, _ = _connect_node(host, subnet + "_brd")
-                ipaddr.assign(
-                    host_iface,
-                    request_ip(config['address'], hname = host),
-                    netns = host
-                )
-    except (IP2Error, DckError) as err:
-        raise InstError(err.cause)
-
-def _instantiate_routers(conf, net_graph):
+        return dx.get_default_net_data()
+    except DckError as err:
+        log.warning(f"Couldn't configure outward internet access: {err.cause}")
+        return None
+
+def _compile_uplink(dag, conf, addr_steps, route_tables, kept):
+    uplink = _uplink_data(conf)
+    if uplink == None:
+        return {}
+    d_brd, d_gw, d_subnet = uplink
+
+    first_router = list(conf['routers'].keys())[0]
+    if (first_router, d_brd) not in kept['attachments']:
+        addr_manager.request_ip(d_subnet)
+        r_ip = addr_manager.request_ip(d_subnet, first_router)
+
+        dag.add(
+            f"bridge:{d_brd}", "bridge", functools.partial(iplink.bridge.activate, d_brd),
+            check = _checked(iplink.bridge.exists, d_brd)
+        )
+        veth = dag.add(
+            f"veth:{first_router}:{d_brd}", "veth",
+            functools.partial(_connect_node, first_router, d_brd),
+            _deps(dag, f"container:{first_router}", f"bridge:{d_brd}"),
+            undo = functools.partial(_disconnect_node, first_router, d_brd),
+            check = _checked(iplink.veth.exists, _veth_names(first_router, d_brd)[0], first_router)
+        )
+        addr_steps[first_router].append(dag.add(
+            f"address:{first_router}:{d_brd}", "address",
+            functools.partial(ipaddr.assign, _veth_names(first_router, d_brd)[0], r_ip, first_router),
+            [veth]
+        ))
+    route_tables[first_router].append(('default', d_gw))
+
+    return {first_router: [("ACCEPT", range) for range in addr_manager.private_ranges] + [("MASQUERADE", None)]}
+
+def _firewall_changed(router, conf, nat_rules, live):
+    prev_conf = live['conf']
+    prev_rules = prev_conf.get('routers', {}).get(router, {}).get('fw_rules', {})
+    if prev_rules != conf['routers'][router]['fw_rules']:
+        return True
+
+    if (router in live['uplinks']) != (router in nat_rules):
+        return True
+
+    # Rules are installed on addresses: they need refreshing if any of them changed
+    referenced = set()
+    for target in ["ACCEPT", "DROP"]:
+        for rule in conf['routers'][router]['fw_rules'].get(target, []):
+            referenced.update(rule[:2])
+    return not referenced <= live['stable']
+
+def reconcile_network(conf, net_graph):
+    """Brings a deployed network in line with an updated configuration.
+
+    The new configuration is diffed against the deployment's recorded state so that
+    only what changed is destroyed and (re)created: containers whose image or type
+    changed, veths and addresses for moved or renumbered attachments, routing tables
+    and firewalls depending on them and so on. Addresses of everything that's kept
+    are preserved. On failure nothing is rolled back: what's been done is recorded,
+    so reconciling again picks up from there.
+
+    Args:
+        conf (dictionary): The updated network configuration.
+        net_graph (networkx.Graph): The graph built from `conf`.
+    """
+    global current_state
     try:
-        for router, config in conf['routers'].items():
-            log.debug(f"Instantiating router {router}")
-            _create_node(router, dx.types.router, conf['router_image'])
-            for subnet in config['subnets']:
-                router_iface, _ = _connect_node(router, subnet + "_brd")
-                ipaddr.assign(
-                    router_iface,
-                    request_ip(conf['subnets'][subnet]['address'], hname = router),
-                    netns = router
-                )
-            dx.apply_fw_rules(router, config['fw_rules'])
-
-        if conf['internet_access']:
-            try:
-                d_brd, d_gw, d_subnet = dx.get_default_net_data()
-            except DckError as err:
-                log.warning(f"Couldn't configure outward internet access: {err.cause}")
+        current_state = state.load(conf['name'])
+        log.info("Setting up the system")
+        _system_setup(conf['ip_backend'])
+        log.info("Diffing the configuration against the deployment...")
+        live, stale = _diff_deployment(conf, current_state.snapshot())
+        _prune_deployment(stale, conf['max_workers'])
+        deployment = _compile_deployment(conf, net_graph, live)
+        _record('add_addresses', addr_manager.assignments())
+        log.info(f"Deploying {len(deployment.tasks)} steps ({conf['max_workers']} at a time)...")
+        deployment.run(conf['max_workers'], retries = conf['retries'])
+        deployment.report()
+        current_state.set_meta('conf', conf)
+        _close_state()
+        log.info(f"Network '{conf['name']}' is up to date!")
+    except (InstError, DckError, IP2Error, StateError) as err:
+        log.critical(f"Error reconciling the net: {err.cause}")
+        log.critical("What's been done so far is recorded: fix the problem and reconcile again...")
+        _close_state()
+        sys.exit(-1)
 
-            log.info("Enabling internet access for each network node...")
+def _diff_deployment(conf, snapshot):
+    """Splits what's deployed into what's to be kept and what's stale.
+
+    Args:
+        conf (dictionary): The desired network configuration.
+        snapshot (dictionary): The recorded state, as returned by state.deployment_state.snapshot().
+
+    Returns:
+        tuple: What's to be kept (check _compile_deployment()) and what's to be removed.
+    """
+    desired = _desired_nodes(conf)
+    if conf['internet_access'] and len(conf['routers']) > 0:
+        uplink = _uplink_data(conf)
+        if uplink != None:
+            d_brd, _, d_subnet = uplink
+            desired[list(conf['routers'].keys())[0]][2].append((d_brd, d_subnet))
+
+    live = {
+        'containers': set(), 'bridges': set(), 'attachments': {},
+        'routes': {}, 'stable': set(), 'uplinks': set(), 'conf': snapshot['conf']
+    }
+    stale = {'containers': [], 'bridges': [], 'veths': [], 'addresses': []}
+
+    # Routers attached to a bridge we don't own (i.e. docker's) are the ones NATting traffic
+    recorded_bridges = snapshot['bridges'] | {subnet + "_brd" for subnet in snapshot['conf'].get('subnets', {})}
+    live['uplinks'] = {node for node, bridge in snapshot['veths'] if bridge not in recorded_bridges}
+
+    # Hosts' attachments are made anew whenever the way they're made changes
+    remode = snapshot['conf'].get('attachment_mode', "veth") != conf.get('attachment_mode', "veth")
+
+    desired_bridges = {subnet + "_brd" for subnet in conf['subnets'].keys()}
+    for bridge in snapshot['bridges']:
+        (live['bridges'].add if bridge in desired_bridges else stale['bridges'].append)(bridge)
+
+    for name, recorded in snapshot['containers'].items():
+        if name not in desired or desired[name][:2] != tuple(recorded):
+            stale['containers'].append(name)
+            continue
+        live['containers'].add(name)
+        live['routes'][name] = snapshot['routes'].get(name, {})
+
+        addrs, stable = snapshot['addresses'].get(name, []), True
+        for bridge, subnet_addr in desired[name][2]:
+            cidr = next((addr for addr in addrs if _same_subnet(addr, subnet_addr)), None)
+            if (name, bridge) in snapshot['veths'] and cidr != None and not (remode and recorded[0] == dx.types.host):
+                live['attachments'][(name, bridge)] = cidr
+            else:
+                stable = False
+
+        for (node, bridge), (node_iface, _) in snapshot['veths'].items():
+            if node == name and (node, bridge) not in live['attachments']:
+                stale['veths'].append((node, bridge, node_iface))
+                stable = False
+        kept_addrs = [cidr for (node, _), cidr in live['attachments'].items() if node == name]
+        stale['addresses'] += [(name, addr) for addr in addrs if addr not in kept_addrs]
+
+        if stable:
+            live['stable'].add(name)
+
+    addr_manager.restore({
+        node: [cidr for (n, _), cidr in live['attachments'].items() if n == node] for node in live['containers']
+    })
+
+    log.info(
+        f"Keeping {len(live['containers'])} containers, {len(live['bridges'])} bridges and " +
+        f"{len(live['attachments'])} attachments; removing {len(stale['containers'])} containers, " +
+        f"{len(stale['bridges'])} bridges and {len(stale['veths'])} attachments"
+    )
+    return live, stale
 
-            first_router = list(conf['routers'].keys())[0]
-            iplink.bridge.activate(d_brd)
-            r_iface, _ = _connect_node(first_router, d_brd)
-            addr_manager.request_ip(d_subnet)
-            r_ip = addr_manager.request_ip(d_subnet, first_router)
-            ipaddr.assign(r_iface, r_ip, first_router)
-            iproute.assign('default', d_gw, first_router)
-            for range in addr_manager.private_ranges:
-                dx.add_nat_rule(first_router, "ACCEPT", range)
-            dx.add_nat_rule(first_router, "MASQUERADE")
+def _same_subnet(cidr, subnet_addr):
+    return cidr.split('/')[1] == subnet_addr.split('/')[1] and get_net_addr(cidr) == get_net_addr(subnet_addr)
 
-    except (IP2Error, DckError) as err:
-        raise InstError(err.cause)
+def _prune_deployment(stale, max_workers):
+    _undo_deployment(
+        {'bridges': stale['bridges'], 'containers': stale['containers']},
+        graceful = False, max_workers = max_workers
+    )
+    for container in stale['containers']:
+        _record('remove_container', container)
+    for bridge in stale['bridges']:
+        _record('remove_bridge', bridge)
+
+    # Removing an end of a veth takes its peer and the addresses on it along
+    for node, bridge, node_iface in stale['veths']:
+        iplink.veth.remove(node_iface, netns = node)
+        _record('remove_veth', node, bridge)
+    for node, cidr in stale['addresses']:
+        _record('remove_address', node, cidr)
+
+def _checked(check, *args):
+    # Anything going wrong while checking means we can't rely on what was done
+    def _check():
+        try:
+            return check(*args)
+        except (IP2Error, UtilError, DckError):
+            return False
+    return _check
+
+def _remove_bridge(name):
+    if iplink.bridge.exists(name):
+        iplink.bridge.remove(name)
+    _record('remove_bridge', name)
+
+def _node_exists(name):
+    return nns.container_running(name) or (dx.container_running(name) and os.path.exists(f"/var/run/netns/{name}"))
+
+def _remove_node(name):
+    try:
+        _cnx(name).remove_container(name, graceful = False)
+    except DckError as err:
+        # It might have never been created: just drop its netns link
+        log.debug(f"Couldn't remove container {name}: {err.cause}")
+        dx.unlink_netns(name)
+    iputils.release_netns(name)
+    _record('remove_container', name)
+
+def _disconnect_node(node, bridge):
+    # The veth might have been left anywhere along the way: removing an end takes the peer along
+    x, y = _veth_names(node, bridge)
+    for iface, netns in [(x, node), (x, None), (y, None)]:
+        if iplink.veth.exists(iface, netns):
+            iplink.veth.remove(iface, netns)
+    _record('remove_veth', node, bridge)
 
 def _create_bridge(name):
     iplink.bridge.create(name)
     iplink.bridge.activate(name)
-    existing_instances['bridges'].append(name)
+    _record_flushed('add_bridge', name)
 
 def _create_node(name, type, img):
-    dx.run_container(
-        name, type, img
+    """Runs a node, either as a container or as a bare network namespace (check netns_cnx.image())."""
+    cnx = _cnx(name, img)
+    cnx.run_container(
+        name, type, nns.command(img) if cnx == nns else img
     )
-    dx.link_netns(name)
-    existing_instances['containers'].append(name)
-
-def _connect_node(node, bridge, vID = None, brdToBrd = False, nIfaceName = None, brdIfaceName = None):
-    x = f"{node}-{bridge}{f'-{vID}' if vID else ''}" if nIfaceName == None else nIfaceName
-    y = f"{bridge}-{node}{f'-{vID}' if vID else ''}" if brdIfaceName == None else brdIfaceName
-    iplink.veth.create(x, y)
-    iplink.veth.connect(node, x, host = not brdToBrd)
-    iplink.veth.activate(x, netns = node if not brdToBrd else None)
-    iplink.veth.connect(bridge, y, host = False)
-    iplink.veth.activate(y)
+    _record('add_container', name, type, img)
+    cnx.link_netns(name)
+    _record('add_netns', name, f"/var/run/netns/{name}")
+
+def _veth_names(node, bridge, vID = None):
+    return f"{node}-{bridge}{f'-{vID}' if vID else ''}", f"{bridge}-{node}{f'-{vID}' if vID else ''}"
+
+def _connect_node(node, bridge, vID = None, brdToBrd = False, nIfaceName = None, brdIfaceName = None, cidr_block = None):
+    x, y = _veth_names(node, bridge, vID)
+    x = x if nIfaceName == None else nIfaceName
+    y = y if brdIfaceName == None else brdIfaceName
+    if brdToBrd:
+        iplink.veth.provision(x, y, master = node, peer_master = bridge)
+    else:
+        iplink.veth.provision(x, y, netns = node, peer_master = bridge, cidr_block = cidr_block)
+    _record_flushed('add_veth', node, bridge, x, y)
     return x, y
 
-def _public_routing(net_conf, net_graph):
-    routes = {
-        'default': networkx.shortest_path(
-            net_graph, target = list(net_conf['routers'].keys())[0],
-            method = "dijkstra"
-        )
-    }
-
-    log.debug(f"Discovered PUBLIC routes --\n{json.dumps(routes, indent = 2)}\n--")
+# Ways of hanging hosts from their subnet's bridge other than a veth
+attachment_modes = {
+    "macvlan": iplink.macvlan,
+    "ipvlan": iplink.ipvlan
+}
 
-    _apply_routes(routes, net_conf)
+def _attach_node(node, bridge, sublink):
+    """Attaches a host to a subnet through a child interface of the subnet's bridge.
+
+    The child (check ip2_api.link.macvlan) is created right within the host's netns
+    and there are no bridge ports involved, so traffic between hosts on the subnet
+    never crosses the bridge.
+    Routers attached to the bridge through veths are reached through the bridge as usual.
+
+    Returns:
+        str: The name of the interface within `node`.
+    """
+    x, _ = _veth_names(node, bridge)
+    sublink.create(x, bridge, netns = node)
+    iplink.veth.activate(x, netns = node)
+    # There's no interface on the bridge's end
+    _record_flushed('add_veth', node, bridge, x, None)
+    return x
+
+def _link_nodes(x_node, y_node, xIfaceName = None, yIfaceName = None):
+    """Connects two nodes through a veth pair with no bridge in between (i.e. a point-to-point link).
+
+    The pair is recorded as an attachment of `x_node` to `y_node`. It goes away along with
+    either node's network namespace.
+
+    Returns:
+        tuple: The names of the interfaces within `x_node` and `y_node`.
+    """
+    x, y = _veth_names(x_node, y_node)
+    x = x if xIfaceName == None else xIfaceName
+    y = y if yIfaceName == None else yIfaceName
+    iplink.veth.provision(x, y, netns = x_node, peer_netns = y_node)
+    _record_flushed('add_veth', x_node, y_node, x, y)
+    return x, y
 
-def _private_routing(net_conf, net_graph):
-    routes = {}
-    for subnet, config in net_conf['subnets'].items():
-        routes[config['address']] = networkx.shortest_path(
-            net_graph, target = subnet + "_brd",
-            method = "dijkstra"
+def _routing_tables(net_conf, net_graph, attach_ips, default_route = True):
+    """Computes every node's routing table in a single BFS pass per destination.
+
+    Destinations are every subnet (i.e. private routing) and the first router (i.e.
+    the default route, if internet access is enabled and there's an uplink). A BFS
+    from a destination yields a tree of next hops towards it: hosts and routers only
+    neighbour bridges, so a node's gateway is its grandparent on the tree, reached
+    through its parent bridge. Nodes whose parent is the destination share its subnet
+    and need no route.
+
+    Args:
+        net_conf (dictionary): The network configuration.
+        net_graph (networkx.Graph): The graph built from `net_conf`.
+        attach_ips (dictionary): (node, bridge) tuples mapped to the node's address on the bridge.
+        default_route (bool, optional): Whether the first router has a way out to the internet.
+
+    Returns:
+        dictionary: Nodes mapped to lists of (destination, gateway address) tuples.
+    """
+    destinations = []
+    if net_conf['private_routing']:
+        destinations += [(config['address'], subnet + "_brd") for subnet, config in net_conf['subnets'].items()]
+    if net_conf['internet_access'] and default_route:
+        destinations.append(('default', list(net_conf['routers'].keys())[0]))
+
+    adjacency = {node: list(neighbours) for node, neighbours in net_graph.adjacency()}
+    sources = [node for node, type in net_graph.nodes(data = 'type') if type != "bridge"]
+
+    tables = {}
+    for dest, target in destinations:
+        parents = _bfs_tree(adjacency, target)
+        for source in sources:
+            via = parents.get(source)
+            if via == None or via == target:
+                continue
+            tables.setdefault(source, []).append((dest, attach_ips[(parents[via], via)]))
+
+    log.debug(f"Computed routes towards {len(destinations)} destinations for {len(tables)} nodes")
+    return tables
+
+def _bfs_tree(adjacency, root):
+    # Every reachable node mapped to its neighbour on a shortest path to `root`
+    parents, queue = {root: None}, collections.deque([root])
+    while queue:
+        node = queue.popleft()
+        for neighbour in adjacency[node]:
+            if neighbour not in parents:
+                parents[neighbour] = node
+                queue.append(neighbour)
+    return parents
+
+def _summarize_route_table(table):
+    """Shrinks a routing table without changing where any packet goes.
+
+    Destinations sharing a gateway are collapsed into the minimal set of covering
+    prefixes, which spans exactly the same addresses. Then, routes whose closest
+    covering route (i.e. the one longest prefix matching falls back to) goes through
+    the same gateway are dropped. With a default route that means hosts behind a
+    single router are left with that route alone.
+
+    Args:
+        table (list): (destination, gateway address) tuples.
+
+    Returns:
+        list: The summarized (destination, gateway address) tuples.
+    """
+    # Prefixes are handled as (network address, length) tuples to keep supernet lookups cheap
+    by_gw, merged = {}, {}
+    for dest, gw in table:
+        by_gw.setdefault(gw, set()).add(_prefix(dest))
+        # Just like `ip route replace`, the last route to a destination wins
+        merged[_prefix(dest)] = gw
+
+    # A supernet colliding with another route (e.g. 10.0.0.0/25 and 10.0.0.128/25 via A
+        # vs 10.0.0.0/24 via B) would take its traffic: keep the specific routes then
+    for gw, prefixes in by_gw.items():
+        for prefix in _collapse(prefixes):
+            if prefix not in merged:
+                merged[prefix] = gw
+
+    summary = []
+    for (addr, plen), gw in merged.items():
+        cover = next(
+            (merged[(addr & masks[sup], sup)] for sup in range(plen - 1, -1, -1) if (addr & masks[sup], sup) in merged),
+            None
         )
+        if cover != gw:
+            summary.append(('default' if plen == 0 else f"{ipaddress.IPv4Address(addr)}/{plen}", gw))
+    return summary
+
+@functools.lru_cache(maxsize = None)
+def _prefix(dest):
+    net = ipaddress.ip_network("0.0.0.0/0" if dest == 'default' else dest, strict = False)
+    return int(net.network_address), net.prefixlen
+
+def _collapse(prefixes):
+    # Merge sibling prefixes (i.e. both halves of a supernet) bottom up
+    by_len = [set() for _ in range(33)]
+    for addr, plen in prefixes:
+        by_len[plen].add(addr)
+    for plen in range(32, 0, -1):
+        for addr in sorted(by_len[plen]):
+            sibling = addr ^ (1 << (32 - plen))
+            if addr in by_len[plen] and sibling in by_len[plen]:
+                by_len[plen] -= {addr, sibling}
+                by_len[plen - 1].add(addr & masks[plen - 1])
+    return [(addr, plen) for plen in range(33) for addr in by_len[plen]]
+
+def _merge_route_tables(tables, new_tables):
+    for node, table in new_tables.items():
+        tables.setdefault(node, []).extend(table)
+
+def _apply_route_table(node, table):
+    with ipbatch.batch():
+        for dest, gw_ip in table:
+            iproute.assign(dest, gw_ip, netns = node)
+    _record('add_routes', node, table)
+
+def _update_route_table(node, table, stale):
+    # Routes through removed interfaces are gone already: there's no need to fail
+    for dest, gw_ip in stale:
+        try:
+            iproute.remove(dest, gw_ip, netns = node)
+        except IP2Error as err:
+            log.debug(f"Couldn't remove stale route @ {node}: {err.cause}")
+    _record('remove_routes', node, [dest for dest, _ in stale])
+    _apply_route_table(node, table)
+
+def _assign_route(dest, gw_ip, node):
+    iproute.assign(dest, gw_ip, netns = node)
+    _record_flushed('add_route', node, dest, gw_ip)
+
+def _undo_deployment(instances, fail = True, graceful = True, max_workers = 16):
+    """Removes the bridges and containers in `instances`.
+
+    Args:
+        instances (dictionary): The `bridges` and `containers` to remove, together with
+            the `netns` links (of containers we don't own) to drop, if any.
+        fail (bool, optional): Whether to raise errors. Otherwise they are just logged.
+        graceful (bool, optional): Whether to remove things one at a time, stopping
+            containers before removing them. Otherwise bridges are deleted in bulk and
+            containers are force-removed by up to `max_workers` threads; errors are
+            collected and reported (or raised, depending on `fail`) at the end.
+        max_workers (int, optional): Containers removed at once when not `graceful`.
+    """
+    if not graceful:
+        _fast_undo_deployment(instances, fail, max_workers)
+        return
 
-    log.debug(f"Discovered PRIVATE routes --\n{json.dumps(routes, indent = 2)}\n--")
-
-    _apply_routes(routes, net_conf)
-
-def _apply_routes(routes, net_conf):
-    for subnet, paths_to_it in routes.items():
-        for source, path_to_subnet in paths_to_it.items():
-            # No need to route bridges
-            if source in existing_instances['bridges']:
-                continue
-            # We belong to the same subnet
-            if len(path_to_subnet) == 2:
-                continue
-            # Source and destination are included in the path
-            for hop in path_to_subnet[1:]:
-                if hop in net_conf['routers'].keys():
-                    gw_ip = _find_reachable_ip(source, hop)
-                    try:
-                        iproute.assign(subnet, gw_ip, netns = source)
-                    except IP2Error as err:
-                        raise InstError(err.cause)
-                    break
-
-def _find_reachable_ip(source, gw):
-    gw_addresses = name_2_ip(gw, index = -1)
-    gw_subnets = [get_net_addr(addr) for addr in gw_addresses]
-    for subnet in [get_net_addr(addr) for addr in name_2_ip(source, index = -1)]:
-        if subnet in gw_subnets:
-            return gw_addresses[gw_subnets.index(subnet)].split('/')[0]
-
-def _undo_deployment(instances, fail = True):
     for bridge in instances['bridges']:
         try:
             iplink.bridge.remove(bridge)
@@ -195,15 +743,59 @@ def _undo_deployment(instances, fail = True):
 
     for container in instances['containers']:
         try:
-            dx.remove_container(container)
+            _cnx(container).remove_container(container)
+            iputils.release_netns(container)
         except DckError as err:
             if fail:
                 raise err
             log.warn(f"{err}")
+    _unlink_netns(instances)
+
+def _unlink_netns(instances):
+    for name in instances.get('netns', []):
+        dx.unlink_netns(name)
+        iputils.release_netns(name)
+
+def _fast_undo_deployment(instances, fail, max_workers):
+    errors = []
 
-def _update_hosts_files():
+    # Every bridge goes away through a single `ip -force -batch -` run
+    try:
+        with ipbatch.batch(force = True):
+            for bridge in instances['bridges']:
+                try:
+                    iplink.bridge.remove(bridge)
+                except IP2Error as err:
+                    errors.append(err)
+    except IP2Error as err:
+        errors.append(err)
+
+    def _remove(container):
+        _cnx(container).remove_container(container, graceful = False)
+        iputils.release_netns(container)
+
+    log.debug(f"Removing {len(instances['containers'])} containers, {max_workers} at a time")
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(_remove, container): container for container in instances['containers']}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except DckError as err:
+                errors.append(DckError(f"{err.cause} @ container {futures[future]}"))
+    _unlink_netns(instances)
+
+    if not errors:
+        return
+
+    log.warning(f"Found {len(errors)} errors tearing down {len(instances['bridges'])} bridges and {len(instances['containers'])} containers:")
+    for err in errors:
+        log.warning(f"\t{err.cause}")
+    if fail:
+        raise errors[0]
+
+def _hosts_file_tar():
     hosts_file = '\n'.join(
-        [f"{addrs[0].split('/')[0]} {host}" for host, addrs in addr_manager.assigned_addreses.items()]
+        [f"{addrs[0].split('/')[0]} {host}" for host, addrs in addr_manager.assignments().items()]
     ) + '\n'
     log.debug(f"Extra hosts:\n{hosts_file}")
 
@@ -220,20 +812,58 @@ def _update_hosts_files():
     t_file.addfile(tinfo, data_buff)
     t_file.close()
     tar_buff.seek(0, io.SEEK_SET)
-    tar_data = tar_buff.read()
+    return tar_buff.read()
 
+def _update_hosts_file(node, tar_data):
     # Once the TAR file has been generated, upload it to containers
         # and append it to /etc/hosts
-    for node in existing_instances['containers']:
-        log.debug(f"Updating /etc/hosts @ node {node}")
+    log.debug(f"Updating /etc/hosts @ node {node}")
+
+    # We CANNOT overwrite /etc/hosts as it is bind-mounted
+        # by the docker engine from the host's disk...
+    cnx = _cnx(node)
+    cnx.upload_file(node, "/etc", tar_data)
+    cnx.append_file_to_file(node, "/etc/extra_hosts", "/etc/hosts")
+
+def delete_net(name, net_conf = None, fail = True):
+    """Tears a network down.
+
+    What to remove is read from the network's recorded state. If there's none (i.e.
+    it was deployed by an older version) names are derived from `net_conf` instead.
+
+    Args:
+        name (str): The network's name.
+        net_conf (dictionary, optional): The network's configuration.
+        fail (bool, optional): Whether to stop on errors. Otherwise they're just
+            reported and the recorded state is dropped regardless.
+    """
+    log.info(f"Deleting the '{name}' network")
+    recorded, max_workers = None, 16
+    try:
+        if state.exists(name):
+            recorded = state.load(name)
+            instances = recorded.instances()
+            max_workers = recorded.get_meta('conf', {}).get('max_workers', max_workers)
+        elif net_conf != None:
+            instances = _conf_instances(net_conf)
+            max_workers = net_conf['max_workers']
+        else:
+            raise StateError(f"There's no state recorded for network '{name}'")
+    except StateError as err:
+        log.critical(f"Error loading the deployment: {err.cause}")
+        sys.exit(-1)
 
-        # We CANNOT overwrite /etc/hosts as it is bind-mounted
-            # by the docker engine from the host's disk...
-        dx.upload_file(node, "/etc", tar_data)
-        dx.append_file_to_file(node, f"/etc/{tinfo.name}", "/etc/hosts")
+    try:
+        _undo_deployment(instances, fail = fail, graceful = False, max_workers = max_workers)
+        if recorded != None:
+            recorded.drop()
+        log.info(f"Deleted the '{name}' network correctly!")
+    except (IP2Error, DckError) as err:
+        log.critical(f"Error undoing the deployment: {err.cause}.")
+        log.critical("Try to manually remove containers and bridges left behind...")
+        sys.exit(-1)
 
-def delete_net(net_conf):
-    log.info(f"Deleting the '{net_conf['name']}' network")
+def _conf_instances(net_conf):
     tmp = {'bridges': [], 'containers': []}
     for subnet, config in net_conf['subnets'].items():
         tmp['bridges'].append(subnet + "_brd")
@@ -241,11 +871,25 @@ def delete_net(net_conf):
             tmp['containers'].append(host)
     for router in net_conf['routers'].keys():
         tmp['containers'].append(router)
+    return tmp
 
+def net_status(name):
+    """Logs what has been recorded for a deployed network."""
     try:
-        _undo_deployment(tmp)
-        log.info(f"Deleted the '{net_conf['name']}' network correctly!")
-    except (IP2Error, DckError) as err:
-        log.critical(f"Error undoing the deployment: {err.cause}.")
-        log.critical("Try to manually remove containers and bridges left behind...")
+        recorded = state.load(name)
+        summary = recorded.summary()
+        log.info(
+            f"Network '{name}' (deployed by {recorded.get_meta('tool')} on " +
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(recorded.get_meta('created')))}): " +
+            ', '.join(f"{count} {kind}" for kind, count in summary.items())
+        )
+        for node in recorded.instances()['containers']:
+            details = recorded.node_details(node)
+            log.debug(
+                f"\t{node}: addresses = {details['addresses']}; ifaces = {details['veths']}; " +
+                f"routes = {[f'{dest} via {gw}' for dest, gw in details['routes']]}"
+            )
+        recorded.close()
+    except StateError as err:
+        log.critical(f"Error loading the deployment: {err.cause}")
         sys.exit(-1)
@@ -0,0 +1,242 @@
+import sqlite3, json, pathlib, threading, logging, time, re
+
+from .exceptions import StateError
+
+log = logging.getLogger(__name__)
+
+# Where deployment state files live: one SQLite DB per network (i.e. <state_dir>/<name>.db)
+state_dir = "/var/lib/dvnet"
+
+_schema = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS containers (name TEXT PRIMARY KEY, type INTEGER, image TEXT);
+    CREATE TABLE IF NOT EXISTS bridges (name TEXT PRIMARY KEY);
+    CREATE TABLE IF NOT EXISTS veths (node TEXT, bridge TEXT, node_iface TEXT, brd_iface TEXT, PRIMARY KEY (node, node_iface));
+    CREATE TABLE IF NOT EXISTS netns (name TEXT PRIMARY KEY, path TEXT);
+    CREATE TABLE IF NOT EXISTS addresses (node TEXT, cidr TEXT, PRIMARY KEY (node, cidr));
+    CREATE TABLE IF NOT EXISTS routes (node TEXT, dest TEXT, gw TEXT, PRIMARY KEY (node, dest));
+    CREATE TABLE IF NOT EXISTS steps (name TEXT PRIMARY KEY, kind TEXT, status TEXT, error TEXT, updated REAL);
+"""
+
+def state_path(name):
+    # Network names are free-form (e.g. `Harder Net`): keep them file system friendly
+    return pathlib.Path(state_dir) / f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.db"
+
+def exists(name):
+    return state_path(name).is_file()
+
+class deployment_state:
+    """The persistent record of what a deployment has instantiated.
+
+    Every element is recorded as soon as it's created so that a network can be torn
+    down or inspected without its original definition, even after a crash. Writes
+    can come from several threads at once (check deployment_dag.task_graph.run()).
+
+    Args:
+        name (str): The network's name.
+        path (str, optional): Where the state lives. Defaults to `state_path(name)`.
+    """
+    def __init__(self, name, path = None):
+        self.name = name
+        self.path = pathlib.Path(path) if path != None else state_path(name)
+        self.lock = threading.Lock()
+        try:
+            self.path.parent.mkdir(parents = True, exist_ok = True)
+            self.db = sqlite3.connect(self.path, check_same_thread = False)
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.executescript(_schema)
+        except (OSError, sqlite3.Error) as err:
+            raise StateError(f"Couldn't open the state at {self.path}: {err}")
+
+    def _write(self, query, params = ()):
+        with self.lock:
+            try:
+                self.db.execute(query, params)
+                self.db.commit()
+            except sqlite3.Error as err:
+                raise StateError(f"Couldn't update the state at {self.path}: {err}")
+
+    def _write_many(self, query, rows):
+        # A single transaction, however many rows there are
+        with self.lock:
+            try:
+                self.db.executemany(query, rows)
+                self.db.commit()
+            except sqlite3.Error as err:
+                raise StateError(f"Couldn't update the state at {self.path}: {err}")
+
+    def _read(self, query, params = ()):
+        with self.lock:
+            try:
+                return self.db.execute(query, params).fetchall()
+            except sqlite3.Error as err:
+                raise StateError(f"Couldn't read the state at {self.path}: {err}")
+
+    def set_meta(self, key, value):
+        self._write("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_meta(self, key, default = None):
+        rows = self._read("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def add_container(self, name, type, image):
+        self._write("INSERT OR REPLACE INTO containers VALUES (?, ?, ?)", (name, type, image))
+
+    def add_bridge(self, name):
+        self._write("INSERT OR IGNORE INTO bridges VALUES (?)", (name,))
+
+    def add_veth(self, node, bridge, node_iface, brd_iface):
+        self._write("INSERT OR REPLACE INTO veths VALUES (?, ?, ?, ?)", (node, bridge, node_iface, brd_iface))
+
+    def add_netns(self, name, path):
+        self._write("INSERT OR REPLACE INTO netns VALUES (?, ?)", (name, path))
+
+    def add_addresses(self, assignments):
+        """Records address assignments.
+
+        Args:
+            assignments (dictionary): Node names mapped to the CIDR blocks they were
+                handed, such as `addr_manager.assignments()`.
+        """
+        self._write_many(
+            "INSERT OR IGNORE INTO addresses VALUES (?, ?)",
+            [(node, cidr) for node, cidrs in assignments.items() for cidr in cidrs]
+        )
+
+    def add_route(self, node, dest, gw):
+        self._write("INSERT OR REPLACE INTO routes VALUES (?, ?, ?)", (node, dest, gw))
+
+    def add_routes(self, node, table):
+        """Records a whole routing table at once.
+
+        Args:
+            node (str): The node the routes are installed on.
+            table (list): (destination, gateway address) tuples.
+        """
+        self._write_many("INSERT OR REPLACE INTO routes VALUES (?, ?, ?)", [(node, dest, gw) for dest, gw in table])
+
+    def remove_container(self, name):
+        """Forgets a container together with everything living in its netns."""
+        for table in ["containers", "netns"]:
+            self._write(f"DELETE FROM {table} WHERE name = ?", (name,))
+        for table in ["veths", "addresses", "routes"]:
+            self._write(f"DELETE FROM {table} WHERE node = ?", (name,))
+
+    def remove_bridge(self, name):
+        self._write("DELETE FROM bridges WHERE name = ?", (name,))
+
+    def remove_veth(self, node, bridge):
+        self._write("DELETE FROM veths WHERE node = ? AND bridge = ?", (node, bridge))
+
+    def remove_address(self, node, cidr):
+        self._write("DELETE FROM addresses WHERE node = ? AND cidr = ?", (node, cidr))
+
+    def remove_route(self, node, dest):
+        self._write("DELETE FROM routes WHERE node = ? AND dest = ?", (node, dest))
+
+    def remove_routes(self, node, dests):
+        self._write_many("DELETE FROM routes WHERE node = ? AND dest = ?", [(node, dest) for dest in dests])
+
+    def snapshot(self):
+        """Returns everything that has been recorded.
+
+        Returns:
+            dictionary: Containers mapped to their (type, image), the set of bridges,
+                (node, bridge) tuples mapped to the veth's (node_iface, brd_iface),
+                nodes mapped to their addresses and nodes mapped to their routes
+                (i.e. {dest: gw}), together with the recorded configuration.
+        """
+        snap = {
+            'containers': {name: (type, image) for name, type, image in self._read("SELECT * FROM containers")},
+            'bridges': {row[0] for row in self._read("SELECT name FROM bridges")},
+            'veths': {(node, bridge): (x, y) for node, bridge, x, y in self._read("SELECT * FROM veths")},
+            'addresses': {},
+            'routes': {},
+            'conf': self.get_meta('conf', {})
+        }
+        for node, cidr in self._read("SELECT * FROM addresses"):
+            snap['addresses'].setdefault(node, []).append(cidr)
+        for node, dest, gw in self._read("SELECT * FROM routes"):
+            snap['routes'].setdefault(node, {})[dest] = gw
+        return snap
+
+    # The deployment journal: check deployment_dag.task_graph.run()
+    def step_done(self, name, kind):
+        self._write("INSERT OR REPLACE INTO steps VALUES (?, ?, 'done', NULL, ?)", (name, kind, time.time()))
+
+    def step_failed(self, name, kind, cause):
+        self._write("INSERT OR REPLACE INTO steps VALUES (?, ?, 'failed', ?, ?)", (name, kind, cause, time.time()))
+
+    def forget_step(self, name):
+        self._write("DELETE FROM steps WHERE name = ?", (name,))
+
+    def journal(self):
+        """Returns the recorded steps mapped to their status (i.e. `done` or `failed`)."""
+        return {name: status for name, status in self._read("SELECT name, status FROM steps")}
+
+    def instances(self):
+        """Returns the recorded bridges and containers as expected by _undo_deployment().
+
+        Netns links to containers we didn't run (e.g. influxdb) are returned under `netns`.
+        """
+        return {
+            'bridges': [row[0] for row in self._read("SELECT name FROM bridges")],
+            'containers': [row[0] for row in self._read("SELECT name FROM containers")],
+            'netns': [row[0] for row in self._read("SELECT name FROM netns WHERE name NOT IN (SELECT name FROM containers)")]
+        }
+
+    def summary(self):
+        """Returns how many elements of each kind have been recorded."""
+        return {
+            table: self._read(f"SELECT COUNT(*) FROM {table}")[0][0]
+                for table in ["containers", "bridges", "veths", "netns", "addresses", "routes", "steps"]
+        }
+
+    def node_details(self, node):
+        """Returns the addresses, interfaces and routes recorded for `node`."""
+        return {
+            'addresses': [row[0] for row in self._read("SELECT cidr FROM addresses WHERE node = ?", (node,))],
+            'veths': [row[0] for row in self._read("SELECT node_iface FROM veths WHERE node = ?", (node,))],
+            'routes': self._read("SELECT dest, gw FROM routes WHERE node = ?", (node,))
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def drop(self):
+        """Closes and deletes the state: do so only once the network is gone."""
+        self.close()
+        for suffix in ["", "-wal", "-shm"]:
+            pathlib.Path(f"{self.path}{suffix}").unlink(missing_ok = True)
+
+def create(name, tool, conf = None):
+    """Starts recording a new deployment.
+
+    Args:
+        name (str): The network's name.
+        tool (str): What's deploying it (i.e. `docker_virt_net` or `logical_to_topo`).
+        conf (dictionary, optional): The configuration being deployed.
+
+    Raises:
+        StateError: If there's state recorded for `name` already.
+    """
+    if exists(name):
+        raise StateError(f"Network '{name}' is already deployed (check {state_path(name)}): remove it first")
+    state = deployment_state(name)
+    state.set_meta('tool', tool)
+    state.set_meta('created', time.time())
+    if conf != None:
+        state.set_meta('conf', conf)
+    return state
+
+def load(name):
+    """Opens the state recorded for an existing deployment.
+
+    Raises:
+        StateError: If there's no state recorded for `name`.
+    """
+    if not exists(name):
+        raise StateError(f"There's no state recorded for network '{name}' (checked {state_path(name)})")
+    return deployment_state(name)
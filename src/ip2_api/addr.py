@@ -1,6 +1,7 @@
 import logging
 
 from .cmds import _execute
+from . import netlink
 
 log = logging.getLogger(__name__)
 
@@ -19,7 +20,8 @@ def assign(iface, cidr_block, netns = None):
 
     _execute(
         args,
-        f"Error assigning {cidr_block} to {iface} on netns {netns if netns else 'root'}"
+        f"Error assigning {cidr_block} to {iface} on netns {netns if netns else 'root'}",
+        nl_op = lambda: netlink.addr_replace(iface, cidr_block, netns)
     )
 
 def reset(iface, netns = None):
@@ -31,5 +33,6 @@ def reset(iface, netns = None):
 
     _execute(
         args,
-        f"Error flushing interface {iface} on netns {netns if netns else 'root'}"
+        f"Error flushing interface {iface} on netns {netns if netns else 'root'}",
+        nl_op = lambda: netlink.addr_flush(iface, netns)
     )
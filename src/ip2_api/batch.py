@@ -0,0 +1,142 @@
+import logging, subprocess, os, re
+
+from . import cmds
+from .cmds import _batches, _active_batch
+from .exceptions import IP2Error
+
+log = logging.getLogger(__name__)
+
+# Both ip(8) and bridge(8) report a failing line in batch mode as:
+    # Command failed -:<LINE>
+    # The offending command's own error message is printed on the preceding line(s).
+_failed_line = re.compile(r"^Command failed -:(\d+)$")
+
+class batch:
+    """Queues iproute2 commands and runs them through `ip -batch -` and `bridge -batch -`.
+
+    Any call to the link, addr, route or vlan modules made within a `with batch():`
+    block is queued instead of forking a new process. On exit, queued commands are
+    grouped by tool and network namespace and each group is flushed through a single
+    invocation.
+
+    Groups are flushed in order of first appearance. Commands within a group keep their
+    relative order, but commands from different groups can be reordered. This is fine
+    as long as root namespace operations (i.e. creating veths and moving them around)
+    are issued before the namespaced ones depending on them, which is what every caller
+    does. Call flush() explicitly to force a barrier otherwise.
+
+    Whatever depends on queued commands having been run (e.g. recording what they
+    created) goes through after_flush(): it's only called once they all succeed.
+
+    Batches only apply to the iproute2 backend. With the netlink one every call is
+    a request over an already open socket and is issued right away, batch or not.
+
+    Args:
+        force (bool, optional): Keep on running a group after a command fails. Every
+            failure is then reported at once.
+    """
+    def __init__(self, force = False):
+        self.force = force
+        self.ops, self.callbacks = [], []
+
+    def __enter__(self):
+        if not hasattr(_batches, 'stack'):
+            _batches.stack = []
+        _batches.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _batches.stack.remove(self)
+        if exc_type != None:
+            log.debug(f"Discarding {len(self.ops)} queued commands due to an exception")
+            self.ops, self.callbacks = [], []
+            return False
+        self.flush()
+        return False
+
+    def queue(self, args, err_msg):
+        tool, netns, cmd = _split_args(args)
+        self.ops.append((tool, netns, cmd, err_msg))
+
+    def after_flush(self, callback):
+        self.callbacks.append(callback)
+
+    def flush(self):
+        groups = {}
+        for tool, netns, cmd, err_msg in self.ops:
+            groups.setdefault((tool, netns), []).append((cmd, err_msg))
+        self.ops = []
+        callbacks, self.callbacks = self.callbacks, []
+
+        if len(groups) > 0:
+            if not os.geteuid() == 0:
+                raise IP2Error("Calls to iproute2 must be made by root!")
+
+            failures = []
+            for (tool, netns), group in groups.items():
+                failures += _run_group(tool, netns, group, self.force)
+                if failures and not self.force:
+                    break
+
+            if failures:
+                raise IP2Error('\n'.join(failures))
+
+        for callback in callbacks:
+            callback()
+
+def after_flush(callback):
+    """Calls `callback` once every command issued so far has actually been run.
+
+    That's right away outside of a batch (or with the netlink backend, which never
+    queues anything). Within one, it's once the innermost batch is flushed, and never
+    if that fails.
+    """
+    active_batch = _active_batch()
+    if active_batch == None or cmds._backend == "netlink":
+        callback()
+    else:
+        active_batch.after_flush(callback)
+
+def _split_args(args):
+    if len(args) > 2 and args[1] == '-n':
+        return args[0], args[2], args[3:]
+    return args[0], None, args[1:]
+
+def _run_group(tool, netns, cmds, force):
+    args = [tool]
+    if netns:
+        args += ['-n', netns]
+    if force:
+        args.append('-force')
+    args += ['-batch', '-']
+
+    log.debug(f"Flushing {len(cmds)} commands through `{' '.join(args)}`")
+    res = subprocess.run(
+        args,
+        input = '\n'.join([' '.join(cmd) for cmd, _ in cmds]) + '\n',
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.PIPE,
+        text = True
+    )
+
+    if res.returncode == 0:
+        return []
+
+    failures, reason = [], []
+    for line in res.stderr.splitlines():
+        match = _failed_line.match(line)
+        if not match:
+            reason.append(line.strip())
+            continue
+        n_line = int(match.group(1))
+        cmd, err_msg = cmds[n_line - 1]
+        failures.append(
+            f"BATCH ERROR @ line {n_line} on netns {netns if netns else 'root'} " +
+            f"(`{tool} {' '.join(cmd)}`) - {err_msg}{': ' + ' '.join(reason) if reason else ''}"
+        )
+        reason = []
+
+    if not failures:
+        failures.append(f"BATCH ERROR on netns {netns if netns else 'root'} - {' '.join(reason)}")
+
+    return failures
@@ -1,7 +1,36 @@
-import subprocess, os
+import subprocess, os, threading
 from .exceptions import IP2Error, UtilError
+from .netlink import NetlinkError
+
+# Either `iproute2` (i.e. forking ip(8), bridge(8) and sysctl(8)) or `netlink`
+    # (i.e. talking rtnetlink over an AF_NETLINK socket from within the process).
+_backend = "iproute2"
+
+# Each thread keeps its own stack of open batches (check batch.py) so that
+    # commands issued within a `with batch():` block are queued instead of run.
+_batches = threading.local()
+
+def _active_batch():
+    stack = getattr(_batches, 'stack', None)
+    return stack[-1] if stack else None
+
+def _execute(args, err_msg, nl_op = None):
+    if nl_op != None and _backend == "netlink":
+        _nl_execute(args, err_msg, nl_op)
+        return
+
+    # A single operation might take several iproute2 commands (check link.veth.provision())
+    if isinstance(args[0], list):
+        for cmd in args:
+            _execute(cmd, err_msg)
+        return
+
+    if args[0] in ['ip', 'bridge']:
+        active_batch = _active_batch()
+        if active_batch != None:
+            active_batch.queue(args, err_msg)
+            return
 
-def _execute(args, err_msg):
     if not os.geteuid() == 0:
         if args[0] == 'ip':
             raise IP2Error("Calls to iproute2 must be made by root!")
@@ -28,7 +57,28 @@ def _execute(args, err_msg):
         else:
             raise UtilError(err_msg)
 
-def _get_value(args, err_msg):
+def _nl_execute(args, err_msg, nl_op):
+    tool = args[0][0] if isinstance(args[0], list) else args[0]
+    if not os.geteuid() == 0:
+        if tool in ['ip', 'bridge']:
+            raise IP2Error("Calls to rtnetlink must be made by root!")
+        else:
+            raise UtilError("Writing calls to sysctl must be made by root!")
+    try:
+        nl_op()
+    except NetlinkError as err:
+        if tool in ['ip', 'bridge']:
+            raise IP2Error(f"KERNEL ERROR - {err_msg} ({err.cause})")
+        else:
+            raise UtilError(f"{err_msg} ({err.cause})")
+
+def _get_value(args, err_msg, nl_op = None):
+    if nl_op != None and _backend == "netlink":
+        try:
+            return nl_op()
+        except NetlinkError as err:
+            raise UtilError(f"{err_msg} ({err.cause})")
+
     try:
         return subprocess.run(args, capture_output = True).stdout
     except subprocess.CalledProcessError:
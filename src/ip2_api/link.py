@@ -1,5 +1,6 @@
 import logging
-from .cmds import _execute
+from .cmds import _execute, _get_value
+from . import netlink, addr
 
 log = logging.getLogger(__name__)
 
@@ -13,9 +14,47 @@ class veth:
                 'type', 'veth', 'peer',
                 'name', y
             ],
-            f"Error creating veth {x}--{y}. Check it doesn't exist already!"
+            f"Error creating veth {x}--{y}. Check it doesn't exist already!",
+            nl_op = lambda: netlink.veth_add(x, y)
         )
 
+    @staticmethod
+    def provision(x, y, netns = None, master = None, peer_netns = None, peer_master = None, cidr_block = None):
+        """Creates veth x--y with both ends already where they belong and up.
+
+        This stands for create() plus connect() and activate() on each end, in two
+        messages instead of five: the pair is created with both ends in place and `x` up,
+        then `y` is brought up and enslaved to `peer_master` (check netlink.veth_provision()
+        for why the peer takes a message of its own). With iproute2 that's two commands.
+
+        Args:
+            x (str): The end going into `netns` or being enslaved to `master`.
+            y (str): The end going into `peer_netns` or being enslaved to `peer_master`.
+            netns (str, optional): Where `x` goes. Ends stay on the root netns by default.
+            master (str, optional): The bridge `x` is attached to.
+            peer_netns (str, optional): Where `y` goes.
+            peer_master (str, optional): The bridge `y` is attached to.
+            cidr_block (str, optional): An address to assign to `x`. That's a request of
+                its own, made on `x`'s netns.
+        """
+        log.debug(
+            f"Provisioning veth {x}--{y}: {x} on {netns if netns else master if master else 'root'}; " +
+            f"{y} on {peer_netns if peer_netns else peer_master if peer_master else 'root'}"
+        )
+        x_args = (['netns', netns] if netns else []) + (['master', master] if master else [])
+        y_args = ['netns', peer_netns] if peer_netns else []
+        _execute(
+            [
+                ['ip', 'link', 'add', x] + x_args + ['up', 'type', 'veth', 'peer', 'name', y] + y_args,
+                (['ip', '-n', peer_netns] if peer_netns else ['ip']) + ['link', 'set', y] +
+                    (['master', peer_master] if peer_master else []) + ['up']
+            ],
+            f"Error provisioning veth {x}--{y}. Check it doesn't exist already!",
+            nl_op = lambda: netlink.veth_provision(x, y, netns, master, peer_netns, peer_master)
+        )
+        if cidr_block:
+            addr.assign(x, cidr_block, netns)
+
     @staticmethod
     def activate(veth, netns = None):
         log.debug(f"Activating {veth} on netns {netns if netns else 'root'}")
@@ -26,7 +65,8 @@ class veth:
 
         _execute(
             args,
-            f"Error activating veth {veth}"
+            f"Error activating veth {veth}",
+            nl_op = lambda: netlink.link_up(veth, netns)
         )
 
     @staticmethod
@@ -38,7 +78,8 @@ class veth:
                 'netns' if host else 'master',
                 node
             ],
-            f"Error connectig {veth} to {node}"
+            f"Error connectig {veth} to {node}",
+            nl_op = lambda: netlink.link_set_netns(veth, node) if host else netlink.link_set_master(veth, node)
         )
 
     @staticmethod
@@ -51,9 +92,14 @@ class veth:
 
         _execute(
             args,
-            f"Error removing veth {veth} on netns {netns if netns else 'root'}"
+            f"Error removing veth {veth} on netns {netns if netns else 'root'}",
+            nl_op = lambda: netlink.link_del(veth, netns)
         )
 
+    @staticmethod
+    def exists(veth, netns = None):
+        return _link_exists(veth, netns)
+
 class bridge:
     @staticmethod
     def create(name):
@@ -63,7 +109,8 @@ class bridge:
                 'ip', 'link', 'add', 'name',
                 name, 'type', 'bridge'
             ],
-            f"Error creating bridge {name}. Check it doesn't exist already!"
+            f"Error creating bridge {name}. Check it doesn't exist already!",
+            nl_op = lambda: netlink.bridge_add(name)
         )
 
     @staticmethod
@@ -71,7 +118,8 @@ class bridge:
         log.debug(f"Activating bridge {name}")
         _execute(
             ['ip', 'link', 'set', name, 'up'],
-            f"Error activating bridge {name}"
+            f"Error activating bridge {name}",
+            nl_op = lambda: netlink.link_up(name)
         )
 
     @staticmethod
@@ -79,7 +127,8 @@ class bridge:
         log.debug(f"Enabling VLAN filtering on bridge {name}")
         _execute(
             ['ip', 'link', 'set', name, 'type', 'bridge', 'vlan_filtering', '1'],
-            f"Error enabling VLAN filtering on bridge {name}"
+            f"Error enabling VLAN filtering on bridge {name}",
+            nl_op = lambda: netlink.bridge_vlan_filtering(name, True)
         )
 
     @staticmethod
@@ -87,7 +136,8 @@ class bridge:
         log.debug(f"Enabling VLAN filtering on bridge {name}")
         _execute(
             ['ip', 'link', 'set', name, 'type', 'bridge', 'vlan_filtering', '0'],
-            f"Error enabling VLAN filtering on bridge {name}"
+            f"Error enabling VLAN filtering on bridge {name}",
+            nl_op = lambda: netlink.bridge_vlan_filtering(name, False)
         )
 
     @staticmethod
@@ -95,5 +145,42 @@ class bridge:
         log.debug(f"Removing bridge {name}")
         _execute(
             ['ip', 'link', 'del', name],
-            f"Error deleting bridge {name}"
+            f"Error deleting bridge {name}",
+            nl_op = lambda: netlink.link_del(name)
+        )
+
+    @staticmethod
+    def exists(name):
+        return _link_exists(name)
+
+class macvlan:
+    """Child interfaces sharing their parent's link, each with a MAC address of its own.
+
+    Children are created right within their network namespace and, in bridge mode,
+    reach each other straight through the parent without going through a bridge.
+    Remove them as any other interface (e.g. through `veth.remove()`).
+    """
+    kind, mode = "macvlan", "bridge"
+
+    @classmethod
+    def create(cls, name, parent, netns = None):
+        log.debug(f"Creating {cls.kind} {name} on {parent} (netns {netns if netns else 'root'})")
+        _execute(
+            ['ip', 'link', 'add', name, 'link', parent] + (['netns', netns] if netns else []) +
+                ['type', cls.kind, 'mode', cls.mode],
+            f"Error creating {cls.kind} {name} on {parent}. Check it doesn't exist already!",
+            nl_op = lambda: netlink.sublink_add(name, parent, cls.kind, netns)
         )
+
+class ipvlan(macvlan):
+    """Just like macvlan, but children share their parent's MAC address (i.e. L2 mode)."""
+    kind, mode = "ipvlan", "l2"
+
+def _link_exists(name, netns = None):
+    # `ip link show` prints nothing on stdout for missing interfaces
+    args = ['ip', '-n', netns, '-o', 'link', 'show', 'dev', name] if netns else ['ip', '-o', 'link', 'show', 'dev', name]
+    return bool(_get_value(
+        args,
+        f"Error looking for {name} on netns {netns if netns else 'root'}",
+        nl_op = lambda: netlink.link_exists(name, netns)
+    ))
@@ -0,0 +1,441 @@
+import logging, socket, struct, os, threading, contextlib, ctypes, collections, errno
+
+log = logging.getLogger(__name__)
+
+# Be sure to check the following for some background:
+    # rtnetlink(7) -> https://man7.org/linux/man-pages/man7/rtnetlink.7.html
+    # netlink(7) -> https://man7.org/linux/man-pages/man7/netlink.7.html
+    # Message layouts -> include/uapi/linux/{netlink,rtnetlink,if_link,if_addr,if_bridge}.h
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+
+NLM_F_REQUEST, NLM_F_ACK = 0x1, 0x4
+NLM_F_ROOT, NLM_F_MATCH = 0x100, 0x200
+NLM_F_DUMP = NLM_F_ROOT | NLM_F_MATCH
+NLM_F_REPLACE, NLM_F_EXCL, NLM_F_CREATE = 0x100, 0x200, 0x400
+
+RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK, RTM_SETLINK = 16, 17, 18, 19
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+RTM_NEWROUTE, RTM_DELROUTE = 24, 25
+
+AF_BRIDGE = 7
+
+IFF_UP = 0x1
+
+IFLA_IFNAME, IFLA_LINK, IFLA_MASTER, IFLA_LINKINFO = 3, 5, 10, 18
+IFLA_AF_SPEC, IFLA_NET_NS_FD = 26, 28
+IFLA_INFO_KIND, IFLA_INFO_DATA = 1, 2
+VETH_INFO_PEER = 1
+IFLA_VLAN_ID = 1
+IFLA_VRF_TABLE = 1
+IFLA_MACVLAN_MODE, MACVLAN_MODE_BRIDGE = 1, 4
+IFLA_IPVLAN_MODE, IPVLAN_MODE_L2 = 1, 0
+IFLA_BR_VLAN_FILTERING = 7
+
+IFLA_BRIDGE_FLAGS, IFLA_BRIDGE_VLAN_INFO = 0, 2
+BRIDGE_FLAGS_MASTER = 0x1
+BRIDGE_VLAN_INFO_PVID, BRIDGE_VLAN_INFO_UNTAGGED = 0x2, 0x4
+BRIDGE_VLAN_INFO_RANGE_BEGIN, BRIDGE_VLAN_INFO_RANGE_END = 0x8, 0x10
+
+IFA_ADDRESS, IFA_LOCAL, IFA_BROADCAST = 1, 2, 4
+
+RTA_DST, RTA_OIF, RTA_GATEWAY, RTA_TABLE = 1, 4, 5, 15
+RT_TABLE_UNSPEC, RT_TABLE_MAIN, RTPROT_BOOT, RTN_UNICAST = 0, 254, 3, 1
+RT_SCOPE_UNIVERSE, RT_SCOPE_LINK, RT_SCOPE_NOWHERE = 0, 253, 255
+
+CLONE_NEWNET = 0x40000000
+
+# Each cached socket holds a file descriptor: keep well below the default 1024 fd limit
+MAX_SOCKETS = 256
+
+_nlmsghdr = struct.Struct("IHHII")
+_rtattr = struct.Struct("HH")
+_ifinfomsg = struct.Struct("BxHiII")
+_ifaddrmsg = struct.Struct("BBBBI")
+_rtmsg = struct.Struct("BBBBBBBBI")
+
+class NetlinkError(Exception):
+    """Exception representing an error reported by the kernel over an rtnetlink socket."""
+    def __init__(self, code, cause = None):
+        self.code = code
+        self.cause = cause if cause else os.strerror(code)
+
+    def __str__(self):
+        return self.cause
+
+class _SocketClosed(Exception):
+    """Raised by sockets used after being evicted from the cache."""
+
+def available():
+    """Returns whether the rtnetlink backend can be used on this system."""
+    return hasattr(socket, "AF_NETLINK") and os.path.exists("/proc/self/ns/net")
+
+_libc = None
+
+def _setns(fd):
+    global _libc
+    if hasattr(os, "setns"):
+        os.setns(fd, CLONE_NEWNET)
+        return
+    if _libc == None:
+        _libc = ctypes.CDLL(None, use_errno = True)
+    if _libc.setns(fd, CLONE_NEWNET) != 0:
+        code = ctypes.get_errno()
+        raise NetlinkError(code, f"setns(): {os.strerror(code)}")
+
+def _netns_path(netns):
+    return f"/var/run/netns/{netns}" if netns else "/proc/self/ns/net"
+
+def _open_netns(netns):
+    try:
+        return os.open(_netns_path(netns), os.O_RDONLY)
+    except OSError as err:
+        raise NetlinkError(err.errno, f"Couldn't open netns {netns}: {err.strerror}")
+
+@contextlib.contextmanager
+def in_netns(netns):
+    """Runs the enclosed block within `netns`. Only the calling thread is moved."""
+    if netns == None:
+        yield
+        return
+
+    own = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    try:
+        target = _open_netns(netns)
+        try:
+            _setns(target)
+        finally:
+            os.close(target)
+        try:
+            yield
+        finally:
+            _setns(own)
+    finally:
+        os.close(own)
+
+def _netns_id(netns):
+    # /var/run/netns/<name> is usually a symlink to /proc/<pid>/ns/net: stat()
+        # follows it so that a recreated namespace can be told apart.
+    try:
+        st = os.stat(_netns_path(netns))
+    except OSError as err:
+        raise NetlinkError(err.errno, f"Couldn't find netns {netns}: {err.strerror}")
+    return st.st_dev, st.st_ino
+
+class _socket:
+    def __init__(self, netns, ns_id):
+        self.netns, self.ns_id, self.seq = netns, ns_id, 0
+        self.lock = threading.Lock()
+        with in_netns(netns):
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+
+    def close(self):
+        with self.lock:
+            self.sock.close()
+
+    def request(self, msg_type, flags, payload):
+        with self.lock:
+            # Another thread might have evicted (and closed) us after we were handed out
+            if self.sock.fileno() < 0:
+                raise _SocketClosed()
+            try:
+                return self._request(msg_type, flags, payload)
+            except OSError as err:
+                raise NetlinkError(err.errno, f"Error talking to rtnetlink on netns {self.netns if self.netns else 'root'}: {err.strerror}")
+
+    def _request(self, msg_type, flags, payload):
+        self.seq += 1
+        seq = self.seq
+        self.sock.send(_nlmsghdr.pack(_nlmsghdr.size + len(payload), msg_type, flags, seq, 0) + payload)
+
+        replies = []
+        while True:
+            data = self.sock.recv(1 << 16)
+            offset = 0
+            while offset < len(data):
+                length, r_type, _, r_seq, _ = _nlmsghdr.unpack_from(data, offset)
+                body = data[offset + _nlmsghdr.size:offset + length]
+                offset += _align(length)
+                if r_seq != seq:
+                    continue
+                if r_type == NLMSG_ERROR:
+                    code = -struct.unpack_from("i", body)[0]
+                    if code != 0:
+                        raise NetlinkError(code)
+                    return replies
+                if r_type == NLMSG_DONE:
+                    return replies
+                replies.append((r_type, body))
+                if not flags & (NLM_F_ACK | NLM_F_DUMP):
+                    return replies
+
+_sockets = collections.OrderedDict()
+_sockets_lock = threading.Lock()
+
+def _get_socket(netns):
+    ns_id = _netns_id(netns)
+    with _sockets_lock:
+        sock = _sockets.get(netns)
+        if sock != None and sock.ns_id != ns_id:
+            log.debug(f"Netns {netns if netns else 'root'} has been recreated: reopening its socket")
+            sock.close()
+            sock = None
+        if sock == None:
+            sock = _socket(netns, ns_id)
+            _sockets[netns] = sock
+            if len(_sockets) > MAX_SOCKETS:
+                _sockets.popitem(last = False)[1].close()
+        else:
+            _sockets.move_to_end(netns)
+    return sock
+
+def forget(netns):
+    """Closes the socket cached for `netns`, if any."""
+    with _sockets_lock:
+        sock = _sockets.pop(netns, None)
+    if sock != None:
+        sock.close()
+
+def _request(netns, msg_type, flags, payload):
+    try:
+        return _get_socket(netns).request(msg_type, flags | NLM_F_REQUEST, payload)
+    except _SocketClosed:
+        # Nothing was sent: just go again on a fresh socket
+        return _get_socket(netns).request(msg_type, flags | NLM_F_REQUEST, payload)
+
+def _align(length):
+    return (length + 3) & ~3
+
+def _attr(attr_type, data):
+    raw = _rtattr.pack(_rtattr.size + len(data), attr_type) + data
+    return raw + b"\0" * (_align(len(raw)) - len(raw))
+
+def _nested(attr_type, *attrs):
+    return _attr(attr_type, b"".join(attrs))
+
+def _ifname(name):
+    return _attr(IFLA_IFNAME, name.encode() + b"\0")
+
+def _parse_attrs(data, offset = 0):
+    attrs = {}
+    while offset + _rtattr.size <= len(data):
+        length, attr_type = _rtattr.unpack_from(data, offset)
+        if length < _rtattr.size:
+            break
+        attrs[attr_type] = data[offset + _rtattr.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+def _parse_cidr(cidr):
+    addr, prefix = cidr.split('/') if '/' in cidr else (cidr, 32)
+    return socket.inet_aton(addr), int(prefix)
+
+def get_index(name, netns = None):
+    """Returns the index of interface `name` within `netns`."""
+    replies = _request(netns, RTM_GETLINK, 0, _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _ifname(name))
+    return _ifinfomsg.unpack_from(replies[0][1])[2]
+
+def link_exists(name, netns = None):
+    """Returns whether interface `name` exists within `netns`. Missing namespaces hold nothing."""
+    try:
+        get_index(name, netns)
+        return True
+    except NetlinkError as err:
+        if err.code in [errno.ENODEV, errno.ENOENT]:
+            return False
+        raise err
+
+def _setlink(name, attrs = b"", flags = 0, change = 0, netns = None):
+    _request(netns, RTM_SETLINK, NLM_F_ACK, _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, flags, change) + _ifname(name) + attrs)
+
+def link_add(name, kind, info_data = b"", attrs = b"", netns = None, flags = 0):
+    linkinfo = _attr(IFLA_INFO_KIND, kind.encode())
+    if info_data:
+        linkinfo += _attr(IFLA_INFO_DATA, info_data)
+    _request(
+        netns, RTM_NEWLINK, NLM_F_ACK | NLM_F_CREATE | NLM_F_EXCL,
+        _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, flags, flags) + _ifname(name) + attrs + _attr(IFLA_LINKINFO, linkinfo)
+    )
+
+def veth_add(x, y, netns = None):
+    link_add(x, "veth", _attr(VETH_INFO_PEER, _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _ifname(y)), netns = netns)
+
+def veth_provision(x, y, target = None, master = None, peer_target = None, peer_master = None):
+    """Creates veth x--y with both ends where they belong and up: an RTM_NEWLINK and an RTM_SETLINK.
+
+    The RTM_NEWLINK creates the pair with `x` within `target`, enslaved to `master` and
+    up, and `y` within `peer_target`. The kernel configures the peer before pairing it,
+    so it can't be brought up there (that fails with ENOTCONN), and it ignores a master
+    for it: the RTM_SETLINK brings `y` up and enslaves it to `peer_master`.
+    """
+    fds = [_open_netns(netns) if netns else None for netns in [target, peer_target]]
+    try:
+        attrs, peer_attrs = b"", b""
+        if fds[0] != None:
+            attrs += _attr(IFLA_NET_NS_FD, struct.pack("I", fds[0]))
+        if master:
+            attrs += _attr(IFLA_MASTER, struct.pack("I", get_index(master, target)))
+        if fds[1] != None:
+            peer_attrs += _attr(IFLA_NET_NS_FD, struct.pack("I", fds[1]))
+        link_add(
+            x, "veth", _attr(VETH_INFO_PEER, _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _ifname(y) + peer_attrs),
+            attrs, flags = IFF_UP
+        )
+    finally:
+        for fd in fds:
+            if fd != None:
+                os.close(fd)
+    link_setup(y, peer_master, peer_target)
+
+def vlan_add(name, parent, vid, netns = None):
+    link_add(
+        name, "vlan", _attr(IFLA_VLAN_ID, struct.pack("H", vid)),
+        attrs = _attr(IFLA_LINK, struct.pack("I", get_index(parent, netns))), netns = netns
+    )
+
+def sublink_add(name, parent, kind, target = None, netns = None):
+    """Creates a macvlan (bridge mode) or ipvlan (L2 mode) child of `parent`, right within `target`."""
+    if kind == "macvlan":
+        info_data = _attr(IFLA_MACVLAN_MODE, struct.pack("I", MACVLAN_MODE_BRIDGE))
+    else:
+        info_data = _attr(IFLA_IPVLAN_MODE, struct.pack("H", IPVLAN_MODE_L2))
+    attrs = _attr(IFLA_LINK, struct.pack("I", get_index(parent, netns)))
+    fd = _open_netns(target) if target else None
+    try:
+        if fd != None:
+            attrs += _attr(IFLA_NET_NS_FD, struct.pack("I", fd))
+        link_add(name, kind, info_data, attrs, netns = netns)
+    finally:
+        if fd != None:
+            os.close(fd)
+
+def vrf_add(name, table, netns = None):
+    link_add(name, "vrf", _attr(IFLA_VRF_TABLE, struct.pack("I", table)), netns = netns)
+
+def bridge_add(name, netns = None):
+    link_add(name, "bridge", netns = netns)
+
+def link_del(name, netns = None):
+    _request(netns, RTM_DELLINK, NLM_F_ACK, _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _ifname(name))
+
+def link_up(name, netns = None):
+    _setlink(name, flags = IFF_UP, change = IFF_UP, netns = netns)
+
+def link_setup(name, master = None, netns = None):
+    """Brings `name` up, enslaving it to `master` on the way."""
+    attrs = _attr(IFLA_MASTER, struct.pack("I", get_index(master, netns))) if master else b""
+    _setlink(name, attrs, flags = IFF_UP, change = IFF_UP, netns = netns)
+
+def link_set_netns(name, target, netns = None):
+    fd = _open_netns(target)
+    try:
+        _setlink(name, _attr(IFLA_NET_NS_FD, struct.pack("I", fd)), netns = netns)
+    finally:
+        os.close(fd)
+
+def link_set_master(name, master, netns = None):
+    _setlink(name, _attr(IFLA_MASTER, struct.pack("I", get_index(master, netns))), netns = netns)
+
+def bridge_vlan_filtering(name, enable, netns = None):
+    _request(
+        netns, RTM_NEWLINK, NLM_F_ACK,
+        _ifinfomsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _ifname(name) + _nested(
+            IFLA_LINKINFO,
+            _attr(IFLA_INFO_KIND, b"bridge"),
+            _nested(IFLA_INFO_DATA, _attr(IFLA_BR_VLAN_FILTERING, struct.pack("B", 1 if enable else 0)))
+        )
+    )
+
+def addr_replace(iface, cidr, netns = None):
+    addr, prefix = _parse_cidr(cidr)
+    attrs = _attr(IFA_LOCAL, addr) + _attr(IFA_ADDRESS, addr)
+    # Mimic `brd +`: point-to-point prefixes don't get a broadcast address
+    if prefix < 31:
+        host_mask = (1 << (32 - prefix)) - 1
+        attrs += _attr(IFA_BROADCAST, struct.pack("!I", struct.unpack("!I", addr)[0] | host_mask))
+    _request(
+        netns, RTM_NEWADDR, NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE,
+        _ifaddrmsg.pack(socket.AF_INET, prefix, 0, RT_SCOPE_UNIVERSE, get_index(iface, netns)) + attrs
+    )
+
+def addr_flush(iface, netns = None):
+    index = get_index(iface, netns)
+    for _, body in _request(netns, RTM_GETADDR, NLM_F_DUMP, _ifaddrmsg.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+        family, prefix, flags, scope, a_index = _ifaddrmsg.unpack_from(body)
+        if a_index != index or scope != RT_SCOPE_UNIVERSE:
+            continue
+        _request(netns, RTM_DELADDR, NLM_F_ACK, body)
+
+def _route_msg(dest, gw, delete = False, table = None, dev = None, netns = None):
+    if dest == "default":
+        dst, prefix = b"", 0
+    else:
+        dst, prefix = _parse_cidr(dest)
+    # Tables beyond 255 don't fit in the header: they go in RTA_TABLE alone
+    rtm_table = RT_TABLE_MAIN if table == None else (table if table < 256 else RT_TABLE_UNSPEC)
+    if delete:
+        rtm = _rtmsg.pack(socket.AF_INET, prefix, 0, 0, rtm_table, 0, RT_SCOPE_NOWHERE, 0, 0)
+    else:
+        # Routes without a gateway (i.e. `dev` alone) reach directly connected destinations
+        scope = RT_SCOPE_UNIVERSE if gw != None else RT_SCOPE_LINK
+        rtm = _rtmsg.pack(socket.AF_INET, prefix, 0, 0, rtm_table, RTPROT_BOOT, scope, RTN_UNICAST, 0)
+    attrs = _attr(RTA_DST, dst) if dst else b""
+    if gw != None:
+        attrs += _attr(RTA_GATEWAY, socket.inet_aton(gw))
+    if dev != None:
+        attrs += _attr(RTA_OIF, struct.pack("I", get_index(dev, netns)))
+    if table != None:
+        attrs += _attr(RTA_TABLE, struct.pack("I", table))
+    return rtm + attrs
+
+def route_replace(dest, gw, netns = None, table = None, dev = None):
+    _request(
+        netns, RTM_NEWROUTE, NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE,
+        _route_msg(dest, gw, table = table, dev = dev, netns = netns)
+    )
+
+def route_del(dest, gw, netns = None):
+    _request(netns, RTM_DELROUTE, NLM_F_ACK, _route_msg(dest, gw, delete = True))
+
+def _vlan_info(vid_range, flags):
+    if len(vid_range) == 1:
+        return _attr(IFLA_BRIDGE_VLAN_INFO, struct.pack("HH", flags, vid_range[0]))
+    return _attr(IFLA_BRIDGE_VLAN_INFO, struct.pack("HH", flags | BRIDGE_VLAN_INFO_RANGE_BEGIN, vid_range[0])) + \
+        _attr(IFLA_BRIDGE_VLAN_INFO, struct.pack("HH", flags | BRIDGE_VLAN_INFO_RANGE_END, vid_range[1]))
+
+def bridge_vlan(iface, vid_range, pvid_untagged = False, delete = False, netns = None):
+    flags = BRIDGE_VLAN_INFO_PVID | BRIDGE_VLAN_INFO_UNTAGGED if pvid_untagged else 0
+    _request(
+        netns, RTM_DELLINK if delete else RTM_SETLINK, NLM_F_ACK,
+        _ifinfomsg.pack(AF_BRIDGE, 0, get_index(iface, netns), 0, 0) + _nested(
+            IFLA_AF_SPEC,
+            _attr(IFLA_BRIDGE_FLAGS, struct.pack("H", BRIDGE_FLAGS_MASTER)),
+            _vlan_info(vid_range, flags)
+        )
+    )
+
+def _sysctl_path(name):
+    return "/proc/sys/" + name.replace('.', '/')
+
+def mkdir(path):
+    try:
+        os.makedirs(path, exist_ok = True)
+    except OSError as err:
+        raise NetlinkError(err.errno, f"Couldn't create {path}: {err.strerror}")
+
+def sysctl_read(name, netns = None):
+    try:
+        with in_netns(netns), open(_sysctl_path(name)) as f:
+            return f.read().strip()
+    except OSError as err:
+        raise NetlinkError(err.errno, f"Couldn't read {name}: {err.strerror}")
+
+def sysctl_write(name, value, netns = None):
+    try:
+        with in_netns(netns), open(_sysctl_path(name), 'w') as f:
+            f.write(f"{value}\n")
+    except OSError as err:
+        raise NetlinkError(err.errno, f"Couldn't write {name}: {err.strerror}")
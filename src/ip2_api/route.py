@@ -1,19 +1,35 @@
 import logging
 
 from .cmds import _execute
+from . import netlink
 
 log = logging.getLogger(__name__)
 
-def assign(dest, gw, netns = None):
-    log.debug(f"Assigning route to {dest} via {gw} on netns {netns if netns else 'root'}")
-    if netns:
-        args = ['ip', '-n', netns, 'route', 'replace', dest, 'via', gw]
-    else:
-        args = ['ip', 'route', 'replace', dest, 'via', gw]
+def assign(dest, gw, netns = None, table = None, dev = None):
+    """Adds (or replaces) a route towards `dest`.
+
+    Args:
+        dest (str): The destination in CIDR notation or `default`.
+        gw (str): The gateway's address. Leave it as None to reach `dest` directly through `dev`.
+        netns (str, optional): The network namespace to add the route in.
+        table (int, optional): The routing table to add the route to. Defaults to the main one.
+        dev (str, optional): The interface to send traffic through. It can belong to another
+            VRF than `table`'s, which leaks the route across them.
+    """
+    log.debug(f"Assigning route to {dest} via {gw if gw else dev} on netns {netns if netns else 'root'}{f' (table {table})' if table else ''}")
+    args = ['ip', '-n', netns] if netns else ['ip']
+    args += ['route', 'replace', dest]
+    if gw != None:
+        args += ['via', gw]
+    if dev != None:
+        args += ['dev', dev]
+    if table != None:
+        args += ['table', f"{table}"]
 
     _execute(
         args,
-        f"Error adding route to {dest} via {gw} on host {netns if netns else 'root'}"
+        f"Error adding route to {dest} via {gw if gw else dev} on host {netns if netns else 'root'}",
+        nl_op = lambda: netlink.route_replace(dest, gw, netns, table, dev)
     )
 
 def remove(dest, gw, netns = None):
@@ -25,5 +41,6 @@ def remove(dest, gw, netns = None):
 
     _execute(
         args,
-        f"Error deleting route to {dest} via {gw} on host {netns if netns else 'root'}"
+        f"Error deleting route to {dest} via {gw} on host {netns if netns else 'root'}",
+        nl_op = lambda: netlink.route_del(dest, gw, netns)
     )
@@ -1,8 +1,12 @@
 import logging
+from . import cmds, netlink
 from .cmds import _execute, _get_value
+from .exceptions import UtilError
 
 log = logging.getLogger(__name__)
 
+backends = ["iproute2", "netlink"]
+
 prev_bridge_nf_call = None
 prev_ipv4_forward = None
 
@@ -13,7 +17,8 @@ def alter_ipv4_forwarding(disable = False):
         prev_ipv4_forward = int(
             _get_value(
                 ['sysctl', '-n', 'net.ipv4.ip_forward'],
-                "Error retrieving ipv4.ip_forward's value"
+                "Error retrieving ipv4.ip_forward's value",
+                nl_op = lambda: netlink.sysctl_read('net.ipv4.ip_forward')
             )
         )
 
@@ -22,7 +27,8 @@ def alter_ipv4_forwarding(disable = False):
             'sysctl', '-w',
             f'net.ipv4.ip_forward={0 if disable else 1}'
         ],
-        "Error writing to net.ipv4.ip_forward"
+        "Error writing to net.ipv4.ip_forward",
+        nl_op = lambda: netlink.sysctl_write('net.ipv4.ip_forward', 0 if disable else 1)
     )
 
 def restore_ipv4_forwarding():
@@ -32,7 +38,8 @@ def restore_ipv4_forwarding():
             'sysctl', '-w',
             f'net.ipv4.ip_forward={prev_ipv4_forward}'
         ],
-        "Error restoring ipv4.ip_forward's value"
+        "Error restoring ipv4.ip_forward's value",
+        nl_op = lambda: netlink.sysctl_write('net.ipv4.ip_forward', prev_ipv4_forward)
     )
 
 def alter_brd_iptables_calls(disable = True):
@@ -42,7 +49,8 @@ def alter_brd_iptables_calls(disable = True):
         prev_bridge_nf_call = int(
             _get_value(
                 ['sysctl', '-n', 'net.bridge.bridge-nf-call-iptables'],
-                "Error retrieving bridge-nf-call-iptables' value. The br_netfilter module might not be loaded!"
+                "Error retrieving bridge-nf-call-iptables' value. The br_netfilter module might not be loaded!",
+                nl_op = lambda: netlink.sysctl_read('net.bridge.bridge-nf-call-iptables')
             )
         )
 
@@ -51,7 +59,8 @@ def alter_brd_iptables_calls(disable = True):
             'sysctl', '-w',
             f'net.bridge.bridge-nf-call-iptables={0 if disable else 1}'
         ],
-        "Error writing to net.bridge.bridge-nf-call-iptables. The br_netfilter module might not be loaded!"
+        "Error writing to net.bridge.bridge-nf-call-iptables. The br_netfilter module might not be loaded!",
+        nl_op = lambda: netlink.sysctl_write('net.bridge.bridge-nf-call-iptables', 0 if disable else 1)
     )
 
 def restore_brd_iptables_calls():
@@ -61,12 +70,40 @@ def restore_brd_iptables_calls():
             'sysctl', '-w',
             f'net.bridge.bridge-nf-call-iptables={prev_bridge_nf_call}'
         ],
-        "Error restoring net.bridge.bridge-nf-call-iptables's value. The br_netfilter module might not be loaded!"
+        "Error restoring net.bridge.bridge-nf-call-iptables's value. The br_netfilter module might not be loaded!",
+        nl_op = lambda: netlink.sysctl_write('net.bridge.bridge-nf-call-iptables', prev_bridge_nf_call)
     )
 
 def create_netns_dir():
     log.debug("Creating the /var/run/netns directory")
     _execute(
         ['mkdir', '-p', '/var/run/netns'],
-        "Error creating the /var/run/netns directory"
+        "Error creating the /var/run/netns directory",
+        nl_op = lambda: netlink.mkdir('/var/run/netns')
     )
+
+def use_backend(backend):
+    """Selects how every call in ip2_api reaches the kernel.
+
+    Args:
+        backend (str): Either `iproute2` (i.e. fork ip(8), bridge(8) and sysctl(8))
+            or `netlink` (i.e. talk rtnetlink and write to /proc/sys from within the
+            process, reusing a socket per network namespace).
+    """
+    if backend not in backends:
+        raise UtilError(f"Unknown ip2_api backend {backend}. Choose one of {backends}")
+    if backend == "netlink" and not netlink.available():
+        raise UtilError("The netlink backend is not available on this system")
+    log.debug(f"Using the {backend} backend")
+    cmds._backend = backend
+
+def current_backend():
+    return cmds._backend
+
+def release_netns(netns):
+    """Drops whatever we hold within `netns` (i.e. the cached rtnetlink socket).
+
+    An open socket keeps a network namespace, and thus its interfaces, alive after
+    its last process is gone: call this once the namespace is no longer needed.
+    """
+    netlink.forget(netns)
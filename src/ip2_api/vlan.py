@@ -1,5 +1,6 @@
 import logging
 from .cmds import _execute
+from . import netlink
 
 log = logging.getLogger(__name__)
 
@@ -22,20 +23,52 @@ class vlan:
                 # PVID/Untagged by default. This leaves us with the [2, 4094] range seen below.
             _execute(
                 ['bridge', 'vlan', 'add', 'dev', ifaceName, 'vid', '2-4094', 'master'],
-                f"Error adding interface {ifaceName} as a trunk port"
+                f"Error adding interface {ifaceName} as a trunk port",
+                nl_op = lambda: netlink.bridge_vlan(ifaceName, (2, 4094))
             )
         else:
             log.debug(f"Adding interface {ifaceName} to VLAN with ID {self.vID}")
             _execute(
                 ['bridge', 'vlan', 'add', 'dev', ifaceName, 'vid', f'{self.vID}',
                     'pvid', 'untagged', 'master'],
-                f"Error adding interface {ifaceName} to VLAN with ID {self.vID}"
+                f"Error adding interface {ifaceName} to VLAN with ID {self.vID}",
+                nl_op = lambda: netlink.bridge_vlan(ifaceName, (self.vID,), pvid_untagged = True)
             )
 
+    def addTaggedIface(self, ifaceName):
+        log.debug(f"Adding interface {ifaceName} to VLAN with ID {self.vID} (tagged)")
+        _execute(
+            ['bridge', 'vlan', 'add', 'dev', ifaceName, 'vid', f'{self.vID}', 'master'],
+            f"Error adding interface {ifaceName} to VLAN with ID {self.vID} (tagged)",
+            nl_op = lambda: netlink.bridge_vlan(ifaceName, (self.vID,))
+        )
+
+    def addSubIface(self, parent, netns = None):
+        """Creates and activates an 802.1Q sub-interface of `parent` carrying this VLAN.
+
+        Returns:
+            str: The sub-interface's name.
+        """
+        name = f"vlan{self.vID}"
+        log.debug(f"Creating sub-interface {name} on {parent} (netns {netns if netns else 'root'})")
+        prefix = ['ip', '-n', netns] if netns else ['ip']
+        _execute(
+            prefix + ['link', 'add', 'link', parent, 'name', name, 'type', 'vlan', 'id', f'{self.vID}'],
+            f"Error creating sub-interface {name} on {parent}",
+            nl_op = lambda: netlink.vlan_add(name, parent, self.vID, netns)
+        )
+        _execute(
+            prefix + ['link', 'set', name, 'up'],
+            f"Error activating sub-interface {name}",
+            nl_op = lambda: netlink.link_up(name, netns)
+        )
+        return name
+
     def delIface(self, ifaceName):
         log.debug(f"Adding interface {ifaceName} to VLAN with ID {self.vID}")
         _execute(
             ['bridge', 'vlan', 'del', 'dev', ifaceName, 'vid', f'{self.vID}',
                 'pvid', 'untagged', 'master'],
-            f"Error adding interface {ifaceName} to VLAN with ID {self.vID}"
+            f"Error adding interface {ifaceName} to VLAN with ID {self.vID}",
+            nl_op = lambda: netlink.bridge_vlan(ifaceName, (self.vID,), pvid_untagged = True, delete = True)
         )
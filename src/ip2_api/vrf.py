@@ -0,0 +1,42 @@
+import logging
+from .cmds import _execute
+from . import netlink
+
+log = logging.getLogger(__name__)
+
+# Be sure to check the following for some background:
+    # Kernel documentation -> https://docs.kernel.org/networking/vrf.html
+
+class vrf:
+    """A Virtual Routing and Forwarding domain: an L3 master device bound to its own routing table.
+
+    Interfaces enslaved to it look their routes up in `table` alone, so several isolated
+    routing contexts can share a single network namespace.
+    """
+    def __init__(self, name, table):
+        log.debug(f"Created VRF {name} bound to table {table}")
+        self.name, self.table = name, table
+
+    def create(self, netns = None):
+        """Creates and activates the VRF device."""
+        log.debug(f"Creating VRF {self.name} on netns {netns if netns else 'root'}")
+        prefix = ['ip', '-n', netns] if netns else ['ip']
+        _execute(
+            prefix + ['link', 'add', self.name, 'type', 'vrf', 'table', f'{self.table}'],
+            f"Error creating VRF {self.name}. Check it doesn't exist already!",
+            nl_op = lambda: netlink.vrf_add(self.name, self.table, netns)
+        )
+        _execute(
+            prefix + ['link', 'set', self.name, 'up'],
+            f"Error activating VRF {self.name}",
+            nl_op = lambda: netlink.link_up(self.name, netns)
+        )
+
+    def addIface(self, ifaceName, netns = None):
+        log.debug(f"Adding interface {ifaceName} to VRF {self.name}")
+        prefix = ['ip', '-n', netns] if netns else ['ip']
+        _execute(
+            prefix + ['link', 'set', ifaceName, 'master', self.name],
+            f"Error adding interface {ifaceName} to VRF {self.name}",
+            nl_op = lambda: netlink.link_set_master(ifaceName, self.name, netns)
+        )
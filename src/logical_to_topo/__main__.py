@@ -7,6 +7,11 @@ from . import mono_router
 from . import vlans
 
 from docker_virt_net import coloured_log_formatter
+from docker_virt_net import network_instantiation as ni
+from docker_virt_net import netns_cnx as nns
+from docker_virt_net import addr_manager
+from docker_virt_net import state
+from docker_virt_net.exceptions import StateError, InstError
 
 niMap = {
     "multi-router": (
@@ -20,6 +25,8 @@ niMap = {
     )
 }
 
+log = logging.getLogger(__name__)
+
 nlMap = {
     "gexf": net_loading.loadGexf,
     "edge-list": net_loading.loadEdgeList
@@ -39,22 +46,61 @@ def main():
 
     logger.addHandler(ch)
 
-    logicalGraph = nlMap[args.format](args.logical_definition, args.directed)
+    # Deployments are recorded (check docker_virt_net/state.py) after the definition's file name
+    netName = args.logical_definition.split('/')[-1].split('.')[0]
+
+    if args.status:
+        ni.net_status(netName)
+        return
+
+    # Recorded deployments are removed without loading the (potentially huge) definition
+    if args.remove and state.exists(netName):
+        ni.delete_net(netName, fail = False)
+        return
+
+    logicalGraph = nlMap[args.format](args.logical_definition, args.directed,
+        **({"attributes": args.edge_attributes} if args.format == "edge-list" else {"cache": not args.no_cache}))
 
     if not logicalGraph:
         return -1
 
+    # Only the `multi-router` algorithm can do without per host bridges (and routers)
+    linkArgs = {"p2p": args.p2p, "vrf": args.vrf} if args.algorithm == "multi-router" else {}
+
     if args.remove:
-        niMap[args.algorithm][1](logicalGraph)
+        niMap[args.algorithm][1](logicalGraph, **linkArgs)
         return
 
+    # Only the `vlans` algorithm covers the graph with cliques
+    coverArgs = {"coverMode": args.cover, "coverBudget": args.cover_budget} if args.algorithm == "vlans" else {}
+
     if args.dump:
-        niMap[args.algorithm][2](logicalGraph, args.logical_definition.split('/')[-1].split('.')[0])
+        niMap[args.algorithm][2](logicalGraph, netName, **coverArgs, **linkArgs)
         return
 
-    niMap[args.algorithm][0](logicalGraph,
-        args.cliques, args.node_image, args.router_image, args.experiment,
-        args.skip_instantiation, args.skip_firewall, args.skip_map_upload)
+    if not args.skip_instantiation:
+        try:
+            ni._open_state(netName, "logical_to_topo", {"algorithm": args.algorithm, "definition": args.logical_definition})
+        except StateError as err:
+            log.critical(f"Error instantiating the net: {err.cause}")
+            return -1
+
+    # Nodes on bare network namespaces are told apart by their image (check docker_virt_net/netns_cnx.py)
+    nImage = nns.image(args.host_command) if args.host_backend == "netns" else args.node_image
+    rImage = nns.image(args.router_command) if args.router_backend == "netns" else args.router_image
+
+    try:
+        niMap[args.algorithm][0](logicalGraph,
+            args.cliques, nImage, rImage, args.experiment,
+            args.skip_instantiation, args.skip_firewall, args.skip_map_upload, fwMode = args.fw_mode,
+            **coverArgs, **({"trunk": args.trunk} if coverArgs else {}), **linkArgs)
+        ni._record('add_addresses', addr_manager.assignments())
+    except InstError as err:
+        log.critical(f"Error instantiating the net: {err.cause}")
+        return -1
+    finally:
+        # Keep whatever was recorded so that partial deployments can be removed too
+        ni._close_state()
     return
 
 if __name__ == "__main__":
@@ -23,7 +23,15 @@ def parse_args():
         help = "The format of the provided network definition."
     )
     parser.add_argument(
-        "-a", "--algorithm", default = "naive-multi-router",
+        "--edge-attributes", nargs = '*', default = [],
+        help = "Names of the columns following the source and destination ones in an edge-list. They become edge attributes."
+    )
+    parser.add_argument(
+        "--no-cache", action = "store_true",
+        help = "Parse GEXF definitions anew instead of loading them from (and storing them into) the cache."
+    )
+    parser.add_argument(
+        "-a", "--algorithm", default = "multi-router",
         choices = ["multi-router", "mono-router", "vlans"],
         help = "The algorithm to use for instantiating the network."
     )
@@ -35,6 +43,24 @@ def parse_args():
         "--router_image", default = "pcollado/d_router",
         help = "The Docker image to run on routers."
     )
+    parser.add_argument(
+        "--host-backend", default = "docker",
+        choices = ["docker", "netns"],
+        help = "Run hosts as docker containers or as bare network namespaces, which are far cheaper to create."
+    )
+    parser.add_argument(
+        "--router-backend", default = "docker",
+        choices = ["docker", "netns"],
+        help = "Run routers as docker containers or as bare network namespaces, which are far cheaper to create."
+    )
+    parser.add_argument(
+        "--host-command", default = None,
+        help = "Command to leave running within each host's namespace. Only applicable to the `netns` backend."
+    )
+    parser.add_argument(
+        "--router-command", default = None,
+        help = "Command to leave running within each router's namespace. Only applicable to the `netns` backend."
+    )
     parser.add_argument(
         "-e", "--experiment", action = 'store_true',
         help = "Instantiate additional infrastructure for running experiments."
@@ -43,6 +69,10 @@ def parse_args():
         "-r", "--remove", action = 'store_true',
         help = "Remove the instances of elements found on <net_definition>."
     )
+    parser.add_argument(
+        "--status", action = 'store_true',
+        help = "Show what has been recorded for the network deployed from <net_definition>."
+    )
     parser.add_argument(
         "-d", "--dump", action = 'store_true',
         help = "Dump visualisation and GEXF files for the logical and physical topologies."
@@ -51,6 +81,27 @@ def parse_args():
         "-c", "--cliques", action = 'store_true',
         help = "Dump discovered cliques. This is only applicable for the `vlans` algorithm."
     )
+    parser.add_argument(
+        "--cover", default = "greedy",
+        choices = ["greedy", "maximal"],
+        help = "How to cover the graph with cliques for the `vlans` algorithm: grow them greedily or enumerate every maximal one."
+    )
+    parser.add_argument(
+        "--cover-budget", type = float, default = None,
+        help = "Seconds to spend covering the graph with cliques. Edges left uncovered get a VLAN of their own."
+    )
+    parser.add_argument(
+        "--trunk", action = "store_true",
+        help = "Connect each host through a single trunk veth with a VLAN sub-interface per clique (`vlans` algorithm only)."
+    )
+    parser.add_argument(
+        "--p2p", action = "store_true",
+        help = "Wire each host straight to its router through a veth pair instead of a two-port bridge (`multi-router` algorithm only)."
+    )
+    parser.add_argument(
+        "--vrf", action = "store_true",
+        help = "Route for many nodes within a few shared routers, giving each node a VRF of its own (`multi-router` algorithm only)."
+    )
     parser.add_argument(
         "--directed", action = "store_true",
         help = "Whether to treat the loaded graph as a Directed Graph."
@@ -63,6 +114,11 @@ def parse_args():
         "--skip-firewall", action = "store_true",
         help = "Skip firewall rule instantiation."
     )
+    parser.add_argument(
+        "--fw-mode", default = "iptables",
+        choices = ["iptables", "nftables"],
+        help = "How routers match allowed traffic: linear iptables chains or nftables sets with O(1) lookups."
+    )
     parser.add_argument(
         "--skip-map-upload", action = "store_true",
         help = "Skip uploading the neighbour map to the nodes."
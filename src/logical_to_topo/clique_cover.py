@@ -0,0 +1,140 @@
+import logging, math, time, concurrent.futures
+
+import networkx as nx
+
+from . import placement
+
+log = logging.getLogger(__name__)
+
+# Components with fewer edges than this are covered in place: shipping them
+    # to a worker process costs more than covering them.
+parallel_threshold = 5000
+
+def _maximal_cover(graph, deadline = None):
+    """Returns every maximal clique, just like `nx.find_cliques()`.
+
+    This is exponential in the worst case: once the deadline is hit the edges not yet
+    covered by a clique are covered by themselves.
+    """
+    cliques, covered = [], set()
+    for clique in nx.find_cliques(graph):
+        cliques.append(clique)
+        covered.update(frozenset((u, v)) for i, u in enumerate(clique) for v in clique[i + 1:])
+        if deadline != None and time.time() > deadline:
+            log.warning(f"Ran out of time enumerating cliques: covering the remaining edges one by one")
+            cliques += [[u, v] for u, v in graph.edges() if frozenset((u, v)) not in covered]
+            break
+    return cliques
+
+def _greedy_cover(graph, deadline = None):
+    """Covers every edge with a clique, growing each clique greedily.
+
+    Starting from the lowest degree nodes, each uncovered edge is grown into a clique by
+    adding the common neighbour covering the most uncovered edges, as long as it covers
+    any. Every node belongs to as few cliques as we can manage without enumerating them.
+    Once the deadline is hit the remaining uncovered edges are covered by themselves.
+    """
+    # Self loops carry no traffic between hosts: a node can't be a candidate to its own clique
+    adj = {node: {v for v in neighs if v != node} for node, neighs in graph.adj.items()}
+    uncovered = {node: set(neighs) for node, neighs in adj.items()}
+
+    # Isolated nodes are cliques on their own
+    cliques = [[node] for node in adj if not adj[node]]
+
+    for u in sorted(adj, key = lambda node: len(adj[node])):
+        while uncovered[u]:
+            if deadline != None and time.time() > deadline:
+                log.warning(f"Ran out of time growing cliques: covering the remaining edges one by one")
+                return cliques + [[a, b] for a in adj for b in uncovered[a] if str(a) < str(b)]
+
+            v = min(uncovered[u], key = lambda node: len(adj[node]))
+            clique, candidates = [u, v], adj[u] & adj[v]
+            # How many uncovered edges each candidate has into the clique
+            score = {w: (u in uncovered[w]) + (v in uncovered[w]) for w in candidates}
+            while candidates:
+                # A partially grown clique is still a clique
+                if deadline != None and time.time() > deadline:
+                    break
+                w = max(candidates, key = score.__getitem__)
+                if not score[w]:
+                    break
+                clique.append(w)
+                candidates &= adj[w]
+                for node in candidates:
+                    score[node] += w in uncovered[node]
+
+            for i, a in enumerate(clique):
+                for b in clique[i + 1:]:
+                    uncovered[a].discard(b)
+                    uncovered[b].discard(a)
+            cliques.append(clique)
+    return cliques
+
+engines = {
+    "greedy": _greedy_cover,
+    "maximal": _maximal_cover
+}
+
+def cover(logicalGraph, mode = "greedy", budget = None, max_workers = None):
+    """Covers every edge of the logical graph with cliques, each becoming a VLAN.
+
+    Connected components are covered independently: large ones are handed out to a
+    pool of processes.
+
+    Args:
+        logicalGraph (nx.Graph): The graph to cover. Directed graphs are taken as undirected.
+        mode (str, optional): The engine to use (check `engines`).
+        budget (float, optional): How many seconds we can spend covering the graph. Once
+            they are over, uncovered edges are covered by themselves.
+        max_workers (int, optional): The maximum number of worker processes.
+
+    Returns:
+        list: The cliques as lists of nodes.
+    """
+    engine = engines[mode]
+    deadline = time.time() + budget if budget != None else None
+    graph = logicalGraph.to_undirected(as_view = True) if logicalGraph.is_directed() else logicalGraph
+
+    components = [graph.subgraph(comp) for comp in nx.connected_components(graph)]
+    large = [comp for comp in components if comp.number_of_edges() >= parallel_threshold]
+    # A single large component gains nothing from a process pool
+    if len(large) < 2:
+        large = []
+    log.info(f"Covering {len(components)} components ({len(large)} in parallel) with the {mode} engine")
+
+    cliques = []
+    for comp in components:
+        if not large or comp.number_of_edges() < parallel_threshold:
+            cliques += engine(comp, deadline)
+
+    if large:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers) as executor:
+            # Subgraphs are views on the whole graph: copy them so that only the component is pickled
+            for result in executor.map(engine, [nx.Graph(comp) for comp in large], [deadline] * len(large)):
+                cliques += result
+    return cliques
+
+def cost(cliques):
+    """Returns the resources instantiating a cover takes.
+
+    Returns:
+        dictionary: The number of `vlans`, host attachments (`veths`), edge `bridges` and
+            `addresses` (i.e. the size of each clique's power-of-two subnet).
+    """
+    attachments = sum(len(clique) for clique in cliques)
+    bridges = attachments // placement.capacity + 1
+    return {
+        "vlans": len(cliques),
+        # Each edge bridge hangs from the core one through its own veth
+        "veths": attachments + bridges,
+        "bridges": bridges,
+        "addresses": sum(2 ** math.ceil(math.log(len(clique) + 2, 2)) for clique in cliques)
+    }
+
+def report(cliques):
+    costs = cost(cliques)
+    log.info(
+        f"The cover takes {costs['vlans']} VLANs, {costs['veths']} veths, " +
+        f"{costs['bridges']} edge bridges and {costs['addresses']} addresses"
+    )
+    return costs
@@ -0,0 +1,114 @@
+import logging
+
+import networkx as nx
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+class csr:
+    """A read-only graph in Compressed Sparse Row format.
+
+    Node `i` is named `names[i]` and its neighbours (i.e. successors on directed graphs)
+    are `indices[indptr[i]:indptr[i + 1]]`, sorted. Undirected graphs store every edge in
+    both directions. This takes a handful of arrays regardless of the graph's size,
+    whereas networkx keeps a couple of dictionaries per node and one per edge.
+
+    Args:
+        names (np.ndarray): Node names.
+        indptr (np.ndarray): Where each node's neighbours start within `indices`.
+        indices (np.ndarray): Neighbour indexes.
+        directed (bool, optional): Whether the graph is directed.
+        attrs (dictionary, optional): Edge attribute names mapped to arrays parallel to `indices`.
+    """
+    def __init__(self, names, indptr, indices, directed = False, attrs = {}):
+        self.names, self.indptr, self.indices = names, indptr, indices
+        self.directed, self.attrs = directed, attrs
+
+    @classmethod
+    def from_edges(cls, names, src, dst, directed = False, attrs = {}):
+        """Builds the graph from parallel arrays of source and destination node indexes.
+
+        Duplicate edges are dropped, keeping the attributes of the first occurrence.
+        """
+        n = len(names)
+        if not directed:
+            src, dst = np.concatenate([src, dst]), np.concatenate([dst, src])
+            attrs = {name: np.concatenate([values, values]) for name, values in attrs.items()}
+
+        keys = src.astype(np.int64) * n + dst
+        order = np.argsort(keys, kind = "stable")
+        keys = keys[order]
+        unique = np.ones(len(keys), dtype = bool)
+        unique[1:] = keys[1:] != keys[:-1]
+        order = order[unique]
+
+        indptr = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(np.bincount(src[order], minlength = n), out = indptr[1:])
+        return cls(
+            np.asarray(names), indptr, dst[order].astype(np.int64), directed,
+            {name: values[order] for name, values in attrs.items()}
+        )
+
+    @classmethod
+    def from_nx(cls, graph):
+        names = list(graph)
+        index = {node: i for i, node in enumerate(names)}
+        edges = np.array([(index[u], index[v]) for u, v in graph.edges()], dtype = np.int64).reshape(-1, 2)
+        return cls.from_edges(np.array(names, dtype = str), edges[:, 0], edges[:, 1], graph.is_directed())
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names.tolist())
+
+    def is_directed(self):
+        return self.directed
+
+    def number_of_edges(self):
+        if self.directed:
+            return len(self.indices)
+        # Self loops are stored once
+        loops = int(np.count_nonzero(self.sources() == self.indices))
+        return (len(self.indices) + loops) // 2
+
+    def neighbours(self, i):
+        """Returns the indexes of node `i`'s neighbours."""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def sources(self):
+        """Returns the source node index of every entry in `indices`."""
+        return np.repeat(np.arange(len(self.names)), np.diff(self.indptr))
+
+    def edges(self, names = None):
+        """Returns every edge as two parallel arrays of node names.
+
+        Edges of undirected graphs show up in both directions.
+
+        Args:
+            names (np.ndarray, optional): Names to use instead of the graph's own ones.
+        """
+        names = self.names if names is None else names
+        return names[self.sources()], names[self.indices]
+
+    def relabel(self, mapping):
+        """Returns a copy whose nodes are renamed as per `mapping`. Nodes missing from it keep their name.
+
+        The arrays holding the structure are shared rather than copied.
+        """
+        names = np.array([mapping.get(name, name) for name in self.names.tolist()], dtype = str)
+        return csr(names, self.indptr, self.indices, self.directed, self.attrs)
+
+    def to_nx(self):
+        """Materialises the graph as a networkx one (e.g. for visualisation)."""
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_nodes_from(self.names.tolist())
+        src = self.sources()
+        keep = slice(None) if self.directed else src <= self.indices
+        ends = zip(self.names[src[keep]].tolist(), self.names[self.indices[keep]].tolist())
+        if not self.attrs:
+            graph.add_edges_from(ends)
+        else:
+            data = zip(*(values[keep].tolist() for values in self.attrs.values()))
+            graph.add_edges_from((u, v, dict(zip(self.attrs, values))) for (u, v), values in zip(ends, data))
+        return graph
@@ -1,4 +1,4 @@
-import logging, json, subprocess, io, tarfile, requests, time
+import logging, json, io, tarfile, requests, time
 import pathlib
 
 import networkx as nx
@@ -6,24 +6,22 @@ import networkx as nx
 from docker_virt_net import addr_manager
 from docker_virt_net import network_instantiation as ni
 from docker_virt_net import docker_cnx as dx
-from docker_virt_net import ip_utils
 from docker_virt_net import net_visualization
 from docker_virt_net.exceptions import DckError
 
 import ip2_api.addr as ipaddr
 from ip2_api.exceptions import IP2Error
-import ip2_api.route as iproute
 
 from . import utils
+from .csr import csr
 
 log = logging.getLogger(__name__)
 
-def instantiate_net(logicalGraph: nx.Graph, _, nImage, rImage, experiment = False,
-    skipInstantiation = False, skipFirewall = False, skipMapUpload = False):
+def instantiate_net(logicalGraph: csr, _, nImage, rImage, experiment = False,
+    skipInstantiation = False, skipFirewall = False, skipMapUpload = False, fwMode = "iptables"):
     if not skipInstantiation:
         ni._system_setup()
 
-    currentSubnet = "10.0.0.0/30"
     topology = nx.Graph(name = "Topology")
 
     topology.add_node("rCore", type = "router", internet_gw = False)
@@ -32,10 +30,10 @@ def instantiate_net(logicalGraph: nx.Graph, _, nImage, rImage, experiment = Fals
         ni._create_node("rCore", dx.types.router, rImage)
 
     # Pad all node names to at least 3-digit numbers
-    logicalGraph = nx.relabel_nodes(logicalGraph, {f"{i}": "0" * (3 - len(f"{i}")) + f"{i}" for i in range(100)})
+    logicalGraph = logicalGraph.relabel({f"{i}": "0" * (3 - len(f"{i}")) + f"{i}" for i in range(100)})
 
     for i, hostName in enumerate(logicalGraph):
-        brdName = f"brd{hostName}"
+        brdName, currentSubnet = f"brd{hostName}", addr_manager.request_subnet(30)
         addGraphNode(topology, brdName, hostName)
         if not skipInstantiation:
             hIface, rIfaceSubnet = addNetworkInfrastructure(brdName, hostName, nImage, i * 4)
@@ -46,19 +44,14 @@ def instantiate_net(logicalGraph: nx.Graph, _, nImage, rImage, experiment = Fals
             # Force address allocation
             addr_manager.request_ip(currentSubnet, hname = hostName)
             addr_manager.request_ip(currentSubnet, hname = "rCore")
-
-        currentSubnet = "{}/30".format(
-            addr_manager.binary_to_addr(ip_utils.addr_to_binary(currentSubnet.split("/")[0]) + 4)
-        )
+    addr_manager.subnet_utilization()
 
     if not skipFirewall:
-        configureFirewalls(logicalGraph)
+        configureFirewalls(logicalGraph, fwMode)
 
-    for node in logicalGraph:
-        if isinstance(logicalGraph, nx.DiGraph):
-            neighbourMap = genNeighbourMap(node, [e[1] for e in logicalGraph.out_edges(node)])
-        else:
-            neighbourMap = genNeighbourMap(node, logicalGraph.neighbors(node))
+    # Neighbours are successors on directed graphs
+    for i, node in enumerate(logicalGraph):
+        neighbourMap = genNeighbourMap(node, logicalGraph.names[logicalGraph.neighbours(i)].tolist())
 
         if not skipMapUpload:
             uploadNeighbourMap(node, neighbourMap)
@@ -69,25 +62,25 @@ def instantiate_net(logicalGraph: nx.Graph, _, nImage, rImage, experiment = Fals
     if experiment and not skipInstantiation:
         log.debug("Setting up additional experiment infrastructure")
         dx.link_netns("influxdb")
+        # influxdb isn't ours: only its netns link goes away along with the network
+        ni._record('add_netns', "influxdb", "/var/run/netns/influxdb")
         ni._create_bridge("brdIDB")
-        hIface, _ = ni._connect_node("influxdb", "brdIDB")
-        rIface, _ = ni._connect_node("rCore", "brdIDB")
-        ipaddr.assign(hIface, "192.168.0.2/30", netns = "influxdb")
-        ipaddr.assign(rIface, "192.168.0.1/30", netns = "rCore")
-        iproute.assign("default", "192.168.0.1", netns = "influxdb")
-        dx._allow_traffic_to_ip("rCore", "192.168.0.2")
-        dx._allow_traffic_from_ip("rCore", "192.168.0.2")
+        ni._connect_node("influxdb", "brdIDB", cidr_block = "192.168.0.2/30")
+        ni._connect_node("rCore", "brdIDB", cidr_block = "192.168.0.1/30")
+        ni._assign_route("default", "192.168.0.1", "influxdb")
+        ni._cnx("rCore")._allow_traffic_to_ip("rCore", "192.168.0.2", mode = fwMode)
+        ni._cnx("rCore")._allow_traffic_from_ip("rCore", "192.168.0.2", mode = fwMode)
 
 def remove_net(logicalGraph):
-    logicalGraph = nx.relabel_nodes(logicalGraph, {f"{i}": "0" * (3 - len(f"{i}")) + f"{i}" for i in range(100)})
-    tmp = {"bridges": ["brdIDB", "brdIDB-influxdb"], "containers": ["rCore"]}
-    subprocess.run(['rm', '-f', '/var/run/netns/influxdb'])
+    logicalGraph = logicalGraph.relabel({f"{i}": "0" * (3 - len(f"{i}")) + f"{i}" for i in range(100)})
+    # influxdb isn't ours: just drop its netns link, as recorded deployments do
+    tmp = {"bridges": ["brdIDB", "brdIDB-influxdb"], "containers": ["rCore"], "netns": ["influxdb"]}
     for node in logicalGraph:
         tmp["bridges"].append(f"brd{node}")
         tmp["containers"].append(node)
 
     log.info(f"Deleting the following instances:\n{json.dumps(tmp)}")
-    ni._undo_deployment(tmp, fail = False)
+    ni._undo_deployment(tmp, fail = False, graceful = False)
 
 def dump_graph_figure(logicalGraph, name: str):
     topology, n = nx.Graph(name = f"{name.capitalize().replace('_', ' ')} Topology"), len(logicalGraph)
@@ -97,8 +90,7 @@ def dump_graph_figure(logicalGraph, name: str):
     for i in range(n):
         addGraphNode(topology, f"brd{i}", f"h{i}")
 
-    relabeledLogicalGraph = nx.relabel_nodes(logicalGraph,
-        {node: f"h{i}" for i, node in enumerate(logicalGraph.nodes())})
+    relabeledLogicalGraph = logicalGraph.relabel({node: f"h{i}" for i, node in enumerate(logicalGraph)}).to_nx()
     relabeledLogicalGraph.graph['name'] = name.capitalize().replace('_', ' ')
 
     nx.write_gexf(topology, f"{name}_topology.gexf")
@@ -146,12 +138,13 @@ def addNetworkAddresses(addressingInfo):
     return routerSubnetIP
 
 def addHostNetworkRoutes(host, routerSubnetIP):
-    iproute.assign("default", routerSubnetIP.split("/")[0], netns = host)
+    ni._assign_route("default", routerSubnetIP.split("/")[0], host)
 
-def configureFirewalls(logicalGraph):
-    dx.apply_fw_rules("rCore", {"POLICY": "DROP", "DROP": [], "ACCEPT": [
-            (node, neigh, True) for node in logicalGraph for neigh in logicalGraph.neighbors(node)
-        ]})
+def configureFirewalls(logicalGraph, fwMode = "iptables"):
+    sources, destinations = logicalGraph.edges()
+    ni._cnx("rCore").apply_fw_rules("rCore", {"POLICY": "DROP", "DROP": [], "ACCEPT": [
+            (node, neigh, True) for node, neigh in zip(sources.tolist(), destinations.tolist())
+        ]}, mode = fwMode)
 
 def genNeighbourMap(node, neighbours):
     return {"ourIP": addr_manager.name_2_ip(node), "neighIPs": [addr_manager.name_2_ip(neigh) for neigh in neighbours]}
@@ -170,4 +163,4 @@ def uploadNeighbourMap(node, neighbourMap):
     tar_buff.seek(0, io.SEEK_SET)
     tar_data = tar_buff.read()
 
-    dx.upload_file(node, "/root", tar_data)
+    ni._cnx(node).upload_file(node, "/root", tar_data)
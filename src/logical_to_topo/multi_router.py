@@ -1,54 +1,79 @@
 import logging, json, sys
 
 import networkx as nx
+import numpy as np
 
 from docker_virt_net import addr_manager
 from docker_virt_net import network_instantiation as ni
 from docker_virt_net import docker_cnx as dx
-from docker_virt_net import ip_utils
 from docker_virt_net import net_visualization
 
 import ip2_api.addr as ipaddr
 import ip2_api.route as iproute
+import ip2_api.vrf as ipvrf
+import ip2_api.batch as ipbatch
 
 log = logging.getLogger(__name__)
 
-def instantiate_net(logicalGraph, _):
+# In VRF mode the routing contexts of this many logical nodes share a router
+vrfsPerRouter = 128
+
+# Node hI's VRF is bound to table vrfTableBase + I, clear of the reserved 253-255 ones
+vrfTableBase = 1000
+
+def instantiate_net(logicalGraph, _, nImage = "pcollado/d_host", rImage = "pcollado/d_router", experiment = False,
+    skipInstantiation = False, skipFirewall = False, skipMapUpload = False, fwMode = "iptables", p2p = False, vrf = False):
     ni._system_setup()
-    currentSubnet = "10.0.0.0/30"
     topology, nNodes = nx.Graph(name = "Topology"), len(logicalGraph)
     topology.add_node("brdCore", type = "bridge", subnet = "")
     ni._create_bridge("brdCore")
 
-    for i in range(nNodes):
-        addHost(topology, i, currentSubnet)
-
-        currentSubnet = "{}/30".format(
-            addr_manager.binary_to_addr(ip_utils.addr_to_binary(currentSubnet.split("/")[0]) + 4)
-        )
-    routeNetwork(nNodes)
-    configureFirewalls(logicalGraph)
+    if vrf:
+        for k in range(_vrfRouters(nNodes)):
+            addVRFRouter(topology, f"rV{k}", rImage)
 
-def remove_net(logicalGraph):
+    subnets = []
+    for i in range(nNodes):
+        subnets.append(addr_manager.request_subnet(30))
+        if vrf:
+            addVRFHost(topology, i, subnets[i], nImage)
+        else:
+            addHost(topology, i, subnets[i], nImage, rImage, p2p)
+    addr_manager.subnet_utilization()
+
+    if vrf:
+        routeVRFs(subnets)
+    else:
+        routeNetwork(nNodes)
+    if not skipFirewall:
+        configureFirewalls(logicalGraph, fwMode, vrf)
+
+def remove_net(logicalGraph, p2p = False, vrf = False):
     tmp = {"bridges": ["brdCore"], "containers": []}
     for i in range(len(logicalGraph)):
-        tmp["bridges"].append(f"brd{i}")
+        if not p2p and not vrf:
+            tmp["bridges"].append(f"brd{i}")
         tmp["containers"].append(f"h{i}")
-        tmp["containers"].append(f"r{i}")
+        if not vrf:
+            tmp["containers"].append(f"r{i}")
+    if vrf:
+        tmp["containers"] += [f"rV{k}" for k in range(_vrfRouters(len(logicalGraph)))]
 
     log.info(f"Deleting the following instances:\n{json.dumps(tmp)}")
-    ni._undo_deployment(tmp, fail = False)
+    ni._undo_deployment(tmp, fail = False, graceful = False)
 
-def dump_graph_figure(logicalGraph, name: str):
+def dump_graph_figure(logicalGraph, name: str, p2p = False, vrf = False):
     topology, n = nx.Graph(name = f"{name.capitalize().replace('_', ' ')} Topology"), len(logicalGraph)
 
     topology.add_node("brdCore", type = "bridge", subnet = "")
 
     for i in range(n):
-        addGraphNode(f"brd{i}", f"h{i}", f"r{i}")
+        if vrf:
+            addGraphNode(topology, None, f"h{i}", _vrfRouter(i))
+        else:
+            addGraphNode(topology, None if p2p else f"brd{i}", f"h{i}", f"r{i}")
 
-    relabeledLogicalGraph = nx.relabel_nodes(logicalGraph,
-        {node: f"h{i}" for i, node in enumerate(logicalGraph.nodes())})
+    relabeledLogicalGraph = logicalGraph.relabel({node: f"h{i}" for i, node in enumerate(logicalGraph)}).to_nx()
     relabeledLogicalGraph.graph['name'] = name.capitalize().replace('_', ' ')
 
     nx.write_gexf(topology, f"{name}_topology.gexf")
@@ -57,29 +82,39 @@ def dump_graph_figure(logicalGraph, name: str):
     nx.write_gexf(relabeledLogicalGraph, f"{name}_relabeled.gexf")
     net_visualization.show_net(relabeledLogicalGraph, f"{name}_relabeled")
 
-def addHost(graph, id, subnet):
-    brdName, hostName, routerName = f"brd{id}", f"h{id}", f"r{id}"
+def addHost(graph, id, subnet, nImage, rImage, p2p = False):
+    # Point-to-point hosts are wired straight to their router: the /30 needs no bridge
+    brdName, hostName, routerName = None if p2p else f"brd{id}", f"h{id}", f"r{id}"
     addGraphNode(graph, brdName, hostName, routerName)
-    hIface, rIfaceSubnet, rIfaceCore = addNetworkInfrastructure(brdName, hostName, routerName)
-    routerSubnetIP = addNetworkAddresses(
-        [(subnet, hostName, hIface), (subnet, routerName, rIfaceSubnet), ("172.16.0.0/12", routerName, rIfaceCore)]
-    )
-    addHostNetworkRoutes(hostName, routerSubnetIP)
+    # Bridges are recorded as they're created: that can't wait for the batch to be flushed
+    if brdName != None:
+        ni._create_bridge(brdName)
+    with ipbatch.batch():
+        hIface, rIfaceSubnet, rIfaceCore = addNetworkInfrastructure(brdName, hostName, routerName, nImage, rImage)
+        routerSubnetIP = addNetworkAddresses(
+            [(subnet, hostName, hIface), (subnet, routerName, rIfaceSubnet), ("172.16.0.0/12", routerName, rIfaceCore)]
+        )
+        addHostNetworkRoutes(hostName, routerSubnetIP)
 
 def addGraphNode(graph, bridge, host, router):
-    graph.add_node(bridge, type = "bridge", subnet = "")
     graph.add_node(host, type = "host")
-    graph.add_edge(bridge, host)
     graph.add_node(router, type = "router", internet_gw = False)
-    graph.add_edge(bridge, router)
+    if bridge == None:
+        graph.add_edge(host, router)
+    else:
+        graph.add_node(bridge, type = "bridge", subnet = "")
+        graph.add_edge(bridge, host)
+        graph.add_edge(bridge, router)
     graph.add_edge("brdCore", router)
 
-def addNetworkInfrastructure(bridge, host, router):
-    ni._create_bridge(bridge)
-    ni._create_node(host, dx.types.host, "pcollado/d_host")
-    hIface, _ = ni._connect_node(host, bridge)
-    ni._create_node(router, dx.types.router, "pcollado/d_router")
-    rIfaceSubnet, _ = ni._connect_node(router, bridge)
+def addNetworkInfrastructure(bridge, host, router, nImage, rImage):
+    ni._create_node(host, dx.types.host, nImage)
+    ni._create_node(router, dx.types.router, rImage)
+    if bridge == None:
+        hIface, rIfaceSubnet = ni._link_nodes(host, router)
+    else:
+        hIface, _ = ni._connect_node(host, bridge)
+        rIfaceSubnet, _ = ni._connect_node(router, bridge)
     rIfaceCore, _ = ni._connect_node(router, "brdCore")
 
     return hIface, rIfaceSubnet, rIfaceCore
@@ -93,10 +128,11 @@ def addNetworkAddresses(addressingInfo):
     return routerSubnetIP
 
 def addHostNetworkRoutes(host, routerSubnetIP):
-    iproute.assign("default", routerSubnetIP.split("/")[0], netns = host)
+    ni._assign_route("default", routerSubnetIP.split("/")[0], host)
 
 def routeNetwork(nNodes):
     rNames = [f"r{i}" for i in range(nNodes)]
+    tables = {sRouter: [] for sRouter in rNames}
     for tRouter in rNames:
         rawSubnet = addr_manager.name_2_ip(tRouter, -1)
         tSubnet = "{}/{}".format(
@@ -105,15 +141,85 @@ def routeNetwork(nNodes):
         )
         tIP = rawSubnet[-1].split('/')[0]
         for sRouter in rNames:
-            if sRouter == tRouter:
-                continue
-            iproute.assign(tSubnet, tIP, netns = sRouter)
-
-def configureFirewalls(logicalGraph):
-    relabeledLogicalGraph = nx.relabel_nodes(logicalGraph,
-        {node: f"h{i}" for i, node in enumerate(logicalGraph.nodes())})
-
-    for i, node in enumerate(relabeledLogicalGraph):
-        dx.apply_fw_rules(f"r{i}", {"POLICY": "DROP", "DROP": [], "ACCEPT": [
-            (node, neigh, True) for neigh in relabeledLogicalGraph.neighbors(node)
-        ]})
+            if sRouter != tRouter:
+                tables[sRouter].append((tSubnet, tIP))
+
+    # Each router's table is a single `ip -batch` and is recorded in a single transaction
+    for sRouter, table in tables.items():
+        ni._apply_route_table(sRouter, table)
+
+def configureFirewalls(logicalGraph, fwMode = "iptables", vrf = False):
+    # Host hI stands for the I-th node: no need to relabel the whole graph
+    hostNames = np.array([f"h{i}" for i in range(len(logicalGraph))])
+
+    # Shared routers enforce the rules of every node they route for
+    rules = {}
+    for i in range(len(logicalGraph)):
+        rules.setdefault(_vrfRouter(i) if vrf else f"r{i}", []).extend(
+            (f"h{i}", neigh, True) for neigh in hostNames[logicalGraph.neighbours(i)].tolist()
+        )
+
+    for router, accepted in rules.items():
+        ni._cnx(router).apply_fw_rules(router, {"POLICY": "DROP", "DROP": [], "ACCEPT": accepted}, mode = fwMode)
+
+def _vrfRouters(nNodes):
+    return (nNodes + vrfsPerRouter - 1) // vrfsPerRouter
+
+def _vrfRouter(id):
+    return f"rV{id // vrfsPerRouter}"
+
+def addVRFRouter(graph, router, rImage):
+    graph.add_node(router, type = "router", internet_gw = False)
+    graph.add_edge("brdCore", router)
+    with ipbatch.batch():
+        ni._create_node(router, dx.types.router, rImage)
+        # Requested first so that it's the address name_2_ip() hands out for the router
+        ni._connect_node(router, "brdCore", cidr_block = addr_manager.request_ip("172.16.0.0/12", hname = router))
+
+def addVRFHost(graph, id, subnet, nImage):
+    """Wires a host straight to its shared router, where the link belongs to a VRF of its own."""
+    hostName, router = f"h{id}", _vrfRouter(id)
+    addGraphNode(graph, None, hostName, router)
+    domain = ipvrf.vrf(f"vrf{id}", vrfTableBase + id)
+    with ipbatch.batch():
+        ni._create_node(hostName, dx.types.host, nImage)
+        hIface, rIface = ni._link_nodes(hostName, router)
+        domain.create(netns = router)
+        domain.addIface(rIface, netns = router)
+        routerSubnetIP = addNetworkAddresses([(subnet, hostName, hIface), (subnet, router, rIface)])
+        addHostNetworkRoutes(hostName, routerSubnetIP)
+
+def routeVRFs(subnets):
+    """Fills in the routing table of every VRF, leaking routes across them.
+
+    Each VRF reaches the other VRFs on its router through their own interfaces and the
+    ones behind other routers through the core, where a summary per router is enough.
+    The main table takes traffic coming in from the core into the right VRF. Routes are
+    programmed in bulk: that's a single `ip -batch` per router.
+
+    Args:
+        subnets (list): The subnet of every host.
+    """
+    members = {}
+    for i in range(len(subnets)):
+        members.setdefault(_vrfRouter(i), []).append(i)
+
+    summaries = {
+        router: ni._summarize_route_table([(subnets[i], addr_manager.name_2_ip(router)) for i in hosts])
+            for router, hosts in members.items()
+    }
+
+    for router, hosts in members.items():
+        coreIface = ni._veth_names(router, "brdCore")[0]
+        ifaces = {i: ni._veth_names(f"h{i}", router)[1] for i in hosts}
+        remote = [route for other, summary in summaries.items() if other != router for route in summary]
+        log.debug(f"Leaking {len(hosts) - 1} local and {len(remote)} remote routes into each of {router}'s {len(hosts)} VRFs")
+        with ipbatch.batch():
+            for i in hosts:
+                for j in hosts:
+                    if j != i:
+                        iproute.assign(subnets[j], None, router, vrfTableBase + i, ifaces[j])
+                for dest, gw in remote:
+                    iproute.assign(dest, gw, router, vrfTableBase + i, coreIface)
+            for j in hosts:
+                iproute.assign(subnets[j], None, router, dev = ifaces[j])
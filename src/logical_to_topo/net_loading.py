@@ -1,31 +1,151 @@
-import logging
+import logging, time, os, hashlib
+import xml.etree.ElementTree as ET
 
-import networkx as nx
+import numpy as np
 import pandas as pd
 
 from typing import Union
 
+from .csr import csr
+
 log = logging.getLogger(__name__)
 
-def loadGexf(defPath: str, directed: bool) -> Union[nx.Graph, None]:
+# Where parsed GEXF definitions are kept (check loadGexf())
+cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "dvnet")
+
+def loadGexf(defPath: str, directed: bool, cache: bool = True) -> Union[csr, None]:
+    """Loads a graph from a GEXF file keeping just node IDs and edges.
+
+    The file is streamed rather than parsed into a whole DOM and the result is cached
+    (check `cache_dir`) as plain arrays: loading the same, unmodified file again skips
+    parsing altogether. Just like with `nx.read_gexf()`, whether the graph is directed
+    is up to the file.
+
+    Args:
+        defPath (str): The path to the GEXF file.
+        directed (bool): Ignored: kept for the sake of a uniform interface.
+        cache (bool, optional): Whether to use (and populate) the cache.
+
+    Returns:
+        Union[csr, None]: The loaded graph or None if it couldn't be loaded.
+    """
     log.info(f"Loading graph at {defPath} (gexf)...")
+    start = time.monotonic()
     try:
-        logicalGraph = nx.read_gexf(defPath)
-    except FileNotFoundError:
+        cachePath = _cache_path(defPath)
+        if cache and os.path.exists(cachePath):
+            with np.load(cachePath) as cached:
+                nodes, edges, isDirected = cached['nodes'], cached['edges'], bool(cached['directed'])
+            log.debug(f"Loaded {defPath} from cache {cachePath}")
+        else:
+            nodes, edges, isDirected = _parse_gexf(defPath)
+            if cache:
+                _store_cache(cachePath, nodes, edges, isDirected)
+    except (FileNotFoundError, ET.ParseError, KeyError):
         log.exception("Couldn't load the graph definition")
         return None
 
+    logicalGraph = csr.from_edges(nodes, edges[:, 0], edges[:, 1], isDirected)
+    log.info(f"Loaded {logicalGraph.number_of_edges()} edges between {len(logicalGraph)} nodes in {time.monotonic() - start:.3f} s")
     return logicalGraph
 
-def loadEdgeList(defPath: str, directed: bool) -> Union[nx.Graph, None]:
+def _cache_path(defPath):
+    # Any change to the definition yields a different key
+    info = os.stat(defPath)
+    key = hashlib.sha1(f"{os.path.abspath(defPath)}:{info.st_size}:{info.st_mtime_ns}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.npz")
+
+def _parse_gexf(defPath):
+    nodes, index, edges, isDirected, container = [], {}, [], False, None
+    for event, elem in ET.iterparse(defPath, events = ("start", "end")):
+        # Drop the namespace: there are several GEXF versions around
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if event == "start":
+            if tag in ["nodes", "edges"]:
+                container = elem
+            continue
+
+        if tag == "graph":
+            isDirected |= elem.get("defaultedgetype") == "directed"
+            continue
+        elif tag == "node":
+            ends = [elem.get("id")]
+        elif tag == "edge":
+            # Edges can reference nodes which weren't declared
+            ends = [elem.get("source"), elem.get("target")]
+            isDirected |= elem.get("type") == "directed"
+        else:
+            continue
+
+        for end in ends:
+            if end not in index:
+                index[end] = len(nodes)
+                nodes.append(end)
+        if tag == "edge":
+            edges.append((index[ends[0]], index[ends[1]]))
+
+        # Drop parsed elements as we go so that memory doesn't grow with the file
+        if container != None:
+            container.clear()
+    return np.array(nodes, dtype = str), np.array(edges, dtype = np.int64).reshape(-1, 2), isDirected
+
+def _store_cache(cachePath, nodes, edges, isDirected):
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        # Write to a temporary file first so that concurrent runs never see a partial cache
+        tmpPath = f"{cachePath}.{os.getpid()}.tmp"
+        with open(tmpPath, "wb") as f:
+            np.savez(f, nodes = nodes, edges = edges, directed = np.array(isDirected))
+        os.replace(tmpPath, cachePath)
+    except OSError as err:
+        log.warning(f"Couldn't cache the graph definition at {cachePath}: {err}")
+
+def loadEdgeList(defPath: str, directed: bool, attributes: list = [], chunksize: int = 1000000) -> Union[csr, None]:
+    """Loads a graph from a headerless CSV file with an edge per line.
+
+    The file is read in chunks and each chunk's columns are turned into arrays of node
+    indexes: no rows are materialised as Python objects nor formatted back into strings.
+    Duplicate edges are dropped.
+
+    Args:
+        defPath (str): The path to the CSV file.
+        directed (bool): Whether to load the graph as a Directed Graph.
+        attributes (list, optional): Names for the columns following the source and
+            destination ones. Their values become edge attributes.
+        chunksize (int, optional): How many lines to read at once.
+
+    Returns:
+        Union[csr, None]: The loaded graph or None if it couldn't be loaded.
+    """
     log.info(f"Loading graph at {defPath} (edge-list) as a{' directed' if directed else 'n undirected'} graph...")
+    start, nLines = time.monotonic(), 0
+    # Node names mapped to their index and the (per chunk) index arrays of edge ends and attributes
+    index, src, dst, data = {}, [], [], {name: [] for name in attributes}
     try:
-        df = pd.read_csv(defPath, header = None)
-        logicalGraph = nx.parse_edgelist(
-            [f"{edge[0]} {edge[1]}" for _, edge in df.iterrows()],
-            nodetype = str,
-            create_using = nx.Graph if not directed else nx.DiGraph)
-    except (FileNotFoundError, IndexError):
+        # Node names are kept as strings just like for GEXF files
+        for chunk in pd.read_csv(defPath, header = None, usecols = range(2 + len(attributes)), dtype = {0: str, 1: str},
+                keep_default_na = False, skipinitialspace = True, chunksize = chunksize):
+            nLines += len(chunk)
+            # Only each chunk's distinct names are looked up one by one
+            codes, uniques = pd.factorize(np.concatenate([chunk[0].to_numpy(), chunk[1].to_numpy()]))
+            codes = np.array([index.setdefault(name, len(index)) for name in uniques], dtype = np.int64)[codes]
+            src.append(codes[:len(chunk)])
+            dst.append(codes[len(chunk):])
+            for i, name in enumerate(attributes):
+                data[name].append(chunk[i + 2].to_numpy())
+    except (FileNotFoundError, ValueError, pd.errors.ParserError, pd.errors.EmptyDataError):
         log.exception("Couldn't load the graph definition")
         return None
+
+    logicalGraph = csr.from_edges(
+        np.array(list(index), dtype = str), np.concatenate(src or [np.empty(0, dtype = np.int64)]),
+        np.concatenate(dst or [np.empty(0, dtype = np.int64)]), directed,
+        {name: np.concatenate(values) for name, values in data.items()}
+    )
+
+    elapsed = time.monotonic() - start
+    log.info(
+        f"Loaded {logicalGraph.number_of_edges()} edges ({nLines} lines) between {len(logicalGraph)} nodes in " +
+        f"{elapsed:.2f} s ({nLines / elapsed if elapsed else 0:.0f} lines/s)"
+    )
     return logicalGraph
@@ -0,0 +1,113 @@
+import logging, heapq
+
+log = logging.getLogger(__name__)
+
+# Linux bridges can tolerate a maximum of 1024 ports: we can use 1023 for hosts and
+    # we need a remaining one for a trunk port. We can use the following to effectively
+    # check that's the imposed limit: `echo $((( $(bridge -c vlan show | wc -l) - 1) / 2))`
+capacity = 1022
+
+def place_attachments(cliques, capacity = capacity):
+    """Places every clique's attachments (i.e. a port per member) on edge bridges.
+
+    As each attachment takes a port of its own, keeping a VLAN local just takes putting
+    all of its attachments on the same bridge: cliques are packed first-fit decreasing.
+    Cliques larger than a bridge span as few bridges as possible.
+
+    Returns:
+        list: For each clique, the index of the bridge each of its members is placed on.
+    """
+    placement, free = [None] * len(cliques), []
+    for i in sorted(range(len(cliques)), key = lambda i: len(cliques[i]), reverse = True):
+        size = len(cliques[i])
+        bridge = next((b for b, room in enumerate(free) if room >= size), None)
+        if bridge != None:
+            free[bridge] -= size
+            placement[i] = [bridge] * size
+            continue
+
+        placement[i] = []
+        while len(placement[i]) < size:
+            if not free or free[-1] == 0:
+                free.append(capacity)
+            taken = min(free[-1], size - len(placement[i]))
+            placement[i] += [len(free) - 1] * taken
+            free[-1] -= taken
+    return placement
+
+def place_hosts(cliques, capacity = capacity):
+    """Places hosts (i.e. a single trunk port each) on edge bridges.
+
+    Bridges are grown one at a time from the host belonging to the most VLANs, always
+    adding the host sharing the most VLANs with the bridge so far. This partitions the
+    clique overlap graph so that as few VLANs as possible span several bridges.
+
+    Returns:
+        list: For each clique, the index of the bridge each of its members is placed on.
+    """
+    vlans = {}
+    for i, clique in enumerate(cliques):
+        for host in clique:
+            vlans.setdefault(host, []).append(i)
+
+    seeds = iter(sorted(vlans, key = lambda host: len(vlans[host]), reverse = True))
+    bridge_of, bridge, size = {}, 0, 0
+
+    while len(bridge_of) < len(vlans):
+        present, gains, heap = set(), {}, []
+        while size < capacity:
+            # Candidates sharing VLANs with the bridge first; the next seed otherwise
+            host = None
+            while heap:
+                gain, candidate = heapq.heappop(heap)
+                if candidate not in bridge_of and -gain == gains[candidate]:
+                    host = candidate
+                    break
+            if host == None:
+                host = next((seed for seed in seeds if seed not in bridge_of), None)
+                if host == None:
+                    break
+
+            bridge_of[host] = bridge
+            size += 1
+            for vlan in vlans[host]:
+                if vlan in present:
+                    continue
+                present.add(vlan)
+                for member in cliques[vlan]:
+                    if member not in bridge_of:
+                        gains[member] = gains.get(member, 0) + 1
+                        heapq.heappush(heap, (-gains[member], member))
+        bridge, size = bridge + 1, 0
+
+    return [[bridge_of[host] for host in clique] for clique in cliques]
+
+def trunk_load(placement):
+    """Returns the VLANs each edge bridge has to carry over its trunk to the core bridge.
+
+    Args:
+        placement (list): The bridges each clique's members are placed on (check
+            `place_attachments()` and `place_hosts()`).
+
+    Returns:
+        dictionary: Bridge indexes mapped to the (clique) indexes of the VLANs spanning them
+            and some other bridge.
+    """
+    load = {bridge: [] for bridges in placement for bridge in bridges}
+    for i, bridges in enumerate(placement):
+        spanned = set(bridges)
+        if len(spanned) > 1:
+            for bridge in spanned:
+                load[bridge].append(i)
+    return load
+
+def report(placement):
+    load = trunk_load(placement)
+    spanning = {vlan for vlans in load.values() for vlan in vlans}
+    log.info(
+        f"Placed {len(placement)} VLANs on {len(load)} edge bridges: {len(spanning)} VLANs span several " +
+        f"bridges, taking {sum(len(vlans) for vlans in load.values())} VLAN trunk memberships through the core"
+    )
+    for bridge, vlans in sorted(load.items()):
+        log.debug(f"\tbrdE{bridge} carries {len(vlans)} VLANs over its trunk")
+    return load
@@ -6,6 +6,9 @@ from docker_virt_net import addr_manager
 from docker_virt_net import network_instantiation as ni
 from docker_virt_net import docker_cnx as dx
 from docker_virt_net import net_visualization
+from docker_virt_net.exceptions import InstError
+from . import clique_cover
+from . import placement
 from networkx.drawing.nx_agraph import write_dot
 
 from typing import Union
@@ -13,84 +16,84 @@ from typing import Union
 import ip2_api.link as iplink
 import ip2_api.addr as ipaddr
 import ip2_api.vlan as ipvlan
+import ip2_api.batch as ipbatch
 
 log = logging.getLogger(__name__)
 
-def instantiate_net(logicalGraph, storeCliques):
+# Each clique is a VLAN: IDs 0, 1 and 4095 are reserved (check ip2_api/vlan.py), which leaves [2, 4094]
+maxVLANs = 4093
+
+# Takes the same arguments as the other algorithms (check __main__.py): as there are no
+    # routers in a VLAN-based topology, the firewall related ones are ignored.
+def instantiate_net(logicalGraph, storeCliques, nImage = "pcollado/d_host", rImage = None, experiment = False,
+    skipInstantiation = False, skipFirewall = False, skipMapUpload = False, fwMode = "iptables",
+    coverMode = "greedy", coverBudget = None, trunk = False):
+    # Covering the graph with cliques takes networkx
+    cliques = clique_cover.cover(logicalGraph.to_nx(), coverMode, coverBudget)
+    clique_cover.report(cliques)
+    if len(cliques) > maxVLANs:
+        raise InstError(f"The graph is covered by {len(cliques)} cliques, but there are only {maxVLANs} VLAN IDs to go around")
+
+    # Keep each VLAN's members on as few edge bridges as possible
+    bridgeOf = placement.place_hosts(cliques) if trunk else placement.place_attachments(cliques)
+    trunkLoad = placement.report(bridgeOf)
+
     ni._system_setup()
 
     topology = nx.Graph(name = "Topology")
     topology.add_node("brdC", type = "bridge", subnet = "")
     ni._create_bridge("brdC")
 
-    trunkVLAN = ipvlan.vlan(0)
+    # VLAN IDs 0, 1 and 4095 are reserved (check ip2_api/vlan.py)
+    for bridge, spanning in sorted(trunkLoad.items()):
+        addEdgeBridge(topology, f"brdE{bridge}", [ipvlan.vlan(i + 2) for i in spanning])
 
-    topology.add_node("brdE0", type = "bridge", subnet = "")
-    topology.add_edge("brdC", "brdE0")
-    ni._create_bridge("brdE0")
-    iplink.bridge.enableVLAN("brdE0")
-    _, edgeIface = ni._connect_node("brdC", "brdE0", brdToBrd = True)
-    trunkVLAN.addIface(edgeIface)
+    # Each host gets a single trunk port carrying every VLAN it belongs to
+    memberships = {}
 
-    nextFreeIP, currVLANID, instantiatedEdges, currEdgeBridge = "10.0.0.0", 2, 0, "brdE0"
-
-    for clique in nx.find_cliques(logicalGraph):
+    for i, clique in enumerate(cliques):
 
         log.info(f"Taking clique {clique} into account")
 
-        cliqueSubnetIPsExp = math.ceil(math.log(len(clique) + 2, 2))
+        # Room for every host plus the network and broadcast addresses
+        cliqueSubnet = addr_manager.request_subnet(32 - math.ceil(math.log(len(clique) + 2, 2)))
 
-        binNextFreeIP = addr_manager.addr_to_binary(nextFreeIP)
-        if binNextFreeIP % (2 ** cliqueSubnetIPsExp) != 0:
-            binNextFreeIP += (2 ** cliqueSubnetIPsExp) - (binNextFreeIP % (2 ** cliqueSubnetIPsExp))
-            nextFreeIP = addr_manager.binary_to_addr(binNextFreeIP)
+        cliqueVLAN = ipvlan.vlan(i + 2)
 
-        cliqueSubnet = f"{nextFreeIP}/{32 - cliqueSubnetIPsExp}"
+        log.debug(f"Assigning addresses from subnet --> {cliqueSubnet}")
 
-        nextFreeIP = addr_manager.binary_to_addr(addr_manager.addr_to_binary(nextFreeIP) + 2 ** cliqueSubnetIPsExp)
+        if trunk:
+            for host, bridge in zip(clique, bridgeOf[i]):
+                memberships.setdefault(_container_name(host), (bridge, []))[1].append((cliqueSubnet, cliqueVLAN))
+            continue
 
-        cliqueVLAN = ipvlan.vlan(currVLANID)
-        currVLANID += 1
+        with ipbatch.batch():
+            for host, bridge in zip(clique, bridgeOf[i]):
+                addHost(topology, f"brdE{bridge}", _container_name(host), cliqueSubnet, cliqueVLAN, nImage)
 
-        log.debug(f"Assigning addresses from subnet --> {cliqueSubnet}")
+        log.debug(f"Assigned addresses -> {addr_manager.assignments()}")
 
-        for host in clique:
-            # Docker container names must be at least 2 characters long
-            if len(host) == 1:
-                host = f"0{host}"
-            log.info(f"Adding host {host}; instantiated {instantiatedEdges} edges")
-            addHost(topology, currEdgeBridge, host, cliqueSubnet, cliqueVLAN)
-            instantiatedEdges += 1
-
-            # Linux bridges can tolerate a maximum of 1024 ports: we can use 1023 for hosts and
-                # we need a remaining one for a trunk port. We can use the following to effectively
-                # check that's the imposed limit: `echo $((( $(bridge -c vlan show | wc -l) - 1) / 2))`
-            if instantiatedEdges % 1022 == 0:
-                log.info(f"Creating a new edge switch!")
-                currEdgeBridge = f"brdE{int(instantiatedEdges / 1022)}"
-                topology.add_node(currEdgeBridge, type = "bridge", subnet = "")
-                topology.add_edge("brdC", currEdgeBridge)
-                ni._create_bridge(currEdgeBridge)
-                iplink.bridge.enableVLAN(currEdgeBridge)
-                _, edgeIface = ni._connect_node("brdC", currEdgeBridge, brdToBrd = True)
-                trunkVLAN.addIface(edgeIface)
-
-        log.debug(f"Assigned addresses -> {addr_manager.assigned_addreses}")
+    for host, (bridge, vlans) in memberships.items():
+        log.info(f"Adding host {host} to {len(vlans)} VLANs on edge switch brdE{bridge}")
+        with ipbatch.batch():
+            addTrunkHost(topology, f"brdE{bridge}", host, vlans, nImage)
+
+    addr_manager.subnet_utilization()
 
 def remove_net(logicalGraph):
-    tmp = {"bridges": ["brdC", *[f"brdE{i}" for i in range(int(len(logicalGraph) / 1022))]], "containers": []}
+    tmp = {"bridges": ["brdC", *_edgeBridges()], "containers": []}
     for node in logicalGraph:
-        tmp["containers"].append(node if len(node) > 1 else '0' + node)
+        tmp["containers"].append(_container_name(node))
 
     log.info(f"Deleting the following instances:\n{json.dumps(tmp)}")
-    ni._undo_deployment(tmp, fail = False)
+    ni._undo_deployment(tmp, fail = False, graceful = False)
 
-def dump_graph_figure(logicalGraph, name: str):
+def dump_graph_figure(logicalGraph, name: str, coverMode = "greedy", coverBudget = None):
     topology = nx.MultiGraph(name = f"{name.capitalize().replace('_', ' ')} Topology")
 
     topology.add_node("brdC", type = "bridge", subnet = "")
 
-    for clique in nx.find_cliques(logicalGraph):
+    for clique in clique_cover.cover(logicalGraph.to_nx(), coverMode, coverBudget):
         log.warn(f"Taking clique {clique} into account")
 
         for host in clique:
@@ -103,16 +106,58 @@ def dump_graph_figure(logicalGraph, name: str):
 
     net_visualization.show_net(topology, f"{name}_topology")
 
-def addHost(graph, brdName, hostName, subnet, vlan):
+def _edgeBridges():
+    # How many there are depends on the cover and on the placement: look for them instead
+    return sorted(link.name for link in pathlib.Path("/sys/class/net").glob("brdE*"))
+
+def _container_name(host):
+    # Docker container names must be at least 2 characters long
+    return host if len(host) > 1 else f"0{host}"
+
+def addEdgeBridge(graph, brdName, spanningVLANs):
+    """Creates an edge bridge hanging from the core one.
+
+    Its trunk port only carries the VLANs with members on other edge bridges too: the
+    traffic of any other VLAN stays local.
+    """
+    log.info(f"Creating edge switch {brdName} ({len(spanningVLANs)} VLANs over its trunk)")
+    graph.add_node(brdName, type = "bridge", subnet = "")
+    graph.add_edge("brdC", brdName)
+    # Bridges are recorded as they're created: that can't wait for the batch to be flushed
+    ni._create_bridge(brdName)
+    with ipbatch.batch():
+        iplink.bridge.enableVLAN(brdName)
+        _, edgeIface = ni._connect_node("brdC", brdName, brdToBrd = True)
+        for vlan in spanningVLANs:
+            vlan.addTaggedIface(edgeIface)
+
+def addTrunkHost(graph, brdName, hostName, vlans, nImage = "pcollado/d_host"):
+    """Connects a host to its edge bridge through a single veth carrying all of its VLANs.
+
+    The bridge port is a tagged member of each VLAN the host belongs to and the host
+    gets an 802.1Q sub-interface (addressed from the clique's subnet) per VLAN.
+
+    Args:
+        vlans (list): (subnet, ipvlan.vlan) tuples for each clique the host belongs to.
+    """
+    graph.add_node(hostName, type = "host")
+    graph.add_edge(hostName, brdName)
+    ni._create_node(hostName, dx.types.host, nImage)
+    hIface, brdIface = ni._connect_node(hostName, brdName)
+    for subnet, vlan in vlans:
+        vlan.addTaggedIface(brdIface)
+        subIface = vlan.addSubIface(hIface, netns = hostName)
+        addNetworkAddresses(subnet, hostName, subIface)
+
+def addHost(graph, brdName, hostName, subnet, vlan, nImage = "pcollado/d_host"):
     if hostName not in graph:
         graph.add_node(hostName, type = "host")
-        ni._create_node(hostName, dx.types.host, "pcollado/d_host")
+        ni._create_node(hostName, dx.types.host, nImage)
     graph.add_edge(hostName, brdName)
-    hIface = addNetworkInfrastructure(brdName, hostName, vlan)
-    addNetworkAddresses(subnet, hostName, hIface)
+    addNetworkInfrastructure(brdName, hostName, vlan, addr_manager.request_ip(subnet, hname = hostName))
 
-def addNetworkInfrastructure(brdName, host, vlan: ipvlan.vlan):
-    hIface, brdIface = ni._connect_node(host, brdName, vID = vlan.vID)
+def addNetworkInfrastructure(brdName, host, vlan: ipvlan.vlan, cidr_block = None):
+    hIface, brdIface = ni._connect_node(host, brdName, vID = vlan.vID, cidr_block = cidr_block)
     vlan.addIface(brdIface)
     return hIface
 
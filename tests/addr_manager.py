@@ -0,0 +1,75 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the addr_manager module can be imported.
+import sys
+sys.path.insert(0, 'src/')
+
+from docker_virt_net import addr_manager
+from docker_virt_net.exceptions import InstError
+
+class TestAddrManager(unittest.TestCase):
+    def setUp(self):
+        addr_manager.reset()
+
+    def test_request_release(self):
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "A"), "10.0.0.1/24")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "B"), "10.0.0.2/24")
+        self.assertEqual(addr_manager.request_ip("10.0.1.0/24", "A"), "10.0.1.1/24")
+        self.assertEqual(addr_manager.assignments(), {"A": ["10.0.0.1/24", "10.0.1.1/24"], "B": ["10.0.0.2/24"]})
+        self.assertEqual(addr_manager.owner("10.0.0.2"), "B")
+
+        addr_manager.release_ip("10.0.0.1/24")
+        self.assertEqual(addr_manager.owner("10.0.0.1"), None)
+        self.assertEqual(addr_manager.name_2_ip("A"), "10.0.1.1")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "C"), "10.0.0.1/24")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "C"), "10.0.0.3/24")
+
+    def test_restore(self):
+        addr_manager.restore({"A": ["10.0.0.7/24"]})
+        self.assertEqual(addr_manager.name_2_ip("A", -1), ["10.0.0.7/24"])
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "B"), "10.0.0.8/24")
+
+    def test_double_release(self):
+        addr_manager.request_ip("10.0.0.0/24", "A")
+        addr_manager.release_ip("10.0.0.1/24")
+        self.assertRaises(InstError, addr_manager.release_ip, "10.0.0.1/24")
+        self.assertRaises(InstError, addr_manager.release_ip, "10.0.0.9/24")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "B"), "10.0.0.1/24")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "C"), "10.0.0.2/24")
+
+    def test_restore_released(self):
+        addr_manager.request_ip("10.0.0.0/24", "X")
+        addr_manager.release_ip("10.0.0.1/24")
+        addr_manager.restore({"B": ["10.0.0.1/24"]})
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "C"), "10.0.0.2/24")
+
+        # Restoring an address held by someone else hands it over
+        addr_manager.restore({"D": ["10.0.0.2/24"]})
+        self.assertEqual(addr_manager.assignments(), {"B": ["10.0.0.1/24"], "D": ["10.0.0.2/24"]})
+        self.assertEqual(addr_manager.owner("10.0.0.2"), "D")
+
+    def test_exhaustion(self):
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/30"), "10.0.0.1/30")
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/30"), "10.0.0.2/30")
+        self.assertRaises(InstError, addr_manager.request_ip, "10.0.0.0/30")
+
+    def test_buddy_subnets(self):
+        self.assertEqual(addr_manager.request_subnet(30), "10.0.0.0/30")
+        self.assertEqual(addr_manager.request_subnet(29), "10.0.0.8/29")
+        # The /30 fills the hole the /29 left behind
+        self.assertEqual(addr_manager.request_subnet(30), "10.0.0.4/30")
+        self.assertEqual(addr_manager.subnet_utilization()["10.0.0.0/8"]["allocated"], 16)
+
+        for subnet in ["10.0.0.0/30", "10.0.0.8/29", "10.0.0.4/30"]:
+            addr_manager.release_subnet(subnet)
+        self.assertEqual(addr_manager.subnet_utilization()["10.0.0.0/8"]["largest_free"], 8)
+        self.assertRaises(InstError, addr_manager.request_subnet, 7)
+
+    def test_masks(self):
+        self.assertEqual(addr_manager.get_net_addr("172.30.5.1/12"), addr_manager.addr_to_binary("172.16.0.0"))
+        self.assertEqual(addr_manager.get_brd_addr("172.16.0.0/12"), addr_manager.addr_to_binary("172.31.255.255"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the clique_cover module can be imported.
+import sys, itertools
+sys.path.insert(0, 'src/')
+
+import networkx as nx
+
+from logical_to_topo import clique_cover, vlans
+from logical_to_topo.csr import csr
+from docker_virt_net.exceptions import InstError
+
+class TestCliqueCover(unittest.TestCase):
+    def assertCovers(self, graph, cliques):
+        covered = set()
+        for clique in cliques:
+            for u, v in itertools.combinations(clique, 2):
+                self.assertTrue(graph.has_edge(u, v))
+                covered.add(frozenset((u, v)))
+        self.assertEqual(covered, {frozenset((u, v)) for u, v in graph.edges() if u != v})
+        self.assertEqual({node for clique in cliques for node in clique}, set(graph.nodes()))
+
+    def test_engines(self):
+        graph = nx.gnp_random_graph(60, 0.3, seed = 1)
+        graph.add_node("isolated")
+        for mode in clique_cover.engines:
+            self.assertCovers(graph, clique_cover.cover(graph, mode))
+
+    def test_budget(self):
+        graph = nx.gnp_random_graph(60, 0.3, seed = 1)
+        self.assertCovers(graph, clique_cover.cover(graph, "greedy", budget = 0))
+
+    def test_self_loops(self):
+        graph = nx.Graph([('a', 'a'), ('a', 'b'), ('b', 'c'), ('a', 'c'), ('d', 'd')])
+        for mode in clique_cover.engines:
+            self.assertCovers(graph, clique_cover.cover(graph, mode, budget = 1))
+
+    def test_cost(self):
+        cliques = clique_cover.cover(nx.complete_graph(6))
+        self.assertEqual(clique_cover.cost(cliques), {"vlans": 1, "veths": 7, "bridges": 1, "addresses": 8})
+
+class TestVLANBudget(unittest.TestCase):
+    def test_too_many_cliques(self):
+        # Three disjoint edges take three VLANs: that's refused before anything is instantiated
+        graph = csr.from_nx(nx.Graph([("a", "b"), ("c", "d"), ("e", "f")]))
+        maxVLANs, vlans.maxVLANs = vlans.maxVLANs, 2
+        try:
+            with self.assertRaises(InstError):
+                vlans.instantiate_net(graph, False)
+        finally:
+            vlans.maxVLANs = maxVLANs
+
+if __name__ == '__main__':
+    unittest.main()
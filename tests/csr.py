@@ -0,0 +1,34 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the csr module can be imported.
+import sys
+sys.path.insert(0, 'src/')
+
+import networkx as nx
+
+from logical_to_topo.csr import csr
+
+class TestCSR(unittest.TestCase):
+    def test_undirected(self):
+        graph = csr.from_nx(nx.Graph([("a", "b"), ("b", "c"), ("c", "c")]))
+        self.assertEqual(list(graph), ["a", "b", "c"])
+        self.assertEqual(graph.number_of_edges(), 3)
+        self.assertEqual(graph.names[graph.neighbours(1)].tolist(), ["a", "c"])
+        self.assertEqual(sorted(graph.to_nx().edges()), [("a", "b"), ("b", "c"), ("c", "c")])
+
+    def test_directed(self):
+        graph = csr.from_nx(nx.DiGraph([("a", "b"), ("b", "a"), ("c", "a")]))
+        sources, destinations = graph.edges()
+        self.assertEqual(list(zip(sources.tolist(), destinations.tolist())), [("a", "b"), ("b", "a"), ("c", "a")])
+        self.assertEqual(graph.names[graph.neighbours(2)].tolist(), ["a"])
+
+    def test_relabel(self):
+        graph = csr.from_nx(nx.Graph([("1", "2")]))
+        relabeled = graph.relabel({"1": "001"})
+        self.assertEqual(list(relabeled), ["001", "2"])
+        self.assertIs(relabeled.indices, graph.indices)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the deployment_dag module can be imported.
+import sys, time
+sys.path.insert(0, 'src/')
+
+from docker_virt_net.deployment_dag import task_graph
+from docker_virt_net.exceptions import InstError, DckError
+
+class TestDeploymentDAG(unittest.TestCase):
+    def test_dependencies(self):
+        done, dag = [], task_graph()
+        dag.add("bridge", "bridge", lambda: done.append("bridge"))
+        dag.add("container", "container", lambda: (time.sleep(0.05), done.append("container")))
+        dag.add("veth", "veth", lambda: done.append("veth"), ["bridge", "container"])
+        dag.add("address", "address", lambda: done.append("address"), ["veth"])
+        dag.run(4)
+        self.assertEqual(done[-2:], ["veth", "address"])
+        self.assertEqual([t.name for t in dag.critical_path()], ["container", "veth", "address"])
+
+    def test_undefined_dependency(self):
+        dag = task_graph()
+        self.assertRaises(InstError, dag.add, "veth", "veth", lambda: None, ["bridge"])
+        dag.add("bridge", "bridge", lambda: None)
+        self.assertRaises(InstError, dag.add, "bridge", "bridge", lambda: None)
+
+    def test_failure(self):
+        def fail():
+            raise DckError("Docker engine error")
+
+        done, dag = [], task_graph()
+        dag.add("container", "container", fail)
+        dag.add("veth", "veth", lambda: done.append("veth"), ["container"])
+        with self.assertRaises(InstError) as ctx:
+            dag.run(2)
+        self.assertIn("@ step container", ctx.exception.cause)
+        self.assertEqual(done, [])
+
+    def test_unexpected_failure(self):
+        class journal:
+            def __init__(self):
+                self.steps = {}
+            def step_done(self, name, kind):
+                self.steps[name] = "done"
+            def step_failed(self, name, kind, cause):
+                self.steps[name] = cause
+
+        dag = task_graph(journal())
+        dag.add("bridge", "bridge", lambda: None)
+        dag.add("container", "container", lambda: {}["missing"], ["bridge"])
+        with self.assertRaises(KeyError):
+            dag.run(2)
+        self.assertEqual(dag.journal.steps, {"bridge": "done", "container": "KeyError: 'missing'"})
+
+    def test_retries(self):
+        attempts, undone = [], []
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise DckError("Docker engine error - timeout")
+
+        dag = task_graph()
+        dag.add("container", "container", flaky, undo = lambda: undone.append(1))
+        dag.run(2, retries = 2, backoff = 0)
+        self.assertEqual((len(attempts), len(undone)), (3, 2))
+
+    def test_resume(self):
+        done, undone, dag = [], [], task_graph()
+        dag.add("bridge", "bridge", lambda: done.append("bridge"), check = lambda: True)
+        dag.add("container", "container", lambda: done.append("container"),
+            undo = lambda: undone.append("container"), check = lambda: False)
+        dag.add("veth", "veth", lambda: done.append("veth"), ["bridge", "container"],
+            undo = lambda: undone.append("veth"))
+        dag.add("address", "address", lambda: done.append("address"), ["veth"])
+
+        # The container is gone: everything depending on it has to be run again
+        skip = dag.revalidate({"bridge": "done", "container": "done", "veth": "failed"})
+        self.assertEqual(skip, {"bridge"})
+        self.assertEqual(undone, ["container", "veth"])
+        dag.run(2, skip)
+        self.assertEqual(done, ["container", "veth", "address"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the docker_cnx module can be imported.
+import sys
+sys.path.insert(0, 'src/')
+
+from docker_virt_net import docker_cnx as dx
+from docker_virt_net import addr_manager
+from docker_virt_net.exceptions import DckError
+
+class TestRulesets(unittest.TestCase):
+    def setUp(self):
+        addr_manager.reset()
+        addr_manager.restore({"A": ["10.0.0.1/24"], "B": ["10.0.1.1/24"], "C": ["10.0.2.1/24"]})
+        self.fw_rules = {"POLICY": "DROP", "ACCEPT": [("A", "B", True)], "DROP": [("A", "C", False)]}
+
+    def test_ruleset(self):
+        self.fw_rules["ACCEPT"].append(("B", "A", False))
+        ruleset, rule_descs = dx._compile_ruleset(self.fw_rules, "FORWARD", [])
+        # B -> A is only installed once
+        self.assertEqual(ruleset.splitlines(), [
+            "*filter",
+            ":FORWARD DROP [0:0]",
+            "-A FORWARD -s 10.0.0.1 -d 10.0.1.1 -j ACCEPT",
+            "-A FORWARD -s 10.0.1.1 -d 10.0.0.1 -j ACCEPT",
+            "-A FORWARD -s 10.0.0.1 -d 10.0.2.1 -j DROP",
+            "COMMIT"
+        ])
+        self.assertEqual(rule_descs[2], "policy DROP")
+        self.assertEqual(rule_descs[5], "rule 10.0.0.1-10.0.2.1-DROP; FORWARD chain; filter table")
+
+        with self.assertRaises(DckError) as err:
+            dx._check_restore(1, b"iptables-restore: line 5 failed\n", rule_descs, r"line (\d+) failed")
+        self.assertEqual(err.exception.cause, f"Non-zero return code @ {rule_descs[5]}")
+        # Lines with no rule (e.g. COMMIT) fall back to the raw output
+        with self.assertRaises(DckError) as err:
+            dx._check_restore(1, b"iptables-restore: line 6 failed\n", rule_descs, r"line (\d+) failed")
+        self.assertEqual(err.exception.cause, "Non-zero return code - iptables-restore: line 6 failed")
+        dx._check_restore(0, b"", rule_descs, r"line (\d+) failed")
+
+    def test_ruleset_replace(self):
+        # Existing rules are kept unless replacing
+        self.assertEqual(dx._fw_payload(self.fw_rules, "FORWARD", [], "iptables", False)[2], ['iptables-restore', '--noflush'])
+        self.assertEqual(dx._fw_payload(self.fw_rules, "FORWARD", [], "iptables", True)[2], ['iptables-restore'])
+
+        # An empty nat table flushes the previous NAT rules when replacing, and only then
+        ruleset, _ = dx._compile_ruleset({}, "FORWARD", [], replace = True)
+        self.assertEqual(ruleset, "*nat\nCOMMIT\n")
+        ruleset, _ = dx._compile_ruleset(self.fw_rules, "FORWARD", [])
+        self.assertNotIn("*nat", ruleset)
+        ruleset, rule_descs = dx._compile_ruleset({}, "FORWARD", [("MASQUERADE", None), ("ACCEPT", "10.0.0.0/8")])
+        self.assertEqual(ruleset.splitlines(), ["*nat", "-A POSTROUTING -j MASQUERADE", "-A POSTROUTING -d 10.0.0.0/8 -j ACCEPT", "COMMIT"])
+        self.assertEqual(rule_descs[3], "rule any-10.0.0.0/8-ACCEPT; POSTROUTING chain; nat table")
+
+    def test_nft_ruleset(self):
+        ruleset, rule_descs = dx._compile_nft_ruleset(self.fw_rules, "FORWARD", [("MASQUERADE", None)])
+        lines = ruleset.splitlines()
+        self.assertEqual(lines[:3], ["table ip dvnet", "delete table ip dvnet", "table ip dvnet {"])
+        self.assertIn("\t\ttype filter hook forward priority 0; policy drop;", lines)
+        self.assertIn("\t\tip saddr . ip daddr @accept_pairs accept", lines)
+        self.assertIn("\t\ttype nat hook postrouting priority 100; policy accept;", lines)
+        self.assertIn("\t\tmasquerade", lines)
+
+        # Sets hold both directions of bidirectional rules
+        accept = lines[lines.index("\tset accept_pairs {") + 3:lines.index("\tset drop_pairs {") - 2]
+        self.assertEqual(accept, ["\t\t\t10.0.0.1 . 10.0.1.1,", "\t\t\t10.0.1.1 . 10.0.0.1"])
+
+        # Descriptions are keyed by 1-based line numbers, as nft(8) reports them
+        self.assertEqual(sorted(rule_descs), [7, 8, 14, 18, 24])
+        self.assertEqual(lines[14 - 1], "\t\t\t10.0.0.1 . 10.0.2.1")
+        self.assertEqual(rule_descs[14], "rule 10.0.0.1-10.0.2.1-DROP; FORWARD chain; dvnet table")
+        self.assertEqual(rule_descs[18], "policy DROP")
+        self.assertEqual(rule_descs[24], "rule any-any-MASQUERADE; postrouting chain; dvnet table")
+
+        failed_line = dx._fw_payload(self.fw_rules, "FORWARD", [], "nftables", False)[4]
+        with self.assertRaises(DckError) as err:
+            dx._check_restore(1, b"/tmp/dvnet.nft:14:4-25: Error: Could not process rule\n", rule_descs, failed_line)
+        self.assertEqual(err.exception.cause, f"Non-zero return code @ {rule_descs[14]}")
+
+    def test_nft_no_nat(self):
+        ruleset, _ = dx._compile_nft_ruleset(self.fw_rules, "FORWARD", [])
+        self.assertNotIn("postrouting", ruleset)
+        self.assertTrue(ruleset.endswith("}\n"))
+
+    def test_nft_allow_traffic(self):
+        cmd = dx._allow_traffic_cmd("nftables", '-d', "192.168.0.2")
+        self.assertEqual(cmd[0], "nft")
+        self.assertIn("insert rule ip dvnet forward ip daddr 192.168.0.2 accept", cmd[1])
+        self.assertNotIn("policy", cmd[1])
+
+if __name__ == '__main__':
+    unittest.main()
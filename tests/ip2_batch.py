@@ -0,0 +1,111 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the ip2_api package can be imported.
+import sys, os
+sys.path.insert(0, 'src/')
+
+from ip2_api.exceptions import IP2Error
+import ip2_api.link as iplink
+import ip2_api.addr as ipaddr
+import ip2_api.batch as ipbatch
+import ip2_api.utils as iputils
+
+class TestIproute2Batch(unittest.TestCase):
+    def test_batched_veths(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        with ipbatch.batch() as b:
+            iplink.veth.create("foo", "faa")
+            iplink.veth.activate("foo")
+            ipaddr.assign("foo", "10.0.0.1/24")
+            # Nothing should have been run yet
+            self.assertEqual(len(b.ops), 3)
+            self.assertFalse(os.path.exists("/sys/class/net/foo"))
+        iplink.veth.remove("foo")
+        self.assertRaises(IP2Error, iplink.veth.remove, "faa")
+
+    def test_failing_line(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        try:
+            with ipbatch.batch():
+                iplink.veth.create("foo", "faa")
+                iplink.veth.activate("fuu")
+                iplink.veth.remove("foo")
+        except IP2Error as err:
+            self.assertIn("line 2", err.cause)
+            self.assertIn("Error activating veth fuu", err.cause)
+        else:
+            self.fail("The batch should have failed")
+        # The command following the failing one is never run
+        iplink.veth.remove("foo")
+
+    def test_forced_batch(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        try:
+            with ipbatch.batch(force = True):
+                iplink.bridge.remove("foo_brd")
+                iplink.bridge.create("faa_brd")
+                iplink.bridge.remove("fii_brd")
+        except IP2Error as err:
+            self.assertEqual(len(err.cause.splitlines()), 2)
+            self.assertIn("line 1", err.cause)
+            self.assertIn("line 3", err.cause)
+        else:
+            self.fail("The batch should have failed")
+        iplink.bridge.remove("faa_brd")
+
+    def test_after_flush(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        flushed = []
+        ipbatch.after_flush(lambda: flushed.append("now"))
+        with ipbatch.batch():
+            iplink.bridge.create("foo_brd")
+            ipbatch.after_flush(lambda: flushed.append("foo_brd"))
+            self.assertEqual(flushed, ["now"])
+        self.assertEqual(flushed, ["now", "foo_brd"])
+
+        # Nothing is reported as done when the batch fails
+        with self.assertRaises(IP2Error):
+            with ipbatch.batch():
+                iplink.bridge.remove("foo_brd")
+                iplink.bridge.remove("foo_brd")
+                ipbatch.after_flush(lambda: flushed.append("gone"))
+        self.assertEqual(flushed, ["now", "foo_brd"])
+
+    def test_provisioned_veth(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        iplink.bridge.create("foo_brd")
+        try:
+            with ipbatch.batch() as b:
+                iplink.veth.provision("foo", "faa", peer_master = "foo_brd")
+                # Creating the pair and setting its peer up are two commands
+                self.assertEqual(len(b.ops), 2)
+            with open("/sys/class/net/faa/flags") as flags:
+                self.assertTrue(int(flags.read(), 16) & 0x1)
+            self.assertEqual(os.path.realpath("/sys/class/net/faa/master"), os.path.realpath("/sys/class/net/foo_brd"))
+        finally:
+            iplink.bridge.remove("foo_brd")
+            iplink.veth.remove("foo")
+
+    def test_netlink_backend(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        # Nothing is queued: calls go straight to the kernel
+        iputils.use_backend("netlink")
+        try:
+            with ipbatch.batch() as b:
+                iplink.bridge.create("foo_brd")
+                self.assertEqual(len(b.ops), 0)
+                self.assertTrue(os.path.exists("/sys/class/net/foo_brd"))
+            iplink.bridge.remove("foo_brd")
+        finally:
+            iputils.use_backend("iproute2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the ip2_api package can be imported.
+import sys, os, subprocess
+sys.path.insert(0, 'src/')
+
+from ip2_api.exceptions import IP2Error
+import ip2_api.link as iplink
+import ip2_api.addr as ipaddr
+import ip2_api.route as ipr
+import ip2_api.utils as iputil
+import ip2_api.netlink as netlink
+
+class TestNetlinkBackend(unittest.TestCase):
+    def setUp(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+        iputil.use_backend("netlink")
+
+    def tearDown(self):
+        iputil.use_backend("iproute2")
+
+    def test_veths(self):
+        self.assertRaises(IP2Error, iplink.veth.remove, "foo")
+        self.assertRaises(IP2Error, iplink.veth.activate, "foo")
+        iplink.veth.create("foo", "faa")
+        self.assertRaises(IP2Error, iplink.veth.create, "foo", "faa")
+        iplink.veth.activate("foo")
+        iplink.veth.activate("faa")
+        iplink.veth.remove("foo")
+        self.assertRaises(IP2Error, iplink.veth.remove, "faa")
+
+    def test_bridges(self):
+        self.assertRaises(IP2Error, iplink.bridge.remove, "foo_brd")
+        iplink.bridge.create("foo_brd")
+        iplink.bridge.activate("foo_brd")
+        iplink.bridge.remove("foo_brd")
+        self.assertRaises(IP2Error, iplink.bridge.remove, "foo_brd")
+
+    def test_netns(self):
+        subprocess.run(['ip', 'netns', 'add', 'foo_ns'], check = True)
+        try:
+            iplink.bridge.create("foo_brd")
+            iplink.veth.create("foo", "faa")
+            iplink.veth.connect("foo_ns", "foo")
+            iplink.veth.activate("foo", netns = "foo_ns")
+            iplink.veth.connect("foo_brd", "faa", host = False)
+            ipaddr.assign("foo", "10.0.0.1/24", netns = "foo_ns")
+            ipr.assign("default", "10.0.0.254", netns = "foo_ns")
+            ipr.assign("10.1.0.0/16", "10.0.0.254", netns = "foo_ns")
+            routes = subprocess.run(['ip', '-n', 'foo_ns', 'route'], capture_output = True, text = True).stdout
+            self.assertIn("default via 10.0.0.254", routes)
+            self.assertIn("10.1.0.0/16 via 10.0.0.254", routes)
+            ipr.assign("10.2.0.0/16", None, netns = "foo_ns", table = 1000, dev = "foo")
+            ipr.assign("10.3.0.0/16", "10.0.0.254", netns = "foo_ns", table = 1000, dev = "foo")
+            routes = subprocess.run(['ip', '-n', 'foo_ns', 'route', 'show', 'table', '1000'], capture_output = True, text = True).stdout
+            self.assertIn("10.2.0.0/16 dev foo scope link", routes)
+            self.assertIn("10.3.0.0/16 via 10.0.0.254 dev foo", routes)
+            ipr.remove("10.1.0.0/16", "10.0.0.254", netns = "foo_ns")
+            self.assertRaises(IP2Error, ipr.remove, "10.1.0.0/16", "10.0.0.254", netns = "foo_ns")
+            ipaddr.reset("foo", netns = "foo_ns")
+            iplink.macvlan.create("foo_mv", "foo_brd", netns = "foo_ns")
+            self.assertTrue(iplink.veth.exists("foo_mv", "foo_ns"))
+            self.assertRaises(IP2Error, iplink.macvlan.create, "foo_mv", "foo_brd", netns = "foo_ns")
+            self.assertRaises(IP2Error, ipaddr.assign, "faa", "10.0.0.1/24", netns = "foo_ns")
+            iplink.veth.provision("fee", "fii", netns = "foo_ns", peer_master = "foo_brd", cidr_block = "10.0.1.1/24")
+            link = subprocess.run(['ip', 'link', 'show', 'fii'], capture_output = True, text = True).stdout
+            self.assertIn("master foo_brd", link)
+            self.assertIn(",UP", link)
+            addrs = subprocess.run(['ip', '-n', 'foo_ns', 'addr', 'show', 'fee'], capture_output = True, text = True).stdout
+            self.assertIn("10.0.1.1/24", addrs)
+            self.assertIn(",UP", addrs)
+            # Point-to-point links have both ends on a netns of their own
+            subprocess.run(['ip', 'netns', 'add', 'faa_ns'], check = True)
+            iplink.veth.provision("fuu", "fyy", netns = "foo_ns", peer_netns = "faa_ns")
+            self.assertIn(",UP", subprocess.run(['ip', '-n', 'foo_ns', 'link', 'show', 'fuu'], capture_output = True, text = True).stdout)
+            self.assertIn(",UP", subprocess.run(['ip', '-n', 'faa_ns', 'link', 'show', 'fyy'], capture_output = True, text = True).stdout)
+            self.assertRaises(IP2Error, iplink.veth.provision, "fuu", "fyy", netns = "foo_ns", peer_netns = "faa_ns")
+        finally:
+            iplink.bridge.remove("foo_brd")
+            iplink.veth.remove("foo", netns = "foo_ns")
+            subprocess.run(['ip', 'netns', 'del', 'foo_ns'])
+            subprocess.run(['ip', 'netns', 'del', 'faa_ns'], stderr = subprocess.DEVNULL)
+            netlink.forget("faa_ns")
+
+    def test_evicted_socket(self):
+        # A socket handed out right before another thread evicts it
+        stale, get_socket = netlink._get_socket(None), netlink._get_socket
+        netlink.forget(None)
+        handed = [stale]
+        netlink._get_socket = lambda netns: handed.pop() if handed else get_socket(netns)
+        try:
+            self.assertTrue(iplink.bridge.exists("lo"))
+        finally:
+            netlink._get_socket = get_socket
+
+    def test_utils(self):
+        iputil.alter_ipv4_forwarding()
+        iputil.restore_ipv4_forwarding()
+        iputil.create_netns_dir()
+
+if __name__ == "__main__":
+    unittest.main()
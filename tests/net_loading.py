@@ -0,0 +1,39 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the net_loading module can be imported.
+import sys, os, tempfile
+sys.path.insert(0, 'src/')
+
+import networkx as nx
+
+from logical_to_topo import net_loading
+
+class TestNetLoading(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        net_loading.cache_dir = os.path.join(self.tmp.name, "cache")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_gexf(self):
+        path = "src/logical_to_topo/sample_graphs/graph_3.gexf"
+        reference = nx.read_gexf(path)
+        for _ in range(2):
+            graph = net_loading.loadGexf(path, False).to_nx()
+            self.assertEqual(list(graph.nodes()), list(reference.nodes()))
+            self.assertEqual({frozenset(edge) for edge in graph.edges()}, {frozenset(edge) for edge in reference.edges()})
+        self.assertEqual(len(os.listdir(net_loading.cache_dir)), 1)
+
+    def test_edge_list(self):
+        path = os.path.join(self.tmp.name, "net.csv")
+        with open(path, "w") as f:
+            f.write("a, b, 1\nb,c,2\na,b,1\nc,a,3\n")
+        graph = net_loading.loadEdgeList(path, True, ["weight"], chunksize = 2).to_nx()
+        self.assertEqual(sorted(graph.edges(data = "weight")), [("a", "b", 1), ("b", "c", 2), ("c", "a", 3)])
+        self.assertEqual(net_loading.loadEdgeList(os.path.join(self.tmp.name, "missing.csv"), False), None)
+
+if __name__ == '__main__':
+    unittest.main()
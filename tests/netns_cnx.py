@@ -0,0 +1,55 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the netns_cnx module can be imported.
+import sys, os, io, tarfile
+sys.path.insert(0, 'src/')
+
+from docker_virt_net import netns_cnx as nns
+from docker_virt_net import docker_cnx as dx
+from docker_virt_net.exceptions import DckError
+
+class TestNetnsNodes(unittest.TestCase):
+    def setUp(self):
+        if not os.geteuid() == 0:
+            self.fail("These tests must be run as root!")
+
+    def tearDown(self):
+        if nns.container_running("dvnet_test"):
+            nns.remove_container("dvnet_test", graceful = False)
+
+    def test_images(self):
+        self.assertTrue(nns.is_image(nns.image()))
+        self.assertEqual(nns.command(nns.image("sleep infinity")), "sleep infinity")
+        self.assertEqual(nns.command(nns.image()), None)
+        self.assertFalse(nns.is_image("pcollado/d_host"))
+
+    def test_lifecycle(self):
+        nns.run_container("dvnet_test", dx.types.router, "sleep 60")
+        self.assertTrue(nns.container_running("dvnet_test"))
+        self.assertRaises(DckError, nns.run_container, "dvnet_test", dx.types.router)
+        self.assertEqual(nns.exec_run("dvnet_test", ['sysctl', '-n', 'net.ipv4.ip_forward']), (0, b"1\n"))
+
+        nns.remove_container("dvnet_test", graceful = False)
+        self.assertFalse(nns.container_running("dvnet_test"))
+        self.assertRaises(DckError, nns.remove_container, "dvnet_test")
+
+    def test_files(self):
+        nns.run_container("dvnet_test", dx.types.host)
+        tar_buff = io.BytesIO()
+        with tarfile.open(mode = 'w', fileobj = tar_buff) as t_file:
+            tinfo = tarfile.TarInfo("extra_hosts")
+            tinfo.size = len(b"10.0.0.1 foo\n")
+            t_file.addfile(tinfo, io.BytesIO(b"10.0.0.1 foo\n"))
+        nns.upload_file("dvnet_test", "/etc", tar_buff.getvalue())
+        nns.append_file_to_file("dvnet_test", "/etc/extra_hosts", "/etc/hosts")
+
+        # The host's /etc/hosts is left alone
+        _, output = nns.exec_run("dvnet_test", ['cat', '/etc/hosts'])
+        self.assertTrue(output.endswith(b"10.0.0.1 foo\n"))
+        with open("/etc/hosts", 'rb') as hosts:
+            self.assertNotIn(b"10.0.0.1 foo", hosts.read())
+
+if __name__ == '__main__':
+    unittest.main()
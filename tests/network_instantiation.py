@@ -0,0 +1,200 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the network_instantiation module can be imported.
+import sys, ipaddress, copy
+import networkx as nx
+sys.path.insert(0, 'src/')
+
+from docker_virt_net import network_instantiation as ni
+from docker_virt_net import addr_manager, config_parser
+from docker_virt_net import docker_cnx as dx
+from docker_virt_net.exceptions import DckError
+
+def _next_hop(table, addr):
+    # Longest prefix matching over a (destination, gateway) table
+    addr = ipaddress.ip_address(addr)
+    routes = [(ipaddress.ip_network("0.0.0.0/0" if dest == 'default' else dest), gw) for dest, gw in table]
+    matching = [(net.prefixlen, gw) for net, gw in routes if addr in net]
+    return max(matching)[1] if matching else None
+
+class TestRouteSummaries(unittest.TestCase):
+    def assertSameForwarding(self, table, summary, probes):
+        for addr in probes:
+            self.assertEqual(_next_hop(table, addr), _next_hop(summary, addr), addr)
+
+    def test_collapse(self):
+        prefixes = [ni._prefix(dest) for dest in ["10.0.0.0/26", "10.0.0.64/26", "10.0.0.128/25", "10.0.2.0/24"]]
+        self.assertEqual(sorted(ni._collapse(prefixes)), sorted([ni._prefix("10.0.0.0/24"), ni._prefix("10.0.2.0/24")]))
+        self.assertEqual(ni._collapse([ni._prefix("10.0.1.0/24")]), [ni._prefix("10.0.1.0/24")])
+
+    def test_summary(self):
+        table = [("default", "A"), ("10.0.0.0/25", "A"), ("10.0.0.128/25", "B"), ("10.0.1.0/25", "B"), ("10.0.1.128/25", "B")]
+        summary = ni._summarize_route_table(table)
+        self.assertEqual(sorted(summary), [("10.0.0.128/25", "B"), ("10.0.1.0/24", "B"), ("default", "A")])
+        self.assertSameForwarding(table, summary, ["10.0.0.1", "10.0.0.200", "10.0.1.1", "10.0.1.200", "8.8.8.8"])
+
+    def test_colliding_supernets(self):
+        table = [("10.0.0.0/25", "A"), ("10.0.0.128/25", "A"), ("10.0.0.0/24", "B")]
+        for ordered in [table, table[::-1]]:
+            summary = ni._summarize_route_table(ordered)
+            self.assertSameForwarding(ordered, summary, ["10.0.0.1", "10.0.0.200"])
+            self.assertEqual(_next_hop(summary, "10.0.0.200"), "A")
+
+        # Both gateways collapse into the same supernet
+        table = [("10.0.0.0/25", "A"), ("10.0.0.128/25", "A")] + [(f"10.0.0.{i * 64}/26", "B") for i in range(4)]
+        for ordered in [table, table[::-1]]:
+            summary = ni._summarize_route_table(ordered)
+            self.assertSameForwarding(ordered, summary, ["10.0.0.1", "10.0.0.100", "10.0.0.200"])
+
+def _conf():
+    return {
+        "name": "test", "internet_access": False, "host_image": "h_img", "router_image": "r_img",
+        "subnets": {
+            "A": {"address": "10.0.0.0/24", "hosts": ["A-1", "A-2"]},
+            "B": {"address": "10.0.1.0/24", "hosts": ["B-1"]}
+        },
+        "routers": {
+            "R-1": {"subnets": ["A", "B"], "fw_rules": {"POLICY": "DROP", "ACCEPT": [["A-1", "B-1", True]], "DROP": []}},
+            "R-2": {"subnets": ["A"], "fw_rules": {}}
+        }
+    }
+
+def _snapshot(conf):
+    # What state.deployment_state.snapshot() holds once `conf` is deployed
+    snap = {'containers': {}, 'bridges': set(), 'veths': {}, 'addresses': {}, 'routes': {}, 'conf': copy.deepcopy(conf)}
+    addr_manager.reset()
+    for name, (type, img, attachments) in ni._desired_nodes(conf).items():
+        snap['containers'][name] = (type, img)
+        for bridge, subnet_addr in attachments:
+            snap['bridges'].add(bridge)
+            snap['veths'][(name, bridge)] = ni._veth_names(name, bridge)
+            snap['addresses'].setdefault(name, []).append(addr_manager.request_ip(subnet_addr, name))
+    addr_manager.reset()
+    return snap
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.conf = _conf()
+        self.snapshot = _snapshot(self.conf)
+
+    def test_unchanged(self):
+        live, stale = ni._diff_deployment(self.conf, self.snapshot)
+        self.assertEqual(live['stable'], set(self.snapshot['containers']))
+        self.assertEqual(len(live['attachments']), len(self.snapshot['veths']))
+        self.assertEqual(stale, {'containers': [], 'bridges': [], 'veths': [], 'addresses': []})
+        for router in self.conf['routers']:
+            self.assertFalse(ni._firewall_changed(router, self.conf, {}, live))
+
+    def test_new_host(self):
+        self.conf['subnets']['A']['hosts'].append("A-3")
+        live, stale = ni._diff_deployment(self.conf, self.snapshot)
+        self.assertNotIn("A-3", live['containers'])
+        self.assertEqual(live['stable'], set(self.snapshot['containers']))
+        self.assertEqual(stale['veths'], [])
+        # Kept addresses are restored: the new host doesn't get any of them
+        self.assertEqual(addr_manager.request_ip("10.0.0.0/24", "A-3"), "10.0.0.5/24")
+        self.assertEqual(addr_manager.owner("10.0.0.1"), "A-1")
+
+    def test_renumbered_subnet(self):
+        self.conf['subnets']['B']['address'] = "10.0.2.0/24"
+        live, stale = ni._diff_deployment(self.conf, self.snapshot)
+        # Everything is kept but the attachments to B, which are made anew
+        self.assertEqual(live['containers'], set(self.snapshot['containers']))
+        self.assertEqual(live['bridges'], {"A_brd", "B_brd"})
+        self.assertEqual(sorted(live['attachments']), [("A-1", "A_brd"), ("A-2", "A_brd"), ("R-1", "A_brd"), ("R-2", "A_brd")])
+        self.assertEqual(sorted(node for node, _, _ in stale['veths']), ["B-1", "R-1"])
+        self.assertEqual(sorted(stale['addresses']), [("B-1", "10.0.1.1/24"), ("R-1", "10.0.1.2/24")])
+        self.assertEqual(live['stable'], {"A-1", "A-2", "R-2"})
+        # R-1's rules refer to B-1, whose address changes
+        self.assertTrue(ni._firewall_changed("R-1", self.conf, {}, live))
+        self.assertFalse(ni._firewall_changed("R-2", self.conf, {}, live))
+
+    def test_firewall_rules(self):
+        self.conf['routers']['R-2']['fw_rules'] = {"POLICY": "ACCEPT", "ACCEPT": [], "DROP": [["A-1", "A-2", False]]}
+        live, stale = ni._diff_deployment(self.conf, self.snapshot)
+        self.assertEqual(live['stable'], set(self.snapshot['containers']))
+        self.assertTrue(ni._firewall_changed("R-2", self.conf, {}, live))
+        self.assertFalse(ni._firewall_changed("R-1", self.conf, {}, live))
+        # Gaining NAT rules changes the firewall as well
+        self.assertTrue(ni._firewall_changed("R-1", self.conf, {"R-1": [("MASQUERADE", None)]}, live))
+
+    def test_attachment_mode(self):
+        self.conf['attachment_mode'] = "macvlan"
+        live, stale = ni._diff_deployment(self.conf, self.snapshot)
+        # Hosts are attached anew but keep running; routers are left alone
+        self.assertEqual(live['containers'], set(self.snapshot['containers']))
+        self.assertEqual(sorted(live['attachments']), [("R-1", "A_brd"), ("R-1", "B_brd"), ("R-2", "A_brd")])
+        self.assertEqual(sorted(node for node, _, _ in stale['veths']), ["A-1", "A-2", "B-1"])
+        self.assertEqual(live['stable'], {"R-1", "R-2"})
+
+        # Back to veths once macvlan is recorded
+        self.snapshot['conf']['attachment_mode'] = "macvlan"
+        live, stale = ni._diff_deployment(_conf(), self.snapshot)
+        self.assertEqual(sorted(node for node, _, _ in stale['veths']), ["A-1", "A-2", "B-1"])
+
+def _route_tables(dag):
+    return {name.split(':')[1]: t.fn.args[1] for name, t in dag.tasks.items() if t.kind == "route"}
+
+class TestRoutingTables(unittest.TestCase):
+    def setUp(self):
+        addr_manager.reset()
+        self.conf = {**config_parser.optional_confs, **_conf(), "internet_access": True}
+        self.get_default_net_data = dx.get_default_net_data
+
+    def tearDown(self):
+        dx.get_default_net_data = self.get_default_net_data
+        addr_manager.reset()
+
+    def test_uplink(self):
+        dx.get_default_net_data = lambda: ("docker0", "172.17.0.1", "172.17.0.0/16")
+        tables = _route_tables(ni._compile_deployment(self.conf, config_parser.build_graph(self.conf)))
+        self.assertIn(("default", "172.17.0.1"), tables["R-1"])
+        self.assertEqual(_next_hop(tables["B-1"], "8.8.8.8"), addr_manager.name_2_ip("R-1", 1).split('/')[0])
+
+    def test_no_uplink(self):
+        def _no_uplink():
+            raise DckError("There's no docker engine")
+        dx.get_default_net_data = _no_uplink
+        with self.assertLogs(ni.log, "WARNING"):
+            tables = _route_tables(ni._compile_deployment(self.conf, config_parser.build_graph(self.conf)))
+        # Nothing would take traffic out of the first router: it'd be black-holed
+        for node, table in tables.items():
+            self.assertIsNone(_next_hop(table, "8.8.8.8"), node)
+
+    def test_next_hops(self):
+        # A ring of subnets, each with a host and a router linking it to the next one
+        conf = {
+            "name": "ring", "internet_access": True, "private_routing": True,
+            "subnets": {f"S{i}": {"address": f"10.0.{i}.0/24", "hosts": [f"H-{i}"]} for i in range(5)},
+            "routers": {f"R-{i}": {"subnets": [f"S{i}", f"S{(i + 1) % 5}"], "fw_rules": {}} for i in range(5)}
+        }
+        graph = config_parser.build_graph(conf)
+        # Gateways come out as the (router, bridge) they're reached through
+        attach_ips = {
+            (node, bridge): (node, bridge) for edge in graph.edges() for node, bridge in [edge, edge[::-1]]
+                if graph.nodes[bridge]['type'] == "bridge"
+        }
+        tables = ni._routing_tables(conf, graph, attach_ips)
+
+        targets = {config['address']: subnet + "_brd" for subnet, config in conf['subnets'].items()}
+        targets['default'] = "R-0"
+        for dest, target in targets.items():
+            # What the original implementation did: the first router along each shortest path
+            paths, lengths = nx.shortest_path(graph, target = target), nx.shortest_path_length(graph, target = target)
+            for source, path in paths.items():
+                if graph.nodes[source]['type'] == "bridge":
+                    continue
+                gw = dict(tables.get(source, [])).get(dest)
+                if len(path) <= 2:
+                    self.assertIsNone(gw, (source, dest))
+                    continue
+                if gw != (path[2], path[1]):
+                    # Paths as short are as good: the gateway must be on one of them
+                    router, bridge = gw
+                    self.assertTrue(graph.has_edge(source, bridge) and graph.has_edge(bridge, router), (source, dest))
+                    self.assertEqual(lengths[router], lengths[source] - 2, (source, dest))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the placement module can be imported.
+import sys
+sys.path.insert(0, 'src/')
+
+from logical_to_topo import placement
+
+class TestPlacement(unittest.TestCase):
+    def test_attachments(self):
+        bridgeOf = placement.place_attachments([["a", "b", "c"], ["c", "d"], ["e", "f", "g", "h", "i"]], capacity = 5)
+        self.assertEqual(bridgeOf, [[1, 1, 1], [1, 1], [0, 0, 0, 0, 0]])
+        self.assertEqual(placement.trunk_load(bridgeOf), {0: [], 1: []})
+
+    def test_hosts(self):
+        # Two triangles joined by a single edge: only the bridging VLAN should span both bridges
+        cliques = [["a", "b", "c"], ["d", "e", "f"], ["c", "d"]]
+        bridgeOf = placement.place_hosts(cliques, capacity = 3)
+        self.assertEqual(bridgeOf[0], [bridgeOf[0][0]] * 3)
+        self.assertEqual(bridgeOf[1], [bridgeOf[1][0]] * 3)
+        self.assertEqual(placement.trunk_load(bridgeOf), {0: [2], 1: [2]})
+
+if __name__ == '__main__':
+    unittest.main()
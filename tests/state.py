@@ -0,0 +1,58 @@
+import unittest
+
+# As our project contains several packages under ../src
+    # we are adding said directory to python's path so
+    # that the state module can be imported.
+import sys, tempfile
+sys.path.insert(0, 'src/')
+
+from docker_virt_net import state
+from docker_virt_net.exceptions import StateError
+
+class TestDeploymentState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        state.state_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_record_and_load(self):
+        recorded = state.create("net", "docker_virt_net", {"name": "net", "max_workers": 4})
+        recorded.add_bridge("A_brd")
+        recorded.add_container("A-1", 0, "pcollado/d_host")
+        recorded.add_veth("A-1", "A_brd", "A-1-A_brd", "A_brd-A-1")
+        recorded.add_addresses({"A-1": ["10.0.0.1/24"]})
+        recorded.add_route("A-1", "default", "10.0.0.254")
+        recorded.add_netns("A-1", "/var/run/netns/A-1")
+        recorded.add_netns("influxdb", "/var/run/netns/influxdb")
+        recorded.close()
+
+        recorded = state.load("net")
+        self.assertEqual(recorded.instances(), {'bridges': ["A_brd"], 'containers': ["A-1"], 'netns': ["influxdb"]})
+        self.assertEqual(recorded.get_meta('conf')['max_workers'], 4)
+        self.assertEqual(recorded.summary()['routes'], 1)
+        self.assertEqual(recorded.node_details("A-1")['addresses'], ["10.0.0.1/24"])
+        recorded.drop()
+        self.assertFalse(state.exists("net"))
+
+    def test_route_tables(self):
+        recorded = state.create("net", "docker_virt_net")
+        recorded.add_routes("A-1", [("default", "10.0.0.254"), ("10.0.1.0/24", "10.0.0.253"), ("10.0.2.0/24", "10.0.0.253")])
+        # The last route to a destination wins
+        recorded.add_routes("A-1", [("10.0.1.0/24", "10.0.0.252")])
+        self.assertEqual(
+            recorded.snapshot()['routes'],
+            {"A-1": {"default": "10.0.0.254", "10.0.1.0/24": "10.0.0.252", "10.0.2.0/24": "10.0.0.253"}}
+        )
+        recorded.remove_routes("A-1", ["10.0.1.0/24", "10.0.2.0/24"])
+        self.assertEqual(recorded.snapshot()['routes'], {"A-1": {"default": "10.0.0.254"}})
+        recorded.drop()
+
+    def test_existing_deployment(self):
+        state.create("net", "logical_to_topo").close()
+        self.assertRaises(StateError, state.create, "net", "logical_to_topo")
+        self.assertRaises(StateError, state.load, "other")
+
+if __name__ == "__main__":
+    unittest.main()